@@ -33,6 +33,7 @@ Main entry point to scipion. It launches the gui, tests, etc.
 import subprocess
 import sys
 import os
+import re
 from os.path import join, exists, expanduser, expandvars
 
 from configparser import ConfigParser
@@ -40,7 +41,9 @@ from threading import Thread
 
 from scipion.constants import *
 from scipion.utils import (getScipionHome, getInstallPath,
-                           getScriptsPath, getTemplatesPath, getModuleFolder)
+                           getScriptsPath, getTemplatesPath, getModuleFolder,
+                           getVarsCacheFile, loadVarsCache, saveVarsCache,
+                           getEnvironKey, runPythonInProcess)
 from scipion.scripts.config import getConfigPathFromConfigFile, HOSTS
 from scipion.constants import MODE_UPDATE
 from scipion import __version__
@@ -62,9 +65,12 @@ def printVersion():
     print('Scipion %s' % getVersion())
 
 
-def config2Dict(configFile, varDict):
+def config2Dict(configFile, varDict, usedNames=None):
     """ Loads a config file if exists and populates a dictionary
     overwriting the keys.
+
+    :param usedNames: Optional, set where the names of the environment
+        variables the values depend on are added
     """
     # If config file exists
     if exists(configFile):
@@ -81,6 +87,9 @@ def config2Dict(configFile, varDict):
 
                 # Give priority to environment variables
                 varDict[variable] = os.environ.get(variable, default=expandvars(cleanValue).strip())
+                if usedNames is not None:
+                    usedNames.add(variable)
+                    usedNames.update(re.findall(r'\$\{?(\w+)', cleanValue))
 
     return varDict
 
@@ -97,39 +106,66 @@ def getMode():
 
 # Auxiliary functions to run commands in our environment, one of our
 # scripts, or one of our "apps"
-def runCmd(cmd, args=''):
-    """ Runs ANY command with its arguments"""
-    if isinstance(args, list):
-        args = ' '.join('"%s"' % x for x in args)
-
-    cmd = '%s %s' % (cmd, args)
-
+def execCmd(args):
+    """ Replaces this process by the command (list with the program and its
+    arguments) in our environment, without a shell in between, so it gets
+    the signals and no launcher is kept alive. """
     os.environ.update(VARS)
-    # result = os.system(cmd)
-    # Replacement of os.system with subprocess.call(cmd, shell=True)
-    result = subprocess.call(cmd, shell=True)
-    sys.exit(result)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if os.name == 'nt':  # exec does not replace the process on Windows
+        sys.exit(subprocess.call(args))
+    try:
+        os.execvpe(args[0], args, os.environ)
+    except OSError as e:
+        sys.exit('Could not run %s: %s' % (args[0], e))
 
 
 # The following functions require a working SCIPION_PYTHON
-def runScript(scriptCmd, args='', chdir=True):
-    """"Runs a PYTHON script appending the profiling prefix if ON"""
+def runPython(args, chdir=True):
+    """ Runs SCIPION_PYTHON with args, with the profiling prefix if ON """
     if chdir:
         os.chdir(Vars.SCIPION_HOME)
 
-    if envOn('SCIPION_PROFILE'):
-        profileStr = '-m cProfile -o output.profile'
-    else:
-        profileStr = ''
-    cmd = '%s %s %s' % (Vars.SCIPION_PYTHON, profileStr, scriptCmd)
-    runCmd(cmd, args)
+    if IN_SERVER:
+        # pyworkflow and the plugins are already loaded here
+        os.environ.update(VARS)
+        if runPythonInProcess(list(args)):
+            sys.exit(0)
+
+    execCmd([Vars.SCIPION_PYTHON] + getProfileArgs() + list(args))
 
 
-def runApp(app, args='', chdir=True):
+def getProfileArgs():
+    """ Returns the python arguments to profile a script, if SCIPION_PROFILE is set """
+    if not os.environ.get('SCIPION_PROFILE'):
+        return []
+    from scipion.profiling import getProfileKind
+    return ['-m', 'scipion.profiling', 'run', '--mode', getMode(), '--'] if getProfileKind() else []
+
+
+def runScript(scriptCmd, args=(), chdir=True):
+    """"Runs a PYTHON script appending the profiling prefix if ON"""
+    runPython([scriptCmd] + list(args), chdir=chdir)
+
+
+def runApp(app, args=(), chdir=True):
     """Runs an app provided by pyworkflow"""
     runScript(join(Vars.PW_APPS, app), args=args, chdir=chdir)
 
 
+def runServerChild(argv):
+    """ Runs scipion with argv in a child of the scipion server """
+    global IN_SERVER, cachedVars
+    IN_SERVER = True
+    cachedVars = VARS
+    # Do not go on with the profile of the server, if any
+    from scipion import profiling
+    profiling.reset()
+    sys.argv = sys.argv[:1] + list(argv)
+    main()
+
+
 # ***************** END FUNCTIONS *****************************************
 
 # Get Scipion home
@@ -195,7 +231,19 @@ class Vars:
     SCIPION_PRIORITY_PACKAGE_LIST = "pwem tomo pwchem"
 
 
+# *********************** WARM SERVER ***********************
+# Whether this is a child of the scipion server
+IN_SERVER = False
+
+if getMode() in SERVER_MODES and envOn('SCIPION_SERVER'):
+    # Run by the server started with the same config files, if any
+    from scipion.server import runInServer, getServerSocket
+    runInServer(getServerSocket([Vars.SCIPION_CONFIG, Vars.SCIPION_LOCAL_CONFIG]), sys.argv[1:])
+
+
 # *********************** READ CONFIG FILES ***********************
+VARS_CACHE = None
+cachedVars = None
 try:
     VARS = dict()
 
@@ -215,12 +263,26 @@ try:
     VARS['SCIPION_VERSION'] = Vars.SCIPION_VERSION
     VARS['SCIPION_PRIORITY_PACKAGE_LIST'] = Vars.SCIPION_PRIORITY_PACKAGE_LIST
 
-    # Read main config file
-    config2Dict(Vars.SCIPION_CONFIG, VARS)
+    # The config files and pyworkflow variables are cached, and only read
+    # again when these files or the environment variables used change
+    VARS_CACHE = getVarsCacheFile([Vars.SCIPION_CONFIG, Vars.SCIPION_LOCAL_CONFIG])
+    VARS_CACHE_FILES = [Vars.SCIPION_CONFIG, Vars.SCIPION_LOCAL_CONFIG,
+                        join(getModuleFolder("pyworkflow"), 'config.py')]
+    VARS_DEFAULTS = dict(VARS)
+    ENVIRON = dict(os.environ)
+    USED_NAMES = {'HOME', 'VIEWERS'}
+
+    cachedVars = VARS_CACHE and loadVarsCache(VARS_CACHE, VARS_CACHE_FILES,
+                                              VARS_DEFAULTS, ENVIRON)
+    if cachedVars:
+        VARS = cachedVars
+    else:
+        # Read main config file
+        config2Dict(Vars.SCIPION_CONFIG, VARS, USED_NAMES)
 
-    # Load the local config
-    if Vars.SCIPION_LOCAL_CONFIG != Vars.SCIPION_CONFIG:
-        config2Dict(Vars.SCIPION_LOCAL_CONFIG, VARS)
+        # Load the local config
+        if Vars.SCIPION_LOCAL_CONFIG != Vars.SCIPION_CONFIG:
+            config2Dict(Vars.SCIPION_LOCAL_CONFIG, VARS, USED_NAMES)
 
 except Exception as e:
     if len(sys.argv) == 1 or sys.argv[1] != MODE_CONFIG:
@@ -237,6 +299,11 @@ def main():
     # Default to MANAGER_MODE
     mode = getMode()
 
+    # Profile of the modes run in this process, SCIPION_PROFILE
+    if os.environ.get('SCIPION_PROFILE'):
+        from scipion import profiling
+        profiling.start(mode)
+
     # Prepare the environment
     os.environ.update(VARS)
 
@@ -254,10 +321,15 @@ def main():
 
         os.environ["VIEWERS"] = '{%s}' % ','.join(defaultViewers)
 
-    # Trigger Config initialization once environment is ready
-    import pyworkflow
-    pwVARS = pyworkflow.Config.getVars()
-    VARS.update(pwVARS)
+    # Trigger Config initialization once environment is ready. Only when
+    # they are not cached, and not for modes that do not need them
+    if not cachedVars and mode not in [MODE_HELP, MODE_VERSION]:
+        import pyworkflow
+        pwVARS = pyworkflow.Config.getVars()
+        VARS.update(pwVARS)
+        if VARS_CACHE:
+            saveVarsCache(VARS_CACHE, VARS_CACHE_FILES, VARS_DEFAULTS, ENVIRON,
+                          USED_NAMES.union(VARS), VARS)
 
     # Update the environment now with pyworkflow values.
     os.environ.update(VARS)
@@ -312,6 +384,28 @@ def main():
         from scipion.install.install_plugin import installPluginMethods
         installPluginMethods()
 
+    elif mode == MODE_APPLY:
+        os.environ.update(VARS)
+        from scipion.install.manifest import main
+        main(sys.argv[2:])
+
+    elif mode == MODE_SERVER:
+        from scipion.server import ZygoteServer, getServerSocket, getCodeKey, getCodeFiles
+        # Load pyworkflow and the plugins once for all the commands served
+        import pyworkflow
+        import pyworkflow.protocol
+        pyworkflow.Config.getDomain().getPlugins()
+
+        names = USED_NAMES.union(VARS)
+        socketPath = (sys.argv[2] if len(sys.argv) > 2 else
+                      getServerSocket([Vars.SCIPION_CONFIG, Vars.SCIPION_LOCAL_CONFIG]))
+        ZygoteServer(socketPath, runServerChild, lambda environ: getEnvironKey(names, environ),
+                     ENVIRON, getCodeKey, getCodeFiles()).serve()
+
+    elif mode == MODE_PROFILE:
+        from scipion.profiling import main as profileMain
+        profileMain(sys.argv[2:])
+
     elif mode == MODE_PLUGINS:
         os.environ.update(VARS)
         from scipion.install.plugin_manager import PluginManager
@@ -323,12 +417,11 @@ def main():
         main(sys.argv[2:])
 
     elif mode == MODE_VERSION:
-        # Print main packages version
-        import pyworkflow
-        import pwem
+        # Print main packages version, without importing them
+        from importlib import metadata
 
-        print("pyworkflow - %s" % pyworkflow. __version__)
-        print("pwem - %s" % pwem.__version__)
+        print("pyworkflow - %s" % metadata.version('scipion-pyworkflow'))
+        print("pwem - %s" % metadata.version('scipion-em'))
         # Just exit, Scipion version will be printed anyway
         sys.exit(0)
 
@@ -344,6 +437,7 @@ def main():
 
     elif mode == MODE_ENV:
         # Print all the environment variables needed to run scipion.
+        import pyworkflow
         from pyworkflow.utils import greenStr,yellowStr
 
         # Trigger plugin's variable definition
@@ -362,15 +456,14 @@ def main():
 
     elif mode == MODE_RUN:
         # Run any command with the environment of scipion loaded.
-        runCmd('emprogram ' + ' '.join(['"%s"' % arg for arg in sys.argv[2:]]))
+        execCmd(['emprogram'] + sys.argv[2:])
 
     elif mode == MODE_PIP:
         # Runs pip command inside scipion's environment.
-        runCmd('pip ' + ' '.join(['"%s"' % arg for arg in sys.argv[2:]]))
+        execCmd(['pip'] + sys.argv[2:])
 
     elif mode == MODE_PYTHON:
-        runScript(' '.join(['"%s"' % arg for arg in sys.argv[2:]]),
-                  chdir=False)
+        runPython(sys.argv[2:], chdir=False)
 
     elif mode == MODE_TUTORIAL:
         runApp(join(Vars.SCIPION_SCRIPTS, 'tutorial.py'), sys.argv[2:])
@@ -390,7 +483,7 @@ def main():
           mode.startswith('b')):
         # To avoid Ghost activation warning
         from pwem import EM_PROGRAM_ENTRY_POINT
-        runCmd(EM_PROGRAM_ENTRY_POINT, sys.argv[1:])
+        execCmd([EM_PROGRAM_ENTRY_POINT] + sys.argv[1:])
 
     elif mode == MODE_INSPECT:
         runScript(join(Vars.SCIPION_INSTALL, 'inspect_plugins.py'), sys.argv[2:])
@@ -421,6 +514,17 @@ MODE can be:
     
     %s             Uninstalls Plugin Binaries. Use with flag --help to see usage.
 
+    %s run|report     Runs a python script with a profile, or merges the profiles written
+                           with SCIPION_PROFILE=1 (cProfile) or SCIPION_PROFILE=sample into a report.
+                           Use with flag --help to see usage.
+
+    %s [SOCKET]        Starts a server with pyworkflow and the plugins loaded. With
+                           SCIPION_SERVER=1 runprotocol, python, run and protocols are run
+                           by it, much faster. SOCKET or SCIPION_SERVER_SOCKET to change its socket.
+
+    %s MANIFEST         Installs, upgrades and uninstalls plugins and binaries to match
+                           a manifest file. Use --plan to only see the operations needed.
+
     %s                Opens the manager with a list of all projects.
 
     %s                inspect a python module and check if it looks like a scipion plugin. 
@@ -487,7 +591,7 @@ MODE can be:
        MODE_PLUGINS,
        MODE_INSTALL_PLUGIN[1], MODE_INSTALL_PLUGIN[0],
        MODE_UNINSTALL_PLUGIN[1], MODE_UNINSTALL_PLUGIN[0],
-       MODE_INSTALL_BINS, MODE_UNINSTALL_BINS, MODE_MANAGER, MODE_INSPECT,
+       MODE_INSTALL_BINS, MODE_UNINSTALL_BINS, MODE_PROFILE, MODE_SERVER, MODE_APPLY, MODE_MANAGER, MODE_INSPECT,
        MODE_ENV, MODE_PROTOCOLS, MODE_RUNPROTOCOL, MODE_PROJECT, MODE_LAST,
        MODE_RUN, MODE_PIP, MODE_PYTHON, MODE_TEST, MODE_TEST_DATA, MODE_VERSION,
        MODE_DEMO[0], MODE_DEMO[1], MODE_TUTORIAL, MODE_VIEWER[1], MODE_VIEWER[2],
@@ -18,6 +18,9 @@ MODE_INSTALL_PLUGIN = ['installp', "install"]
 MODE_UNINSTALL_PLUGIN = ['uninstallp', 'uninstall']
 MODE_INSTALL_BINS = 'installb'
 MODE_UNINSTALL_BINS = 'uninstallb'
+MODE_APPLY = 'apply'
+MODE_SERVER = 'server'
+MODE_PROFILE = 'profile'
 MODE_CONFIG = 'config'
 MODE_VERSION = 'version'
 MODE_RUNPROTOCOL = 'runprotocol'
@@ -34,6 +37,8 @@ PLUGIN_MODES = [MODE_UNINSTALL_PLUGIN[0], MODE_UNINSTALL_PLUGIN[1],
                 MODE_INSTALL_PLUGIN[1], MODE_INSTALL_PLUGIN[0],
                 MODE_INSTALL_BINS,
                 MODE_UNINSTALL_BINS]
+# Modes run by the scipion server, when it is running and SCIPION_SERVER is on
+SERVER_MODES = [MODE_RUNPROTOCOL, MODE_PYTHON, MODE_RUN, MODE_PROTOCOLS]
 
 # Entry points
 SCIPION_EP = "scipion"
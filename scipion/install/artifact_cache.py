@@ -0,0 +1,223 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Cache of already built packages (the folders that addPackage leaves in
+software/em), so other nodes with the same recipe unpack them instead of
+building them again.
+
+The cache is a folder (e.g. in a shared file system) or an http server
+accepting GET and PUT of files, like the one started with:
+    python -m scipion.install.artifact_cache serve FOLDER [--port 8000]
+"""
+import argparse
+import hashlib
+import os
+import platform
+import shutil
+import tarfile
+import tempfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Folder or http(s) url of the cache. Not defined means no cache.
+SCIPION_ARTIFACT_CACHE = 'SCIPION_ARTIFACT_CACHE'
+
+EXTENSION = '.tgz'
+
+
+def getHostAbi():
+    """ Returns a string identifying the binaries this machine can run """
+    libc = '-'.join(x for x in platform.libc_ver() if x)
+    return '%s-%s-%s' % (platform.system(), platform.machine(), libc)
+
+
+class DirectoryStore:
+    """ Artifacts stored as files in a folder """
+    def __init__(self, path):
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+
+    def __str__(self):
+        return self._path
+
+    def _getFile(self, key):
+        return os.path.join(self._path, key + EXTENSION)
+
+    def has(self, key):
+        return os.path.exists(self._getFile(key))
+
+    def fetch(self, key, path):
+        shutil.copyfile(self._getFile(key), path)
+
+    def put(self, key, path):
+        dest = self._getFile(key)
+        tmp = '%s.%d.tmp' % (dest, os.getpid())
+        try:
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+class HttpStore:
+    """ Artifacts stored in an http server, read with GET and written with PUT """
+    def __init__(self, url, timeout=60):
+        self._url = url.rstrip('/')
+        self._timeout = timeout
+
+    def __str__(self):
+        return self._url
+
+    def _getUrl(self, key):
+        return '%s/%s%s' % (self._url, key, EXTENSION)
+
+    def has(self, key):
+        import requests
+        r = requests.head(self._getUrl(key), timeout=self._timeout)
+        return r.status_code == 200
+
+    def fetch(self, key, path):
+        from .download import Downloader
+        Downloader().download(self._getUrl(key), path)
+
+    def put(self, key, path):
+        import requests
+        with open(path, 'rb') as f:
+            r = requests.put(self._getUrl(key), data=f, timeout=self._timeout)
+        r.raise_for_status()
+
+
+class ArtifactCache:
+    """ Packs and unpacks built packages into a store. """
+    def __init__(self, store):
+        self._store = store
+
+    @classmethod
+    def fromEnviron(cls):
+        """ Returns the cache configured in the environment or None if there
+        is no cache configured. """
+        location = os.environ.get(SCIPION_ARTIFACT_CACHE, '')
+        if not location:
+            return None
+        if location.startswith(('http://', 'https://')):
+            return cls(HttpStore(location))
+        return cls(DirectoryStore(os.path.expanduser(location)))
+
+    def getStore(self):
+        return self._store
+
+    @staticmethod
+    def getKey(recipeKey, root=None):
+        """ Returns the key of the artifact built with the recipe in this
+        kind of machine.
+
+        :param recipeKey: hash of the commands, their environment and the
+            package version, see Target.getRecipeKey
+        :param root: folder the artifact is built in, for artifacts that
+            only work there. None for relocatable artifacts.
+        """
+        key = '%s\n%s' % (recipeKey, getHostAbi())
+        if root is not None:
+            key += '\n%s' % os.path.abspath(root)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def restore(self, key, root):
+        """ Extract the artifact with the given key into root.
+        Returns False if it is not in the cache. """
+        if not self._store.has(key):
+            return False
+        from .download import Downloader
+        with tempfile.TemporaryDirectory(dir=root, prefix='.artifact-') as tmp:
+            pack = os.path.join(tmp, key + EXTENSION)
+            self._store.fetch(key, pack)
+            Downloader().extractFile(pack, root)
+        return True
+
+    def save(self, key, root, folders):
+        """ Pack folders, relative to root, and store them with the given key """
+        with tempfile.TemporaryDirectory(dir=root, prefix='.artifact-') as tmp:
+            pack = os.path.join(tmp, key + EXTENSION)
+            with tarfile.open(pack, 'w:gz', compresslevel=1) as tar:
+                for folder in folders:
+                    tar.add(os.path.join(root, folder), arcname=folder)
+            self._store.put(key, pack)
+
+
+class _StoreRequestHandler(SimpleHTTPRequestHandler):
+    """ Serves the files of a folder and stores the ones PUT into it """
+    def do_PUT(self):
+        name = os.path.basename(self.path)
+        if not name.endswith(EXTENSION):
+            self.send_error(400, "Only %s files are accepted" % EXTENSION)
+            return
+        dest = os.path.join(self.directory, name)
+        tmp = '%s.%d.tmp' % (dest, os.getpid())
+        length = int(self.headers.get('Content-Length', 0))
+        with open(tmp, 'wb') as f:
+            while length:
+                data = self.rfile.read(min(length, 1024 * 1024))
+                if not data:
+                    break
+                f.write(data)
+                length -= len(data)
+        if length:
+            os.remove(tmp)
+            self.send_error(400, "Incomplete upload")
+            return
+        os.replace(tmp, dest)
+        self.send_response(201)
+        self.end_headers()
+
+
+def serve(folder, port=8000):
+    """ Serve the artifacts of folder over http """
+    os.makedirs(folder, exist_ok=True)
+
+    def handler(*args, **kwargs):
+        return _StoreRequestHandler(*args, directory=folder, **kwargs)
+
+    server = ThreadingHTTPServer(('', port), handler)
+    print("Serving artifacts of %s on port %d" % (folder, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache of built packages")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    serveParser = subparsers.add_parser('serve', help="Serve a folder as an http cache")
+    serveParser.add_argument('folder')
+    serveParser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.mode == 'serve':
+        serve(args.folder, args.port)
+
+
+if __name__ == '__main__':
+    main()
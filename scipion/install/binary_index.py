@@ -0,0 +1,153 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Index of the binaries defined by the installed plugins, kept in
+software/binary_index.json, so installb and uninstallb find the plugin of
+a binary without importing all the plugins and running their
+defineBinaries. Only the plugins whose version (or __init__ file) changed
+since the index was written are read again.
+"""
+import json
+import os
+import tempfile
+from importlib import util
+
+from pyworkflow.utils import redStr
+
+from .discovery import getPluginEntryPoints, getPluginModule
+from .funcs import Environment
+
+BINARY_INDEX_FILE = 'binary_index.json'
+
+
+def getPluginVersions():
+    """ Returns a dict with a string identifying the installed code of each
+    plugin (version and modification time), without importing them. """
+    versions = {}
+    for entryPoint in getPluginEntryPoints().values():
+        dist = getattr(entryPoint, 'dist', None)
+        version = dist.version if dist is not None else ''
+        # Plugins installed in editable mode change without a new version
+        try:
+            spec = util.find_spec(entryPoint.name)
+            if spec is not None and spec.origin and os.path.exists(spec.origin):
+                version += '@%d' % os.stat(spec.origin).st_mtime_ns
+        except (ImportError, ValueError):
+            pass
+        versions[entryPoint.name] = version
+    return versions
+
+
+class BinaryIndex:
+    """ Binaries (name, version and default flag) of each plugin """
+
+    def __init__(self, path=None):
+        self._path = path or Environment.getSoftware(BINARY_INDEX_FILE)
+        self._plugins = {}
+        try:
+            with open(self._path) as f:
+                self._plugins = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def update(self, versions=None):
+        """ Read again the binaries of the plugins installed, updated or
+        removed since the last time. Returns self.
+
+        :param versions: Optional, the result of getPluginVersions
+        """
+        if versions is None:
+            versions = getPluginVersions()
+        changed = False
+        for pluginName in list(self._plugins):
+            if pluginName not in versions:
+                del self._plugins[pluginName]
+                changed = True
+        for pluginName, version in versions.items():
+            entry = self._plugins.get(pluginName)
+            if entry is None or entry['version'] != version:
+                self._plugins[pluginName] = self._readPlugin(pluginName, version)
+                changed = True
+        if changed:
+            self._save()
+        return self
+
+    @staticmethod
+    def _readPlugin(pluginName, version):
+        """ Returns the index entry of the plugin, running its defineBinaries """
+        env = Environment()
+        env.setDefault(False)
+        defaultTargets = set(t.getName() for t in env.getTargetList())
+        try:
+            plugin = getPluginModule(pluginName)
+            plugin._pluginInstance.defineBinaries(env)
+        except Exception as e:
+            print(redStr("Error retrieving plugin %s binaries: " % pluginName), e)
+            version = None  # Try again next time
+        targets = [{'name': t.getName(), 'default': t.isDefault()}
+                   for t in env.getTargetList() if t.getName() not in defaultTargets]
+        packages = [list(p) for versions in env.getPackages().values() for p in versions]
+        return {'version': version, 'targets': targets, 'packages': packages}
+
+    def _save(self):
+        folder = os.path.dirname(self._path)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=folder, delete=False) as f:
+                json.dump(self._plugins, f)
+            os.replace(f.name, self._path)
+        except OSError as e:
+            print("WARNING: could not write %s: %s" % (self._path, e))
+
+    def getPlugins(self):
+        return list(self._plugins)
+
+    def getTargets(self, pluginName):
+        """ Returns a list of dicts with the name and the default flag of the
+        binaries of the plugin """
+        return self._plugins.get(pluginName, {}).get('targets', [])
+
+    def getBinToPluginDict(self):
+        """ Returns a dict with the plugin of each binary, with and without
+        its version (e.g. ctffind4-4.1.14 and ctffind4) """
+        binToPlugin = {}
+        for pluginName, entry in self._plugins.items():
+            names = [t['name'] for t in entry['targets']]
+            binToPlugin.update({name: pluginName for name in names})
+            binToPlugin.update({name.split('-', 1)[0]: pluginName for name in names})
+        return binToPlugin
+
+    def getPackages(self, pluginName=None):
+        """ Returns the packages of all the plugins, as Environment.getPackages,
+        or the list of (name, version) of the packages of pluginName """
+        if pluginName is not None:
+            entry = self._plugins.get(pluginName, {})
+            return [tuple(p) for p in entry.get('packages', [])]
+        packages = {}
+        for entry in self._plugins.values():
+            for name, version in entry['packages']:
+                packages.setdefault(name, []).append((name, version))
+        return packages
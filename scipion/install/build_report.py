@@ -0,0 +1,98 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+JSON lines report of an installation (installb/installp --build-report).
+
+Each line is a record with a "type":
+
+ - graph: the targets to install and their dependencies
+ - command: wall time, cpu time of the child processes, their peak
+   memory, bytes downloaded and exit status of a command
+ - target: wall time and status of a target
+
+Several installations may append to the same file.
+"""
+import json
+import os
+import platform
+import socket
+import threading
+import time
+
+
+def getMaxRssKb(rusage):
+    """ Returns ru_maxrss in KB (it is in bytes in MacOS) """
+    if platform.system() == 'Darwin':
+        return rusage.ru_maxrss // 1024
+    return rusage.ru_maxrss
+
+
+class BuildReport:
+    """ Appends the records of an installation to a JSON lines file. """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._host = socket.gethostname()
+        self._pid = os.getpid()
+
+    def getPath(self):
+        return self._path
+
+    def _write(self, record):
+        record.update(host=self._host, pid=self._pid, time=time.time())
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            # A single write in append mode keeps lines from several
+            # processes whole
+            with open(self._path, 'a') as f:
+                f.write(line)
+
+    def addGraph(self, targets):
+        """ Record the dependencies between targets.
+
+        :param targets: dict with the list of dependencies of each target
+        """
+        self._write({'type': 'graph', 'targets': targets})
+
+    def addCommand(self, target, command, stats):
+        """ Record the execution of a command.
+
+        :param target: name of the target of the command
+        :param command: command string
+        :param stats: dict with the values measured, see Command.getStats
+        """
+        record = {'type': 'command', 'target': target, 'command': command}
+        record.update(stats)
+        self._write(record)
+
+    def addTarget(self, target, wallTime, status, deps=()):
+        """ Record the execution of a target.
+
+        :param status: 'done', 'skipped' or 'failed'
+        """
+        self._write({'type': 'target', 'target': target, 'wallTime': wallTime,
+                     'status': status, 'deps': list(deps)})
@@ -0,0 +1,158 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Record of the install commands that finished successfully, so running
+installb again skips exactly the commands already done, and of the time
+each target took to install.
+
+Each command is identified by a key that hashes its recipe (command line,
+targets, working folder and environment) together with the key of the previous
+command of its target. Changing one step of a recipe invalidates that step
+and the ones after it, but not the previous ones.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+BUILD_STATE_FILE = 'build_state.sqlite'
+
+
+def hashCommand(previousKey, cmd, targets=(), cwd=None, environ=None, root=None):
+    """ Returns the key of a command.
+
+    :param previousKey: key of the previous command of the target, or the
+        name of the target for the first one
+    :param cmd: command string (or a description of a python callable)
+    :param targets: paths (or glob patterns) produced by the command
+    :param cwd: folder where the command is executed
+    :param environ: environment of the command. Only the variables it
+        sets to a value other than the one of the current environment are
+        taken into account, not the ones of the user missing in it.
+    :param root: Optional, folder replaced by a placeholder, so the key is
+        the same for installations in different folders
+    """
+    envDiff = []
+    if environ is not None:
+        envDiff = sorted((k, v) for k, v in environ.items()
+                         if os.environ.get(k) != v)
+    recipe = json.dumps([previousKey, cmd, list(targets), cwd, envDiff])
+    if root:
+        recipe = recipe.replace(root, '${ROOT}')
+    return hashlib.sha256(recipe.encode()).hexdigest()
+
+
+class BuildState:
+    """ SQLite file with the commands that finished successfully and the
+    state of their targets when they did. """
+
+    def __init__(self, path):
+        self._path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # Targets may be installed from several threads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS commands ("
+                               "key TEXT PRIMARY KEY, "
+                               "target TEXT, "
+                               "command TEXT, "
+                               "targets TEXT, "
+                               "finished REAL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS targets ("
+                               "name TEXT PRIMARY KEY, "
+                               "wallTime REAL, "
+                               "finished REAL)")
+
+    def getPath(self):
+        return self._path
+
+    def isDone(self, key, targets):
+        """ Returns True if the command with this key finished successfully
+        and its targets are still as it left them.
+
+        :param targets: current state of the targets, as returned by
+            Command.getTargetsState
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT targets FROM commands WHERE key=?",
+                                     (key,)).fetchone()
+        return row is not None and json.loads(row[0]) == targets
+
+    def hasKey(self, key):
+        """ Returns True if the command with this key finished successfully
+        at some point, whatever the state of its targets. """
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM commands WHERE key=?",
+                                     (key,)).fetchone()
+        return row is not None
+
+    def hasTarget(self, target):
+        """ Returns True if some command of the target has been recorded """
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM commands WHERE target=? LIMIT 1",
+                                     (target,)).fetchone()
+        return row is not None
+
+    def setDone(self, key, target, command, targets):
+        """ Record that a command finished successfully.
+
+        :param key: key of the command, see hashCommand
+        :param target: name of the target of the command
+        :param command: command string, for information
+        :param targets: state of the targets after running the command
+        """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO commands VALUES (?, ?, ?, ?, ?)",
+                               (key, target, command, json.dumps(targets), time.time()))
+
+    def setTargetTime(self, target, wallTime):
+        """ Record how long it took to install a target """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO targets VALUES (?, ?, ?)",
+                               (target, wallTime, time.time()))
+
+    def getTargetTimes(self):
+        """ Returns a dict with the last install time of each target """
+        with self._lock:
+            rows = self._conn.execute("SELECT name, wallTime FROM targets").fetchall()
+        return dict(rows)
+
+    def clear(self, target=None):
+        """ Forget the commands of the given target, or all of them """
+        with self._lock, self._conn:
+            if target is None:
+                self._conn.execute("DELETE FROM commands")
+            else:
+                self._conn.execute("DELETE FROM commands WHERE target=?", (target,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
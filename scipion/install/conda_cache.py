@@ -0,0 +1,298 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Reuse of the conda environments created for the binaries.
+
+Environments are identified by a key: a hash of the python version,
+the pip requirements (list and file content), the conda packages and the
+channels. Before creating an environment, the install commands run:
+
+    python -m scipion.install.conda_cache restore ENV_NAME [spec]
+
+which, in this order:
+
+ - clones the environment of the cache of this machine with the same key
+ - unpacks it from SCIPION_CONDA_ENV_STORE, if packed there with conda-pack
+ - creates it from the explicit package list (and pip freeze) recorded
+   in SCIPION_CONDA_ENV_STORE, which does not need the solver
+
+and exits with 1 if none is possible, so the environment is created as
+usual and then recorded with:
+
+    python -m scipion.install.conda_cache save ENV_NAME [spec]
+
+right after it is created, before the rest of the install commands add
+other packages to it. The cache keeps a clone of it at that moment
+(scipion-cache-KEY), which is the one cloned for the next environments,
+since the spec only describes the environment up to then.
+
+Caching is best effort: save never makes the install commands fail.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Folder (e.g. in a shared file system) with the recorded environments
+SCIPION_CONDA_ENV_STORE = 'SCIPION_CONDA_ENV_STORE'
+
+# File inside conda-meta with the key of the environment
+KEY_FILE = 'scipion-env-key'
+# Name of the clean environments kept by the cache, followed by their key
+CACHE_ENV_PREFIX = 'scipion-cache-'
+
+
+def getEnvKey(python=None, requirements=None, pip=(), conda=None, channels=()):
+    """ Returns the key of an environment.
+
+    :param python: python version
+    :param requirements: pip requirements file, its content is hashed
+    :param pip: list of pip packages
+    :param conda: conda packages (and other arguments) of conda create
+    :param channels: list of conda channels
+    """
+    content = None
+    if requirements:
+        with open(requirements) as f:
+            content = f.read()
+    spec = [platform.system(), platform.machine(), python, content,
+            sorted(pip), conda, list(channels)]
+    return hashlib.sha256(json.dumps(spec).encode()).hexdigest()
+
+
+def getCacheCommand(mode, envName, **spec):
+    """ Returns the command line to restore or save (mode) the environment
+    envName. spec holds the arguments of getEnvKey. """
+    cmd = [sys.executable, '-m', 'scipion.install.conda_cache', mode, envName]
+    # --option=value, so values starting with - are not taken as options
+    for option in ['python', 'requirements', 'conda']:
+        if spec.get(option):
+            cmd.append('--%s=%s' % (option, spec[option]))
+    for option, values in [('pip', spec.get('pip')), ('channel', spec.get('channels'))]:
+        for value in values or []:
+            cmd.append('--%s=%s' % (option, value))
+    return ' '.join(shlex.quote(arg) for arg in cmd)
+
+
+class CondaEnvCache:
+    """ Finds, records and restores environments by key """
+
+    def __init__(self, store=None, conda=None):
+        self._store = store
+        self._conda = conda or os.environ.get('CONDA_EXE') or shutil.which('conda') or 'conda'
+
+    @classmethod
+    def fromEnviron(cls):
+        store = os.environ.get(SCIPION_CONDA_ENV_STORE, '')
+        return cls(os.path.expanduser(store) if store else None)
+
+    def _run(self, *args, **kwargs):
+        return subprocess.run([self._conda] + list(args), check=True, **kwargs)
+
+    def _json(self, *args):
+        output = self._run(*args, '--json', stdout=subprocess.PIPE).stdout
+        return json.loads(output)
+
+    def getEnvs(self):
+        """ Returns the prefixes of the existing environments """
+        return self._json('env', 'list')['envs']
+
+    def getEnvPrefix(self, name):
+        """ Returns the prefix of the environment name (it may not exist) """
+        for prefix in self.getEnvs():
+            if os.path.basename(prefix) == name:
+                return prefix
+        return os.path.join(self._json('info')['envs_dirs'][0], name)
+
+    @staticmethod
+    def getKey(prefix):
+        keyFile = os.path.join(prefix, 'conda-meta', KEY_FILE)
+        if not os.path.exists(keyFile):
+            return None
+        with open(keyFile) as f:
+            return f.read().strip()
+
+    @staticmethod
+    def getCacheEnvName(key):
+        """ Returns the name of the clean environment kept for key """
+        return CACHE_ENV_PREFIX + key[:16]
+
+    def findEnv(self, key):
+        """ Returns the prefix of the clean environment of the cache with
+        the given key, or None """
+        name = self.getCacheEnvName(key)
+        for prefix in self.getEnvs():
+            if os.path.basename(prefix) == name and self.getKey(prefix) == key:
+                return prefix
+        return None
+
+    def _getStoreFile(self, key, suffix):
+        return os.path.join(self._store, key + suffix)
+
+    def restore(self, name, key):
+        """ Make the environment name have the packages of the key.
+        Returns a description of how, or None if it was not possible. """
+        prefix = self.getEnvPrefix(name)
+        if self.getKey(prefix) == key:
+            return 'already there'
+        source = self.findEnv(key)
+        if source is not None:
+            self._remove(name, prefix)
+            self._run('create', '-y', '-n', name, '--clone', source, '--offline')
+            self._setKey(prefix, key)
+            return 'cloned from %s' % source
+
+        if self._store is None:
+            return None
+
+        packed = self._getStoreFile(key, '.tar.gz')
+        if os.path.exists(packed):
+            self._remove(name, prefix)
+            os.makedirs(prefix)
+            subprocess.run(['tar', '-xzf', packed, '-C', prefix], check=True)
+            subprocess.run([os.path.join(prefix, 'bin', 'conda-unpack')], check=True)
+            self._setKey(prefix, key)
+            return 'unpacked from %s' % packed
+
+        explicit = self._getStoreFile(key, '.explicit.txt')
+        if os.path.exists(explicit):
+            self._remove(name, prefix)
+            self._run('create', '-y', '-n', name, '--file', explicit)
+            pipFreeze = self._getStoreFile(key, '.pip.txt')
+            if os.path.getsize(pipFreeze):
+                subprocess.run([os.path.join(prefix, 'bin', 'python'), '-m', 'pip',
+                                'install', '--no-deps', '-r', pipFreeze], check=True)
+            self._setKey(prefix, key)
+            return 'created from %s' % explicit
+        return None
+
+    def _remove(self, name, prefix):
+        if os.path.exists(prefix):
+            self._run('env', 'remove', '-y', '-n', name)
+
+    @staticmethod
+    def _setKey(prefix, key):
+        with open(os.path.join(prefix, 'conda-meta', KEY_FILE), 'w') as f:
+            f.write(key)
+
+    def save(self, name, key):
+        """ Record that the environment name was just created with key:
+        keep a clone of it for the next environments with the same key and,
+        with a store, save its explicit package list and pip packages there,
+        and the environment itself if conda-pack is available. """
+        prefix = self.getEnvPrefix(name)
+        self._setKey(prefix, key)
+        if self.findEnv(key) is None:
+            cacheName = self.getCacheEnvName(key)
+            cachePrefix = self.getEnvPrefix(cacheName)
+            self._remove(cacheName, cachePrefix)
+            self._run('create', '-y', '-n', cacheName, '--clone', prefix, '--offline')
+            self._setKey(cachePrefix, key)
+        if self._store is None:
+            return
+        os.makedirs(self._store, exist_ok=True)
+
+        explicit = self._run('list', '--explicit', '--md5', '-p', prefix,
+                             stdout=subprocess.PIPE, universal_newlines=True).stdout
+        python = os.path.join(prefix, 'bin', 'python')
+        pipFreeze = ''
+        if os.path.exists(python):
+            pipFreeze = subprocess.run([python, '-m', 'pip', 'freeze', '--exclude-editable'],
+                                       stdout=subprocess.PIPE, universal_newlines=True).stdout
+        # Packages installed from local folders can not be installed elsewhere
+        pipFreeze = ''.join(line + '\n' for line in pipFreeze.splitlines()
+                            if ' @ file:' not in line)
+        self._write(self._getStoreFile(key, '.pip.txt'), pipFreeze)
+        # Written last: it tells the entry is complete
+        self._write(self._getStoreFile(key, '.explicit.txt'), explicit)
+
+        condaPack = shutil.which('conda-pack')
+        if condaPack:
+            packed = self._getStoreFile(key, '.tar.gz')
+            tmp = '%s.%d.tmp' % (packed, os.getpid())
+            try:
+                subprocess.run([condaPack, '-p', prefix, '-o', tmp, '--format', 'tar.gz',
+                                '--ignore-editable-packages', '-q'], check=True)
+                os.replace(tmp, packed)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    @staticmethod
+    def _write(path, content):
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path),
+                                         delete=False) as f:
+            f.write(content)
+        os.replace(f.name, path)
+
+
+def getParser():
+    parser = argparse.ArgumentParser(description="Cache of conda environments")
+    parser.add_argument('mode', choices=['restore', 'save'])
+    parser.add_argument('name', help="Name of the environment")
+    parser.add_argument('--python', help="Python version")
+    parser.add_argument('--requirements', help="Pip requirements file")
+    parser.add_argument('--pip', action='append', default=[], help="Pip package")
+    parser.add_argument('--conda', help="Arguments of conda create: packages, channels...")
+    parser.add_argument('--channel', action='append', default=[], help="Conda channel")
+    return parser
+
+
+def main(args=None):
+    argv = sys.argv[1:] if args is None else list(args)
+    try:
+        args = getParser().parse_args(argv)
+    except SystemExit as e:
+        if e.code == 0:  # --help
+            raise
+        # The environment is created, or its install goes on, as usual
+        sys.exit(0 if argv[:1] == ['save'] else 1)
+
+    key = getEnvKey(args.python, args.requirements, args.pip, args.conda, args.channel)
+    cache = CondaEnvCache.fromEnviron()
+
+    # The environment is created as usual if anything goes wrong
+    try:
+        if args.mode == 'restore':
+            how = cache.restore(args.name, key)
+            if how is None:
+                sys.exit(1)
+            print("Conda environment %s %s" % (args.name, how))
+        else:
+            cache.save(args.name, key)
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError) as e:
+        print("WARNING: conda environment cache: %s" % e, file=sys.stderr)
+        sys.exit(1 if args.mode == 'restore' else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Discovery of the installed plugins for the install commands and the plugin
+manager. Plugins are found through their entry points and distribution
+metadata, and a plugin module is only imported (and its variables defined)
+when its binaries are needed, instead of importing all of them with
+Domain.getPlugins().
+"""
+import threading
+from importlib import metadata
+
+PLUGIN_ENTRY_POINT = 'pyworkflow.plugin'
+
+_pluginModules = {}
+_lock = threading.RLock()
+
+
+def getPluginEntryPoints():
+    """ Returns a dict with the entry point of each installed plugin """
+    entryPoints = metadata.entry_points()
+    if hasattr(entryPoints, 'select'):
+        entryPoints = entryPoints.select(group=PLUGIN_ENTRY_POINT)
+    else:
+        entryPoints = entryPoints.get(PLUGIN_ENTRY_POINT, [])
+    return {entryPoint.name: entryPoint for entryPoint in entryPoints}
+
+
+def getPluginNames():
+    """ Returns the sorted module names of the installed plugins """
+    return sorted(getPluginEntryPoints())
+
+
+def getPluginDistribution(pluginName):
+    """ Returns the name of the distribution installing a plugin, or None """
+    entryPoint = getPluginEntryPoints().get(pluginName)
+    dist = getattr(entryPoint, 'dist', None)
+    return dist.metadata['Name'] if dist is not None else None
+
+
+def getPluginModule(pluginName):
+    """ Imports the module of a plugin, after the priority packages, and
+    defines its variables, as Domain.getPluginModule, only once. Raises
+    KeyError if it is not installed or can not be imported. """
+    from pwem import Domain
+    from pyworkflow import Config
+
+    with _lock:
+        if pluginName not in _pluginModules:
+            installed = getPluginEntryPoints()
+            for name in Config.getPriorityPackageList():
+                if name in installed and name != pluginName and name not in _pluginModules:
+                    try:
+                        _pluginModules[name] = Domain.getPluginModule(name)
+                    except KeyError:
+                        pass
+            _pluginModules[pluginName] = Domain.getPluginModule(pluginName)
+        return _pluginModules[pluginName]
+
+
+def forgetPluginModule(pluginName):
+    """ Makes getPluginModule import the plugin again, e.g. after an upgrade """
+    with _lock:
+        _pluginModules.pop(pluginName, None)
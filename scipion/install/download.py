@@ -0,0 +1,464 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+HTTP downloader used to fetch the binaries of the plugins.
+
+Big files are downloaded in several segments at the same time using range
+requests. Interrupted downloads are resumed from the <file>.part left
+behind, failed requests are retried and the result can be verified
+against its sha256.
+
+Tar files can also be extracted while they are downloaded, without
+writing them to disk first. A connection lost in the middle is continued
+with a range request, if the server accepts them, but an extraction that
+fails can not be resumed later: the next attempt downloads it all again.
+
+Files are saved, hashed and extracted as the server sends them, as wget
+does, even if it declares them with Content-Encoding (e.g. gzip for .tgz).
+
+It can be used from the command line too:
+    python -m scipion.install.download URL FILE [--sha256 SUM]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+import requests
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+from .download_cache import sha256sum
+
+# Number of connections used for a single file
+SCIPION_DOWNLOAD_SEGMENTS = 'SCIPION_DOWNLOAD_SEGMENTS'
+DEFAULT_SEGMENTS = 4
+# Files smaller than this are downloaded with a single connection
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+MB = 1024 * 1024
+
+
+class DownloadError(IOError):
+    pass
+
+
+class _RangesIgnored(Exception):
+    """ The server answered a range request with the whole file """
+
+
+class ProgressPrinter:
+    """ Prints the progress of a download to a stream: on the same line
+    for terminals and every few seconds for files. """
+    def __init__(self, name, stream=None, interval=None):
+        self._name = name
+        self._stream = stream or sys.stdout
+        self._tty = hasattr(self._stream, 'isatty') and self._stream.isatty()
+        self._interval = interval or (0.5 if self._tty else 10)
+        self._last = time.time()
+
+    def __call__(self, done, total, speed, finished=False):
+        now = time.time()
+        if not finished and now - self._last < self._interval:
+            return
+        self._last = now
+
+        if total:
+            msg = "  %s: %3d%% %.1f of %.1f MB, %.1f MB/s" % (
+                self._name, 100 * done / total, done / MB, total / MB, speed / MB)
+        else:
+            msg = "  %s: %.1f MB, %.1f MB/s" % (self._name, done / MB, speed / MB)
+
+        if self._tty:
+            self._stream.write('\r%s\x1b[K%s' % (msg, '\n' if finished else ''))
+        else:
+            self._stream.write(msg + '\n')
+        self._stream.flush()
+
+
+class Downloader:
+    """ Downloads urls into files. The progress callback, if any, is called
+    as progress(bytesDone, totalBytes, bytesPerSecond, finished). """
+    def __init__(self, segments=None, retries=5, timeout=60, progress=None):
+        self._segments = segments or int(os.environ.get(SCIPION_DOWNLOAD_SEGMENTS,
+                                                        DEFAULT_SEGMENTS))
+        self._retries = retries
+        self._timeout = timeout
+        self._progress = progress
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+
+        # Statistics of the last download
+        self.bytesDownloaded = 0
+        self.bytesPerSecond = 0
+
+    def download(self, url, path, sha256=None):
+        """ Download url into path, resuming a previous <path>.part if any.
+
+        :param url: url to download
+        :param path: destination file, it is overwritten if it exists
+        :param sha256: Optional, expected sha256 of the file
+        :returns the number of bytes transferred
+        """
+        part = path + '.part'
+        state = part + '.json'
+        total, ranges = self._getInfo(url)
+
+        if ranges and total and total > MIN_SEGMENT_SIZE and self._segments > 1:
+            segments = self._loadSegments(state, total)
+            mode = 'r+b' if os.path.exists(part) else 'wb'
+        else:
+            # Single connection. Continue the .part if we can ask for the rest,
+            # unless it was left by a segmented download, with holes
+            size = 0
+            if ranges and os.path.exists(part) and not os.path.exists(state):
+                size = os.path.getsize(part)
+                if total and size > total:
+                    size = 0
+            end = total - 1 if total else None
+            segments = [[0, size, end]]
+            mode = 'r+b' if size else 'wb'
+            if os.path.exists(state):
+                os.remove(state)
+
+        self.bytesDownloaded = 0
+        self._done = sum(s[1] - s[0] for s in segments)
+        self._total = total
+        self._start = time.time()
+        self._lastSave = 0
+
+        try:
+            with open(part, mode) as f:
+                if len(segments) == 1:
+                    self._downloadSegment(url, f, segments[0], state=None)
+                else:
+                    f.truncate(total)
+                    self._downloadSegments(url, f, segments, state)
+        except _RangesIgnored:
+            # The segments can not be continued: all the file from the start
+            if os.path.exists(state):
+                os.remove(state)
+            self._done = 0
+            with open(part, 'wb') as f:
+                self._downloadSegment(url, f, [0, 0, total - 1 if total else None], state=None)
+
+        self._report(finished=True)
+
+        if total and os.path.getsize(part) != total:
+            raise DownloadError("Size of %s is %d, expected %d"
+                                % (part, os.path.getsize(part), total))
+        if sha256 and sha256sum(part) != sha256:
+            for f in [part, state]:
+                if os.path.exists(f):
+                    os.remove(f)
+            raise DownloadError("Checksum mismatch for %s" % url)
+
+        os.replace(part, path)
+        if os.path.exists(state):
+            os.remove(state)
+        return self.bytesDownloaded
+
+    def extract(self, url, destDir, sha256=None, tee=None):
+        """ Download the tar file in url extracting it into destDir on the
+        fly. The members are extracted to a temporary folder and moved
+        to destDir when the whole file has been verified.
+
+        :param url: url of the tar file, with any compression
+        :param destDir: folder where the content of the tar is extracted
+        :param sha256: Optional, expected sha256 of the tar file
+        :param tee: Optional, file where the tar file is written too
+        :returns the number of bytes transferred
+        """
+        r = self._request('get', url, stream=True)
+        size = r.headers.get('Content-Length')
+        self._total = int(size) if size else None
+        reopen = None
+        if r.headers.get('Accept-Ranges', '').lower() == 'bytes':
+            def reopen(position):
+                """ Returns the stream of the rest of the file """
+                r = self._request('get', url, stream=True,
+                                  headers={'Range': 'bytes=%d-' % position})
+                if r.status_code != 206:
+                    raise DownloadError("Cannot continue downloading %s" % url)
+                return _RawStream(r)
+        return self._extractStream(_RawStream(r), url, destDir, sha256, tee, reopen)
+
+    def extractFile(self, path, destDir, sha256=None):
+        """ Same as extract, but for a local tar file """
+        with open(path, 'rb') as f:
+            self._total = os.path.getsize(path)
+            return self._extractStream(f, path, destDir, sha256, None)
+
+    def _extractStream(self, stream, name, destDir, sha256, tee, reopen=None):
+        self.bytesDownloaded = 0
+        self._done = 0
+        self._start = time.time()
+        reader = _StreamReader(stream, self, tee, reopen)
+        # Unique, since several threads may extract into the same folder
+        tmpDir = tempfile.mkdtemp(prefix='.extracting-', dir=destDir)
+        try:
+            with tarfile.open(fileobj=reader, mode='r|*') as tar:
+                if hasattr(tarfile, 'fully_trusted_filter'):
+                    # Same as "tar -xf", i.e. keep permissions and links
+                    tar.extractall(tmpDir, filter='fully_trusted')
+                else:
+                    tar.extractall(tmpDir)
+            reader.drain()  # The padding after the last member
+            self._report(finished=True)
+
+            if sha256 and reader.sha.hexdigest() != sha256:
+                raise DownloadError("Checksum mismatch for %s" % name)
+
+            for name in os.listdir(tmpDir):
+                _moveInto(os.path.join(tmpDir, name), os.path.join(destDir, name))
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+        return self.bytesDownloaded
+
+    def _getInfo(self, url):
+        """ Returns the size of url (None if unknown) and whether the server
+        accepts range requests. """
+        try:
+            r = self._request('head', url, allow_redirects=True)
+        except requests.HTTPError:
+            return None, False  # HEAD not allowed, we will find out with GET
+        size = r.headers.get('Content-Length')
+        ranges = r.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        return (int(size) if size else None), ranges
+
+    def _loadSegments(self, state, total):
+        """ Returns the list of [start, position, end] of each segment,
+        the ones saved by an interrupted download if they match. """
+        if os.path.exists(state) and os.path.exists(state[:-len('.json')]):
+            with open(state) as f:
+                saved = json.load(f)
+            if saved.get('total') == total:
+                return saved['segments']
+
+        size = -(-total // self._segments)  # ceil
+        return [[start, start, min(start + size, total) - 1]
+                for start in range(0, total, size)]
+
+    def _saveSegments(self, state, segments, force=False):
+        """ Save the progress of the segments to resume the download later.
+        Done once per second at most, unless force is True. """
+        with self._lock:
+            now = time.time()
+            if not force and now - self._lastSave < 1:
+                return
+            self._lastSave = now
+            with open(state + '.tmp', 'w') as f:
+                json.dump({'total': self._total, 'segments': segments}, f)
+            os.replace(state + '.tmp', state)
+
+    def _downloadSegments(self, url, f, segments, state):
+        errors = []
+
+        def run(segment):
+            try:
+                self._downloadSegment(url, f, segment, state, segments)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(s,), daemon=True)
+                   for s in segments if s[2] is None or s[1] <= s[2]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self._saveSegments(state, segments, force=True)
+
+        if errors:
+            raise next((e for e in errors if isinstance(e, _RangesIgnored)), errors[0])
+
+    def _downloadSegment(self, url, f, segment, state, segments=None):
+        """ Download the bytes from segment[1] to segment[2] (both included)
+        writing them at the same offsets of f. segment[1] is updated with
+        the progress, so a new attempt starts where the last one failed. """
+        end = segment[2]
+        attempt = 0
+        while end is None or segment[1] <= end:
+            headers = {}
+            if segment[1] or end is not None:
+                headers['Range'] = 'bytes=%d-%s' % (segment[1], '' if end is None else end)
+            r = self._request('get', url, headers=headers, stream=True)
+            if 'Range' in headers and r.status_code != 206:
+                # The server sends the whole file, start again
+                if segments is not None or segment[0]:
+                    raise _RangesIgnored()
+                segment[1] = 0
+            position = segment[1]
+            try:
+                for chunk in _RawStream(r):
+                    os.pwrite(f.fileno(), chunk, segment[1])
+                    segment[1] += len(chunk)
+                    with self._lock:
+                        self.bytesDownloaded += len(chunk)
+                        self._done += len(chunk)
+                    if state is not None:
+                        self._saveSegments(state, segments)
+                    self._report()
+                if end is None:
+                    break  # Unknown size, we got all the server had
+                error = "connection closed by the server"
+            except requests.RequestException as e:
+                error = e
+
+            if segment[1] == position:  # No progress at all in this attempt
+                attempt += 1
+                if attempt > self._retries:
+                    raise DownloadError("Downloading %s failed after %d attempts: %s"
+                                        % (url, attempt, error))
+                time.sleep(min(2 ** attempt, 60))
+
+    def _request(self, method, url, **kwargs):
+        """ Make a request retrying on connection errors and server errors """
+        for attempt in range(self._retries + 1):
+            try:
+                r = self._session.request(method, url, timeout=self._timeout, **kwargs)
+                if r.status_code < 500:
+                    r.raise_for_status()
+                    return r
+                error = "HTTP %d" % r.status_code
+            except requests.HTTPError:
+                raise  # 4XX, no point in trying again
+            except requests.RequestException as e:
+                error = e
+            if attempt < self._retries:
+                time.sleep(min(2 ** (attempt + 1), 60))
+        raise DownloadError("Cannot get %s: %s" % (url, error))
+
+    def _report(self, finished=False):
+        elapsed = time.time() - self._start
+        self.bytesPerSecond = self.bytesDownloaded / elapsed if elapsed else 0
+        if self._progress is not None:
+            self._progress(self._done, self._total, self.bytesPerSecond,
+                           finished)
+
+
+def _isFolder(path):
+    return os.path.isdir(path) and not os.path.islink(path)
+
+
+def _moveInto(src, dest):
+    """ Moves src to dest, merging it into dest if both are folders, as
+    "tar -xf" does. Files replace the existing ones, but not folders. """
+    if _isFolder(src) and _isFolder(dest):
+        for name in os.listdir(src):
+            _moveInto(os.path.join(src, name), os.path.join(dest, name))
+    elif _isFolder(dest) or (_isFolder(src) and os.path.lexists(dest)):
+        raise DownloadError("Cannot extract %s: %s exists" % (os.path.basename(src), dest))
+    else:
+        os.replace(src, dest)
+
+
+class _RawStream:
+    """ Bytes of a streamed response as the server sends them, without
+    undoing their Content-Encoding. Read errors are raised as
+    requests.ConnectionError. """
+    def __init__(self, response):
+        self._raw = response.raw
+
+    def read(self, size=-1):
+        try:
+            return self._raw.read(None if size < 0 else size, decode_content=False)
+        except Urllib3Error as e:
+            raise requests.ConnectionError(e)
+
+    def __iter__(self):
+        return iter(lambda: self.read(CHUNK_SIZE), b'')
+
+
+class _StreamReader:
+    """ File like object reading from a stream while computing its sha256,
+    copying it to tee and reporting the progress to the downloader.
+
+    :param reopen: Optional, function returning a new stream starting at
+        the given position, to continue after a read error
+    """
+    def __init__(self, stream, downloader, tee=None, reopen=None):
+        self._stream = stream
+        self._downloader = downloader
+        self._tee = tee
+        self._reopen = reopen
+        self._position = 0
+        self._attempts = 0
+        self.sha = hashlib.sha256()
+
+    def _read(self, size):
+        while True:
+            try:
+                return self._stream.read(size)
+            except requests.RequestException as e:
+                self._attempts += 1
+                if self._reopen is None or self._attempts > self._downloader._retries:
+                    raise DownloadError("Download interrupted: %s" % e)
+                time.sleep(min(2 ** self._attempts, 60))
+                self._stream = self._reopen(self._position)
+
+    def read(self, size=-1):
+        data = self._read(size)
+        if data:
+            self._position += len(data)
+            self.sha.update(data)
+            if self._tee is not None:
+                self._tee.write(data)
+            d = self._downloader
+            with d._lock:
+                d.bytesDownloaded += len(data)
+                d._done += len(data)
+            d._report()
+        return data
+
+    def drain(self):
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Download URL into FILE.")
+    parser.add_argument('url', metavar='URL')
+    parser.add_argument('path', metavar='FILE')
+    parser.add_argument('--sha256', help='expected sha256 of the file')
+    parser.add_argument('--segments', type=int,
+                        help='number of connections (default %d)' % DEFAULT_SEGMENTS)
+    args = parser.parse_args(args)
+
+    downloader = Downloader(segments=args.segments,
+                            progress=ProgressPrinter(os.path.basename(args.path)))
+    try:
+        downloader.download(args.url, args.path, sha256=args.sha256)
+    except Exception as e:
+        sys.exit("ERROR: %s" % e)
+
+
+if __name__ == '__main__':
+    main()
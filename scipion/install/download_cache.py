@@ -0,0 +1,235 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Content addressed cache of downloaded packages, shared by several
+SCIPION_HOME installations of the same machine.
+
+Entries are keyed by the url and the expected checksum of the file, and
+are hardlinked (or reflinked, or copied as a last resort) into the
+install that asks for them. The least recently used entries are removed
+when the cache grows over its maximum size.
+"""
+import fcntl
+import hashlib
+import os
+import shutil
+from contextlib import contextmanager
+from os.path import join, exists
+
+# Folder of the cache. Not defined means no cache.
+SCIPION_DOWNLOAD_CACHE = 'SCIPION_DOWNLOAD_CACHE'
+# Maximum size of the cache, in GB
+SCIPION_DOWNLOAD_CACHE_SIZE = 'SCIPION_DOWNLOAD_CACHE_SIZE'
+DEFAULT_CACHE_SIZE = 50
+
+# ioctl to clone a file sharing its blocks (btrfs, xfs...)
+FICLONE = 0x40049409
+
+GB = 1024 ** 3
+
+
+def sha256sum(path, blockSize=1024 * 1024):
+    """ Returns the sha256 hex digest of the file in path """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def linkFile(src, dst):
+    """ Make dst have the content of src without copying it if possible:
+    hardlink, then reflink, then a plain copy. """
+    if exists(dst) or os.path.islink(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass  # Most likely a different file system
+
+    try:
+        with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        return
+    except OSError:
+        pass
+
+    shutil.copyfile(src, dst)
+
+
+class DownloadCache:
+    """ Folder with the downloaded files, safe to be used by several
+    installations at the same time. """
+
+    def __init__(self, path, maxSize=DEFAULT_CACHE_SIZE * GB):
+        self._path = path
+        self._maxSize = maxSize
+        for folder in [self._getDataFolder(), self._getLocksFolder()]:
+            os.makedirs(folder, exist_ok=True)
+
+    @classmethod
+    def fromEnviron(cls):
+        """ Returns the cache configured in the environment or None if there
+        is no cache configured. """
+        path = os.environ.get(SCIPION_DOWNLOAD_CACHE, '')
+        if not path:
+            return None
+        maxSize = float(os.environ.get(SCIPION_DOWNLOAD_CACHE_SIZE,
+                                       DEFAULT_CACHE_SIZE))
+        return cls(os.path.expanduser(path), int(maxSize * GB))
+
+    def getPath(self):
+        return self._path
+
+    def _getDataFolder(self):
+        return join(self._path, 'data')
+
+    def _getLocksFolder(self):
+        return join(self._path, 'locks')
+
+    @staticmethod
+    def getKey(url, sha256=None):
+        """ Returns the key of an entry: a hash of the url and the checksum """
+        return hashlib.sha256(('%s\n%s' % (url, sha256 or '')).encode()).hexdigest()
+
+    def getEntry(self, key):
+        """ Returns the path of the file for the given key """
+        return join(self._getDataFolder(), key)
+
+    @contextmanager
+    def _lock(self, name, blocking=True):
+        """ Hold an exclusive lock between processes on name. Yield False if
+        not blocking and the lock is held by someone else. """
+        with open(join(self._getLocksFolder(), name + '.lock'), 'w') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def lookup(self, url, sha256=None, dest=None):
+        """ Returns the path of the cached file for url or None, and marks
+        it as recently used.
+
+        :param dest: Optional, path where the cached file is linked to. It
+            is returned instead of the entry, which another installation may
+            evict while it is being read.
+        """
+        key = self.getKey(url, sha256)
+        entry = self.getEntry(key)
+        with self._lock(key):
+            if not exists(entry):
+                return None
+            os.utime(entry)
+            if dest is None:
+                return entry
+            linkFile(entry, dest)
+            return dest
+
+    def fetch(self, url, dest, download, sha256=None):
+        """ Make dest have the content of url, downloading it into the cache
+        only if it is not already there.
+
+        :param url: url of the file
+        :param dest: path where the file is needed
+        :param download: function(url, path) that downloads url into path,
+            checking its sha256 if there is one
+        :param sha256: Optional, expected sha256 of the file
+        :returns True if the file was already in the cache
+        """
+        key = self.getKey(url, sha256)
+        entry = self.getEntry(key)
+
+        with self._lock(key):
+            cached = exists(entry)
+            if not cached:
+                tmp = '%s.%d.tmp' % (entry, os.getpid())
+                try:
+                    download(url, tmp)
+                    os.replace(tmp, entry)
+                finally:
+                    if exists(tmp):
+                        os.remove(tmp)
+            # Mark as recently used
+            os.utime(entry)
+            linkFile(entry, dest)
+
+        if not cached:
+            self.evict()
+        return cached
+
+    @contextmanager
+    def writer(self, url, sha256=None):
+        """ Yield a file where the content of url is written while it is
+        being used for something else, e.g. extracted. It is added to the
+        cache only if the block finishes without errors. """
+        key = self.getKey(url, sha256)
+        entry = self.getEntry(key)
+        tmp = '%s.%d.tmp' % (entry, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                yield f
+            with self._lock(key):
+                os.replace(tmp, entry)
+        finally:
+            if exists(tmp):
+                os.remove(tmp)
+        self.evict()
+
+    def getSize(self):
+        """ Returns the total size in bytes of the cached files """
+        folder = self._getDataFolder()
+        return sum(os.path.getsize(join(folder, f)) for f in os.listdir(folder))
+
+    def evict(self):
+        """ Remove the least recently used files until the cache fits
+        in its maximum size. Entries in use are not removed. """
+        with self._lock('evict', blocking=False) as locked:
+            if not locked:
+                return  # Another process is already cleaning
+
+            folder = self._getDataFolder()
+            entries = []
+            for name in os.listdir(folder):
+                if '.' in name:
+                    continue  # Download in progress
+                st = os.stat(join(folder, name))
+                entries.append((st.st_mtime, st.st_size, name))
+
+            total = sum(e[1] for e in entries)
+            for mtime, size, name in sorted(entries):
+                if total <= self._maxSize:
+                    break
+                with self._lock(name, blocking=False) as free:
+                    if free:
+                        # Installs already linked keep their own copy
+                        os.remove(join(folder, name))
+                        total -= size
@@ -31,13 +31,23 @@ logger = logging.getLogger(__name__)
 import os
 import platform
 import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
 from glob import glob
 from os.path import join, exists, islink, abspath
-from subprocess import STDOUT, call
+from subprocess import STDOUT, call, Popen
 
 from pyworkflow import Config
 import pwem
+from .build_report import BuildReport, getMaxRssKb
+from .build_state import BuildState, BUILD_STATE_FILE, hashCommand
+from .download_cache import DownloadCache
+from .jobserver import getDefaultJobs, sharedJobServer
+from .mirror import getMirror, getBinaryFile
+from .wheelhouse import getPipInstallOptions
 from typing import List, Tuple, Dict
 
 
@@ -47,6 +57,29 @@ WINDOWS = (platform.system() == 'Windows')
 LINUX = (platform.system() == 'Linux')
 VOID_TGZ = "void.tgz"
 
+# Set it to 1 (true, on, yes) to extract the packages while they are
+# downloaded, unless stream=False is passed to addPackage/addLibrary
+SCIPION_STREAM_DOWNLOADS = 'SCIPION_STREAM_DOWNLOADS'
+
+# Number of targets installed at the same time when --parallel is not passed
+SCIPION_INSTALL_PARALLEL = 'SCIPION_INSTALL_PARALLEL'
+
+# The working directory is shared by all the threads of the process. Any
+# chdir, and anything resolving relative paths or spawning processes that
+# inherit the current directory, has to hold this lock.
+_cwdLock = threading.Lock()
+# Serializes the output of targets installed concurrently
+_outputLock = threading.Lock()
+# Lock of each target (by software folder and name), so the environments of
+# several plugins installed at the same time do not build the same one at once
+_targetLocks = {}
+_targetLocksLock = threading.Lock()
+
+
+def _getTargetLock(software, name):
+    with _targetLocksLock:
+        return _targetLocks.setdefault((abspath(software), name), threading.Lock())
+
 
 def ansi(n):
     """Return function that escapes text with ANSI color n."""
@@ -60,6 +93,12 @@ black, red, green, yellow, blue, magenta, cyan, white = map(ansi, range(30, 38))
 # with all python versions (and so it is simplified).
 
 
+def _formatDuration(dt):
+    if dt < 60:
+        return '%.2f seconds' % dt
+    return '%d m %02d s' % (dt / 60, int(dt) % 60)
+
+
 def progInPath(prog):
     """ Is program prog in PATH? """
     for base in os.environ.get('PATH', '').split(os.pathsep):
@@ -102,24 +141,93 @@ class Command:
         self._out = kwargs.get('out', None)
         self._always = kwargs.get('always', False)
         self._environ = kwargs.get('environ', None)
+        # What the command does, for its key, when it can be done in several
+        # ways that do not change the result (e.g. downloads): list of steps
+        self._recipe = kwargs.get('recipe', None)
+        self._stats = {}  # Measured in the last execution
 
     def _existsAll(self):
         """ Return True if all targets exist. """
-        for t in self._targets:
-            if not glob(t):
-                return False
+        with _cwdLock:
+            for t in self._targets:
+                if not glob(t):
+                    return False
         return True
 
+    def isAlways(self):
+        return self._always
+
+    def getKey(self, previousKey, root=None):
+        """ Returns the key of this command in the build state, see
+        build_state.hashCommand """
+        if self._recipe is not None:
+            for step in self._recipe:
+                previousKey = hashCommand(previousKey, step, root=root)
+            return previousKey
+        return hashCommand(previousKey, self.getDescription(), self._targets,
+                           self._cwd, self._environ, root)
+
+    def getDescription(self):
+        """ Returns the command as a string that does not change
+        from one run to another. """
+        def describe(cmd):
+            if isinstance(cmd, str):
+                return cmd
+            if hasattr(cmd, '__qualname__'):  # a function
+                return '%s.%s' % (cmd.__module__, cmd.__qualname__)
+            return str(cmd)
+
+        if isinstance(self._cmd, str) or callable(self._cmd):
+            desc = describe(self._cmd)
+        else:
+            desc = '\n'.join(describe(c) for c in self._cmd)
+        if self._out is not None:
+            desc += ' > %s' % self._out
+        return desc
+
+    def getTargetsState(self):
+        """ Returns a list of [path, mtime] for the files matching the
+        targets. The mtime of folders is None, since it changes when
+        later commands write into them. """
+        state = []
+        with _cwdLock:
+            for t in self._targets:
+                for path in sorted(glob(t)):
+                    mtime = None if os.path.isdir(path) else os.path.getmtime(path)
+                    state.append([path, mtime])
+        return state
+
+    def getStats(self):
+        """ Returns a dict with what was measured in the last execution:
+        wallTime, cpu time (cpuUser, cpuSystem) and peak memory (maxRssKb)
+        of the child processes, bytesDownloaded and exit status. """
+        return dict(self._stats)
+
     def execute(self):
+        """ Execute the command unless all its targets exist.
+        Returns None if it was skipped, otherwise the exit code of the
+        last failing command (0 if all of them succeeded). """
+        self._stats = {'wallTime': 0, 'cpuUser': 0, 'cpuSystem': 0,
+                       'maxRssKb': 0, 'bytesDownloaded': 0}
+        t1 = time.time()
+        status = 1  # If it exits before finishing
+        try:
+            status = self._execute()
+        finally:
+            self._stats.update(wallTime=time.time() - t1, status=status,
+                               skipped=status is None)
+        return status
+
+    def _execute(self):
+        out = self._env.getOutput()
+        status = 0
         if not self._always and self._targets and self._existsAll():
-            print("  Skipping command: %s" % cyan(self._cmd))
-            print("  All targets %s exist." % self._targets)
+            print("  Skipping command: %s" % cyan(self._cmd), file=out)
+            print("  All targets %s exist." % self._targets, file=out)
+            return None
         else:
-            cwd = os.getcwd()
             if self._cwd is not None:
-                if not self._env.showOnly:
-                    os.chdir(self._cwd)
-                print(cyan("cd %s" % self._cwd))
+                print(cyan("cd %s" % self._cwd), file=out)
 
             # Actually allow self._cmd to be a list or a
             # '\n'-separated list of commands, and run them all.
@@ -135,25 +243,71 @@ class Command:
                     cmd += ' > %s 2>&1' % self._out
                     # TODO: more general, this only works for bash.
 
-                print(cyan(cmd))
+                print(cyan(cmd), file=out)
 
                 if self._env.showOnly:
                     continue  # we don't really execute the command here
 
                 if callable(cmd):  # cmd could be a function: call it
-                    cmd()
+                    downloaded = getattr(cmd, 'bytesDownloaded', 0)
+                    self._callInCwd(cmd)
+                    self._stats['bytesDownloaded'] += getattr(cmd, 'bytesDownloaded', 0) - downloaded
                 else:  # if not, it's a command: make a system call
-                    call(cmd, shell=True, env=self._environ,
-                         stdout=sys.stdout, stderr=sys.stderr)
+                    out.flush()
+                    status = self._run(cmd, out) or status
 
-            # Return to working directory, useful when we change dir
-            # before executing the command.
-            os.chdir(cwd)
             if not self._env.showOnly:
-                for t in self._targets:
-                    if not glob(t):
-                        print(red("ERROR: File or folder '%s' not found after running '%s'." % (t, cmd)))
-                        sys.exit(1)
+                with _cwdLock:
+                    missing = [t for t in self._targets if not glob(t)]
+                for t in missing:
+                    print(red("ERROR: File or folder '%s' not found after running '%s'." % (t, cmd)), file=out)
+                    sys.exit(1)
+        return status
+
+    def _run(self, cmd, out):
+        """ Run cmd in a shell holding a job of the jobserver, which is
+        passed to make through MAKEFLAGS. Returns its exit code. """
+        jobServer = self._env.getJobServer()
+        if jobServer is None:
+            environ, fds = self._environ, ()
+        else:
+            environ, fds = jobServer.getEnviron(self._environ), jobServer.getFds()
+
+        with jobServer.job() if jobServer else nullcontext():
+            # Other threads may be in a different folder for a
+            # moment, so the process is spawned holding the lock.
+            with _cwdLock:
+                process = Popen(cmd, shell=True, env=environ, cwd=self._cwd,
+                                stdout=out, stderr=out, pass_fds=fds)
+            return self._wait(process)
+
+    def _wait(self, process):
+        """ Wait for process to finish and add the resources used by it
+        and its children to the stats. Returns its exit code. """
+        if not hasattr(os, 'wait4'):
+            return process.wait()
+        _, waitStatus, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(waitStatus)
+        self._stats['cpuUser'] += rusage.ru_utime
+        self._stats['cpuSystem'] += rusage.ru_stime
+        self._stats['maxRssKb'] = max(self._stats['maxRssKb'], getMaxRssKb(rusage))
+        return process.returncode
+
+    def _callInCwd(self, func):
+        """ Call func from self._cwd. Functions (e.g. Link) work with paths
+        relative to it, so we need to change the process working directory
+        and return to the previous one afterwards. """
+        if self._cwd is None:
+            func()  # Nothing to change, do not block other threads
+            return
+
+        with _cwdLock:
+            cwd = os.getcwd()
+            try:
+                os.chdir(self._cwd)
+                func()
+            finally:
+                os.chdir(cwd)
 
     def __repr__(self):
         return self.__str__()
@@ -171,6 +325,7 @@ class Target:
         self._commandList = list(commands)  # copy the list/tuple of commands
         self._finalCommands = []  # their targets will be used to check if we need to re-build
         self._deps = []  # names of dependency targets
+        self._artifact = None  # (root, folders, commands after restoring, relocatable)
 
     def getCommands(self):
         return self._commandList
@@ -208,21 +363,172 @@ class Target:
         return self._name
 
     def execute(self):
+        # Another environment of this process may be installing it, then
+        # it is found installed once it finishes
+        with _getTargetLock(self._env.getSoftware(), self._name):
+            self._execute()
+
+    def _execute(self):
         t1 = time.time()
+        out = self._env.getOutput()
 
-        print(green("Installing %s ..." % self._name))
-        if not self._always and self._existsAll():
-            print("  All targets exist, skipping.")
+        print(green("Installing %s ..." % self._name), file=out)
+        if (not self._always and not self._env.isForced()
+                and self._existsAll() and not self._recipeChanged()):
+            print("  All targets exist, skipping.", file=out)
+            self._report(time.time() - t1, 'skipped')
         else:
-            for command in self._commandList:
-                command.execute()
+            status = 'failed'  # If it exits before finishing
+            try:
+                if self._restoreArtifact():
+                    status = 'done'
+                elif self._executeCommands():
+                    # Only what was built without errors is shared
+                    self._saveArtifact()
+                    status = 'done'
+            finally:
+                self._report(time.time() - t1, status)
+            if self._useBuildState():
+                self._env.getBuildState().setTargetTime(self._name, time.time() - t1)
 
         if not self._env.showOnly:
-            dt = time.time() - t1
-            if dt < 60:
-                print(green('Done (%.2f seconds)' % dt))
+            print(green('Done (%s)' % _formatDuration(time.time() - t1)), file=out)
+
+    def _executeCommands(self):
+        """ Execute the commands of the target, skipping the ones that the
+        build state records as done, as long as none of the previous ones
+        has been executed again. Returns True if none of them failed. """
+        out = self._env.getOutput()
+        useState = self._useBuildState()
+        key = self._name  # Each key depends on the previous commands
+        executed = self._env.isForced()
+        ok = True
+
+        for command in self._commandList:
+            key = command.getKey(key)
+            if not useState:
+                ok = not self._executeCommand(command) and ok
+                continue
+
+            state = self._env.getBuildState()
+            if (not executed and not command.isAlways()
+                    and state.isDone(key, command.getTargetsState())):
+                print("  Skipping command: %s" % cyan(command.getDescription()), file=out)
+                print("  Done in a previous run.", file=out)
+                continue
+
+            status = self._executeCommand(command)
+            executed = executed or status is not None
+            if not status:
+                state.setDone(key, self._name, command.getDescription(),
+                              command.getTargetsState())
             else:
-                print(green('Done (%d m %02d s)' % (dt / 60, int(dt) % 60)))
+                ok = False
+        return ok
+
+    def _executeCommand(self, command):
+        """ Execute command, adding what it took to the build report """
+        try:
+            return command.execute()
+        finally:
+            report = self._env.getBuildReport()
+            if report is not None and not self._env.showOnly:
+                report.addCommand(self._name, command.getDescription(),
+                                  command.getStats())
+
+    def _report(self, wallTime, status):
+        report = self._env.getBuildReport()
+        if report is not None and not self._env.showOnly:
+            report.addTarget(self._name, wallTime, status,
+                             sorted(self._env.getTargetDeps(self)))
+
+    def _useBuildState(self):
+        return not (self._always or self._env.showOnly)
+
+    def getRecipeKey(self, root=None):
+        """ Returns a hash of the name of the target and all its commands,
+        i.e. the key of its last command in the build state.
+
+        :param root: Optional, folder that does not change the key if the
+            commands are the same in another folder
+        """
+        key = self._name
+        for command in self._commandList:
+            key = command.getKey(key, root)
+        return key
+
+    def _recipeChanged(self):
+        """ Returns True if the commands of the target are not the ones that
+        were executed the last time it was installed. """
+        if not self._useBuildState() or not self._commandList:
+            return False
+        state = self._env.getBuildState()
+        # Targets installed before having a build state are left alone
+        return (state.hasTarget(self._name)
+                and not state.hasKey(self.getRecipeKey()))
+
+    def setArtifact(self, root, folders, commands=(), relocatable=False):
+        """ Let the target be taken from the artifact cache, if there is one.
+
+        :param root: folder where the target is built, e.g. software/em
+        :param folders: folders, relative to root, with everything the
+            target builds. They are packed after building the target.
+        :param commands: commands to execute after unpacking the folders
+            instead of building them, e.g. the Link
+        :param relocatable: True if what the target builds does not hold
+            the path of the software folder (rpaths, shebangs, --prefix...),
+            so it can be taken by installations in other folders
+        """
+        self._artifact = (root, folders, commands, relocatable)
+
+    def _getArtifactCache(self):
+        if self._artifact is None or self._env.showOnly:
+            return None
+        return self._env.getArtifactCache()
+
+    def _getArtifactKey(self, cache):
+        software = abspath(self._env.getSoftware())
+        if self._artifact[3]:
+            # The same for any SCIPION_HOME
+            return cache.getKey(self.getRecipeKey(software))
+        return cache.getKey(self.getRecipeKey(), software)
+
+    def _restoreArtifact(self):
+        """ Take the target from the artifact cache.
+        Returns False if it is not there. """
+        cache = self._getArtifactCache()
+        if cache is None or self._env.isForced():
+            return False
+
+        out = self._env.getOutput()
+        root, folders, commands, _ = self._artifact
+        try:
+            if not cache.restore(self._getArtifactKey(cache), root):
+                return False
+        except Exception as e:
+            print(yellow("Could not take %s from the artifact cache: %s"
+                         % (self._name, e)), file=out)
+            return False
+
+        print("  Taken from the artifact cache (%s)" % cache.getStore(), file=out)
+        for command in commands:
+            self._executeCommand(command)
+        return True
+
+    def _saveArtifact(self):
+        """ Pack the target into the artifact cache """
+        cache = self._getArtifactCache()
+        if cache is None:
+            return
+
+        out = self._env.getOutput()
+        root, folders, _, _ = self._artifact
+        try:
+            cache.save(self._getArtifactKey(cache), root, folders)
+            print("  Saved into the artifact cache (%s)" % cache.getStore(), file=out)
+        except Exception as e:
+            print(yellow("Could not save %s into the artifact cache: %s"
+                         % (self._name, e)), file=out)
 
     def __str__(self):
         return "Name: %s, default: %s, always: %s, commands: %s, final commands: %s, deps: %s." %(
@@ -243,25 +549,62 @@ class Environment:
 
         self._args = kwargs.get('args', [])
         self.showOnly = '--show' in self._args
+        # Run again the commands recorded as done in the build state
+        self._force = '--force' in self._args
+        self._buildState = None
+
+        # JSON lines file where the time and resources used are written
+        if '--build-report' in self._args:
+            r = self._args.index('--build-report')
+            self._buildReport = BuildReport(os.path.abspath(self._args[r + 1]))
+        else:
+            self._buildReport = None
 
-        # Find if the -j arguments was passed to get the number of processors
+        # Find if the -j arguments was passed to get the number of processors,
+        # the budget of jobs for all the targets. By default as many as the
+        # cores and the available memory allow.
         if '-j' in self._args:
             j = self._args.index('-j')
             self._processors = int(self._args[j + 1])
         else:
-            self._processors = 1
+            self._processors = getDefaultJobs()
+        self._jobServer = None
+
+        # Number of independent targets that can be installed concurrently,
+        # at least one
+        if '--parallel' in self._args:
+            p = self._args.index('--parallel')
+            self._parallel = int(self._args[p + 1])
+        else:
+            self._parallel = int(os.environ.get(SCIPION_INSTALL_PARALLEL, 1))
+        self._parallel = max(1, self._parallel)
+
+        # Output stream of the target being executed by each thread
+        self._threadData = threading.local()
 
         if LINUX:
             self._libSuffix = 'so'  # Shared libraries extension name
         else:
             self._libSuffix = 'dylib'
 
-        self._downloadCmd = ('wget -nv -c -O %(tar)s.part %(url)s\n'
-                             'mv -v %(tar)s.part %(tar)s')
         # Removed the z: "The tar command auto-detects compression type and extracts the archive"
         # From https://linuxize.com/post/how-to-extract-unzip-tar-bz2-file/#extracting-tarbz2-file
         self._tarCmd = 'tar -xf %s'
-        self._pipCmd = kwargs.get('pipCmd', 'pip install %s==%s')
+        self._pipCmd = kwargs.get('pipCmd', 'pip install %s%%s==%%s' %
+                                   getPipInstallOptions().replace('%', '%%'))
+        # Requirements of the pip modules added, to build their wheels
+        self._pipModules = []
+        # Files downloaded by the targets, to build mirrors
+        self._downloads = []
+        # Downloads shared with other installations, if configured
+        self._downloadCache = DownloadCache.fromEnviron()
+        # Packages already built by other installations, if configured.
+        # Imported here so "python -m scipion.install.artifact_cache"
+        # does not find it already imported by the package
+        from .artifact_cache import ArtifactCache
+        self._artifactCache = ArtifactCache.fromEnviron()
+        self._streamDownloads = (os.environ.get(SCIPION_STREAM_DOWNLOADS, '').lower()
+                                 in ['1', 'true', 'on', 'yes'])
 
     def getLibSuffix(self):
         return self._libSuffix
@@ -269,6 +612,43 @@ class Environment:
     def getProcessors(self):
         return self._processors
 
+    def getJobServer(self):
+        """ Returns the make jobserver shared by all the commands while the
+        targets are executed (see _executeTargets). None otherwise, and in
+        Windows. """
+        return self._jobServer
+
+    def getDownloadCache(self):
+        return self._downloadCache
+
+    def getArtifactCache(self):
+        return self._artifactCache
+
+    def isForced(self):
+        return self._force
+
+    def getBuildState(self):
+        """ Returns the BuildState with the commands done in previous runs,
+        opening it the first time. """
+        if self._buildState is None:
+            with _cwdLock:
+                if self._buildState is None:
+                    self._buildState = BuildState(self.getSoftware(BUILD_STATE_FILE))
+        return self._buildState
+
+    def getBuildReport(self):
+        """ Returns the BuildReport passed with --build-report, or None """
+        return self._buildReport
+
+    def getParallel(self):
+        """ Returns the maximum number of targets executed at the same time """
+        return self._parallel
+
+    def getOutput(self):
+        """ Returns the stream where the target being executed by the current
+        thread has to write its output. """
+        return getattr(self._threadData, 'output', sys.stdout)
+
     @staticmethod
     def getSoftware(*paths):
         return os.path.join(Config.SCIPION_SOFTWARE, *paths)
@@ -358,6 +738,11 @@ class Environment:
     def hasTarget(self, name):
         return name in self._targetDict
 
+    def getTargetDeps(self, target):
+        """ Returns the set of names of the dependencies of target, with
+        the aliases resolved. """
+        return {self._targetDict[x].getName() for x in target.getDeps()}
+
     def getTargets(self):
         return self._targetList
 
@@ -384,6 +769,8 @@ class Environment:
         This is the base for addLibrary, addModule and addPackage.
 
         :param createBuildDir:  If true tar extraction will specify an extraction dir. Use this for plain tgz, tars, ...use with target
+        :param stream: If true the tar file is extracted while it is downloaded, without saving it.
+                       Default is True if SCIPION_STREAM_DOWNLOADS is 1 (true, on, yes).
 
         """
         # Use reasonable defaults.
@@ -413,14 +800,36 @@ class Environment:
         if os.path.isfile(tarFile) and os.path.getsize(tarFile) == 0:
             os.remove(tarFile)
 
+        finalTarget = join(downloadDir, kwargs.get('target', buildDir))
+        stream = kwargs.get('stream', self._streamDownloads)
+
+        # The file, not where it comes from or how, is part of the recipe of
+        # the target, so a mirror or streaming do not make it build again
+        downloadRecipe = 'download %s %s' % (tar, kwargs.get('sha256') or '')
+        extractRecipe = 'extract %s%s' % (tar, ' into %s' % buildDir if createBuildDir else '')
+
+        if not url.startswith('file:'):
+            self.addDownload(url, tar, kwargs.get('sha256'))
+            mirror = getMirror()
+            if mirror is not None:  # Offline, only from the mirror
+                url = 'file:' + getBinaryFile(mirror, url, tar)
+
         if url.startswith('file:'):
             t.addCommand('ln -s %s %s' % (url.replace('file:', ''), tar),
                          targets=tarFile,
-                         cwd=downloadDir)
+                         cwd=downloadDir, recipe=[downloadRecipe])
+        elif stream and tar != VOID_TGZ:
+            # Download and extraction are a single step. Its target is the
+            # extracted folder since the tar file is never written.
+            extractDir = buildPath if createBuildDir else downloadDir
+            t.addCommand(DownloadExtract(self, url, tarFile, extractDir,
+                                         kwargs.get('sha256')),
+                         targets=finalTarget, recipe=[downloadRecipe, extractRecipe])
+            logger.debug("Target added: %s" % t)
+            return t
         else:
-            t.addCommand(self._downloadCmd % {'tar': tarFile, 'url': url},
-                         targets=tarFile)
-
+            t.addCommand(Download(self, url, tarFile, kwargs.get('sha256')),
+                         targets=tarFile, recipe=[downloadRecipe])
 
         tarCmd = self._tarCmd % tar
 
@@ -433,10 +842,9 @@ class Environment:
             else:
                 tarCmd = 'mkdir {0} && {1} -C {2}'.format(buildPath,tarCmd, buildDir)
 
-        finalTarget = join(downloadDir, kwargs.get('target', buildDir))
         t.addCommand(tarCmd,
                      targets=finalTarget,
-                     cwd=downloadDir)
+                     cwd=downloadDir, recipe=[extractRecipe])
 
         logger.debug("Target added: %s" % t)
 
@@ -518,7 +926,9 @@ class Environment:
                          out=self.getLogFolder('%s_cmake.log' % name),
                          environ=environ)
 
-        t.addCommand('make -j %d' % self._processors,
+        # make takes the jobs from the jobserver, if there is one
+        makeCmd = 'make -j %d' % self._processors if WINDOWS else 'make'
+        t.addCommand(makeCmd,
                      cwd=t.buildPath,
                      out=self.getLogFolder('%s_make.log' % name))
 
@@ -549,6 +959,7 @@ class Environment:
 
         target = name if target is None else target
         pipCmd = pipCmd or self._pipCmd % (name, version)
+        self._pipModules.append('%s==%s' % (name, version) if version else name)
         t = self.addTarget(name, default=default, always=True)  # we set always=True to let pip decide if updating
 
         # Add the dependencies
@@ -564,6 +975,20 @@ class Environment:
 
         return t
 
+    def getPipModules(self):
+        """ Returns the requirements (name==version) of the pip modules added """
+        return list(self._pipModules)
+
+    def getDownloads(self):
+        """ Returns the (url, tar file name, sha256) of the files downloaded
+        by the targets added """
+        return list(self._downloads)
+
+    def addDownload(self, url, tar, sha256=None):
+        """ Records a file downloaded by the targets, e.g. to copy it into a
+        mirror (see getDownloads) """
+        self._downloads.append((url, tar, sha256))
+
     def addPackage(self, name, **kwargs):
         """ Download a package tgz, untar it and create a link in software/em. Params in kwargs:
 
@@ -574,6 +999,11 @@ class Environment:
             :param neededProgs: Optional, list of programs needed. E.g: make, cmake,...
             :param version: Optional, version of the package.
             :param libChecks: Optional, a list of the libraries needed. E.g: libjpeg62, gsl (GSL - GNU Scientific Library)
+            :param sha256: Optional, expected sha256 of the tar file. Identifies the file in the download cache.
+            :param artifact: Optional, if False the package is never taken from the artifact cache
+                             (SCIPION_ARTIFACT_CACHE). By default True unless its commands use conda.
+            :param relocatable: Optional, True if the built package does not depend on the folder it is
+                                installed in. It is then shared with installations in other folders.
 
         """
         # Add to the list of available packages, for reference (used in --help).
@@ -651,18 +1081,27 @@ class Environment:
             for t in tgt:
                 # Check for empty targets and warn about them
                 if not t:
-                    print("WARNING: Target empty for command %s" % cmd)
+                    print("WARNING: Target empty for command %s" % cmd, file=self.getOutput())
 
                 normTgt.append(join(target.targetPath, t))
 
             target.addCommand(cmd, targets=normTgt, cwd=target.buildPath,
                               final=True, environ=environ)
 
-        target.addCommand(Command(self, Link(extName, targetDir),
-                                  targets=[self.getEm(extName),
-                                           self.getEm(targetDir)],
-                                  cwd=self.getEm('')),
-                          final=True)
+        link = target.addCommand(Command(self, Link(extName, targetDir, self),
+                                         targets=[self.getEm(extName),
+                                                  self.getEm(targetDir)],
+                                         cwd=self.getEm('')),
+                                 final=True)
+
+        # Conda environments are created out of software/em, so
+        # they can not be packed with the rest of the package
+        usesConda = any('conda' in str(cmd) for cmd, _ in commands)
+        if kwargs.get('artifact', not usesConda):
+            folders = {os.path.normpath(x).split(os.sep)[0]
+                       for x in (buildDir, targetDir)}
+            target.setArtifact(self.getEmFolder(), sorted(folders), [link],
+                               kwargs.get('relocatable', False))
 
         # Create an alias with the name for that version
         # this implies that the last package version added will be
@@ -703,28 +1142,205 @@ class Environment:
                 continue
             nodes.extend((lvl + 1, self._targetDict[x]) for x in tgt.getDeps())
 
-    def _executeTargets(self, targetList):
-        """ Execute the targets in targetList, running all their
-        dependencies first.
+    def _showTargetTimes(self, targetList):
+        """ Print the tree of dependencies annotated with the time each
+        target took the last time it was installed, the critical path,
+        the estimated speedup with several workers and the targets that
+        block most of the work.
         """
-        executed = set()  # targets already executed
+        targets = self._sortTargets(targetList)
+        times = self.getBuildState().getTargetTimes()
+        durations = {t.getName(): times.get(t.getName(), 0) for t in targets}
+
+        def timeStr(name):
+            return _formatDuration(times[name]) if name in times else '?'
+
+        blocked = self._getBlockedTimes(targets, durations)
+        nodes = [(0, tgt) for tgt in targetList[::-1]]
+        while nodes:
+            lvl, tgt = nodes.pop()
+            name = tgt.getName()
+            print("%s- %s (%s)" % ("  " * lvl, name, timeStr(name)))
+            nodes.extend((lvl + 1, self._targetDict[x]) for x in tgt.getDeps())
+
+        unknown = [t.getName() for t in targets if t.getName() not in times]
+        if unknown:
+            print("\n" + yellow("No recorded time for: %s (taken as 0)" % ', '.join(unknown)))
+
+        total = sum(durations.values())
+        path = self._getCriticalPath(targets, durations)
+        pathTime = sum(durations[x] for x in path)
+        print("\nTotal time: %s" % _formatDuration(total))
+        print("Critical path (%s): %s" % (_formatDuration(pathTime),
+                                          ' -> '.join(path)))
+
+        print("\nWorkers  Time        Speedup")
+        for workers in sorted(w for w in {1, 2, 4, 8, self._parallel} if w >= 1):
+            makespan = self._getMakespan(targets, durations, workers)
+            print("%7d  %-10s  %.2f" % (workers, _formatDuration(makespan),
+                                        total / makespan if makespan else 1))
+        if pathTime:
+            print("Maximum speedup: %.2f" % (total / pathTime))
+
+        print("\nTargets blocking most work:")
+        for name in sorted(blocked, key=blocked.get, reverse=True)[:10]:
+            if blocked[name]:
+                print("  %-30s %s" % (name, _formatDuration(blocked[name])))
+
+    def _getCriticalPath(self, targets, durations):
+        """ Returns the names of the targets in the longest chain of
+        dependencies, taking durations as the time of each target.
+        Targets must be sorted by dependencies. """
+        finish = {}  # name: (time when it can finish, previous in the chain)
+        for tgt in targets:
+            name = tgt.getName()
+            prev = max(self.getTargetDeps(tgt), key=lambda x: finish[x][0],
+                       default=None)
+            start = finish[prev][0] if prev else 0
+            finish[name] = (start + durations[name], prev)
+
+        name = max(finish, key=lambda x: finish[x][0], default=None)
+        path = []
+        while name:
+            path.append(name)
+            name = finish[name][1]
+        return path[::-1]
+
+    def _getBlockedTimes(self, targets, durations):
+        """ Returns the time of all the targets that depend, directly or not,
+        on each target. Targets must be sorted by dependencies. """
+        dependants = {t.getName(): set() for t in targets}
+        for tgt in targets[::-1]:
+            name = tgt.getName()
+            for dep in self.getTargetDeps(tgt):
+                dependants[dep] |= dependants[name] | {name}
+        return {name: sum(durations[x] for x in deps)
+                for name, deps in dependants.items()}
+
+    def _getMakespan(self, targets, durations, workers):
+        """ Returns the time to install the targets with that many workers,
+        starting them in the same order as _executeTargets. Targets must be
+        sorted by dependencies. """
+        pendingDeps = {t.getName(): self.getTargetDeps(t) for t in targets}
+        ready = [t.getName() for t in targets if not pendingDeps[t.getName()]]
+        running = []  # (finish time, name)
+        now = 0
+        while ready or running:
+            while ready and len(running) < workers:
+                name = ready.pop(0)
+                running.append((now + durations[name], name))
+            running.sort()
+            now, done = running.pop(0)
+            for tgt in targets:
+                deps = pendingDeps[tgt.getName()]
+                if done in deps:
+                    deps.discard(done)
+                    if not deps:
+                        ready.append(tgt.getName())
+        return now
+
+    def _sortTargets(self, targetList):
+        """ Return the targets in targetList and all their dependencies,
+        sorted so that every target comes after its dependencies.
+        Raise RuntimeError if there is a cyclic dependency.
+        """
+        sortedTargets = []
+        visited = set()  # targets already sorted
         exploring = set()  # targets whose dependencies we are exploring
-        targets = targetList[::-1]
+        # Stack of (target, dependencies already pushed)
+        targets = [(tgt, False) for tgt in targetList[::-1]]
         while targets:
-            tgt = targets.pop()
-            if tgt.getName() in executed:
+            tgt, expanded = targets.pop()
+            name = tgt.getName()
+            if expanded:
+                exploring.discard(name)
+                if name not in visited:
+                    visited.add(name)
+                    sortedTargets.append(tgt)
                 continue
-            deps = tgt.getDeps()
-            if set(deps) - executed:  # there are dependencies not yet executed
-                if tgt.getName() in exploring:
-                    raise RuntimeError("Cyclic dependency on %s" % tgt)
-                exploring.add(tgt.getName())
-                targets.append(tgt)
-                targets.extend(self._targetDict[x] for x in deps)
-            else:
+            if name in visited:
+                continue
+            if name in exploring:
+                raise RuntimeError("Cyclic dependency on %s" % tgt)
+            exploring.add(name)
+            targets.append((tgt, True))
+            targets.extend((self._targetDict[x], False)
+                           for x in tgt.getDeps()[::-1])
+        return sortedTargets
+
+    def _executeTargets(self, targetList):
+        """ Execute the targets in targetList, running all their
+        dependencies first. Up to getParallel() targets whose dependencies
+        are satisfied are executed at the same time. Their commands take
+        their jobs from the jobserver of this process meanwhile.
+        """
+        jobServer = nullcontext() if WINDOWS else sharedJobServer(self._processors)
+        with jobServer as self._jobServer:
+            try:
+                self._runTargets(targetList)
+            finally:
+                self._jobServer = None
+
+    def _runTargets(self, targetList):
+        """ Execute the targets, see _executeTargets """
+        targets = self._sortTargets(targetList)
+        if self._buildReport is not None and not self.showOnly:
+            self._buildReport.addGraph({t.getName(): sorted(self.getTargetDeps(t))
+                                        for t in targets})
+
+        if self._parallel <= 1:
+            for tgt in targets:
                 tgt.execute()
-                executed.add(tgt.getName())
-                exploring.discard(tgt.getName())
+            return
+
+        # Names of the dependencies not executed yet, for each target
+        pendingDeps = {tgt.getName(): self.getTargetDeps(tgt) for tgt in targets}
+        ready = [tgt for tgt in targets if not pendingDeps[tgt.getName()]]
+        running = {}
+        error = None
+
+        with ThreadPoolExecutor(max_workers=self._parallel) as pool:
+            while ready or running:
+                # Do not start new targets once one of them has failed
+                while ready and error is None:
+                    tgt = ready.pop(0)
+                    running[pool.submit(self._executeCaptured, tgt)] = tgt
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future).getName()
+                    try:
+                        future.result()
+                    except BaseException as e:  # sys.exit also stops us
+                        error = error or e
+                        continue
+                    for tgt in targets:
+                        deps = pendingDeps[tgt.getName()]
+                        if name in deps:
+                            deps.discard(name)
+                            if not deps:
+                                ready.append(tgt)
+
+        if error is not None:
+            raise error
+
+    def _executeCaptured(self, target):
+        """ Execute target writing its output to a temporary file, that is
+        printed at once when the target finishes, so the output of
+        concurrent targets is not interleaved. """
+        with tempfile.TemporaryFile(mode='w+') as output:
+            self._threadData.output = output
+            try:
+                target.execute()
+            finally:
+                del self._threadData.output
+                output.flush()
+                output.seek(0)
+                with _outputLock:
+                    sys.stdout.write(output.read())
+                    sys.stdout.flush()
 
     @staticmethod
     def _getExtName(name, version):
@@ -738,15 +1354,22 @@ class Environment:
         return (exists(join(self.getEmFolder(), extName)) or
                 extName in [x[:len(extName)] for x in os.listdir(pydir)])
 
-    def printHelp(self):
+    def printHelp(self, packages=None):
+        """ Returns the list of packages and whether they are installed.
+
+        :param packages: Optional, dict like getPackages to list instead of
+            the packages of this environment
+        """
+        if packages is None:
+            packages = self._packages
         printStr = ""
-        if self._packages:
+        if packages:
             printStr = ("Available binaries: "
                         "([ ] not installed, [X] seems already installed)\n\n")
 
-            keys = sorted(self._packages.keys())
+            keys = sorted(packages.keys())
             for k in keys:
-                pVersions = self._packages[k]
+                pVersions = packages[k]
                 printStr += "{0:25}".format(k)
                 for name, version in pVersions:
                     installed = self._isInstalled(name, version)
@@ -761,8 +1384,9 @@ class Environment:
 
         # Check if there are explicit targets and only install
         # the selected ones, ignore starting with 'xmipp'
-        cmdTargets = [a for a in self._args
-                      if a[0].isalpha()]
+        cmdTargets = [a for i, a in enumerate(self._args)
+                      if a[0].isalpha() and
+                      (i == 0 or self._args[i - 1] != '--build-report')]
         if cmdTargets:
             # Check that they are all command targets
             for t in cmdTargets:
@@ -777,6 +1401,8 @@ class Environment:
         if '--show-tree' in self._args:
             if '--dot' in self._args:
                 self._showTargetGraph(targetList)
+            elif '--times' in self._args:
+                self._showTargetTimes(targetList)
             else:
                 self._showTargetTree(targetList)
         else:
@@ -823,9 +1449,13 @@ class Environment:
 
 
 class Link:
-    def __init__(self, packageLink, packageFolder):
+    def __init__(self, packageLink, packageFolder, env=None):
+        """
+        :param env: Optional, Environment whose output the messages go to
+        """
         self._packageLink = packageLink
         self._packageFolder = packageFolder
+        self._env = env
 
     def __call__(self):
         self.createPackageLink(self._packageLink, self._packageFolder)
@@ -840,10 +1470,11 @@ class Link:
         This function is supposed to be executed in software/em folder.
         """
         linkText = "'%s -> %s'" % (packageLink, packageFolder)
+        out = self._env.getOutput() if self._env is not None else sys.stdout
 
         if not exists(packageFolder):
             print(red("Creating link %s, but '%s' does not exist!!!\n"
-                      "INSTALLATION FAILED!!!" % (linkText, packageFolder)))
+                      "INSTALLATION FAILED!!!" % (linkText, packageFolder)), file=out)
             sys.exit(1)
 
         if exists(packageLink):
@@ -851,11 +1482,90 @@ class Link:
                 os.remove(packageLink)
             else:
                 print(red("Creating link %s, but '%s' exists and is not a link!!!\n"
-                          "INSTALLATION FAILED!!!" % (linkText, packageLink)))
+                          "INSTALLATION FAILED!!!" % (linkText, packageLink)), file=out)
                 sys.exit(1)
 
         os.symlink(packageFolder, packageLink)
-        print("Created link: %s" % linkText)
+        print("Created link: %s" % linkText, file=out)
+
+
+class Download:
+    """ Callable command that downloads a url into a file, through the
+    download cache shared with other installations if there is one. """
+    def __init__(self, env, url, tarFile, sha256=None):
+        self._env = env
+        self._url = url
+        self._tarFile = tarFile
+        self._sha256 = sha256
+        self.bytesDownloaded = 0
+
+    def __call__(self):
+        cache = self._env.getDownloadCache()
+        out = self._env.getOutput()
+        try:
+            if cache is None:
+                self._download(self._url, self._tarFile)
+            elif cache.fetch(self._url, self._tarFile, self._download,
+                             sha256=self._sha256):
+                print("Taken from the download cache (%s)" % cache.getPath(),
+                      file=out)
+        except Exception as e:
+            print(red("Downloading %s failed: %s\n"
+                      "INSTALLATION FAILED!!!" % (self._url, e)), file=out)
+            sys.exit(1)
+
+    def _download(self, url, path):
+        # Imported here so "python -m scipion.install.download" does not
+        # find it already imported by the package
+        from .download import Downloader, ProgressPrinter
+        out = self._env.getOutput()
+        downloader = Downloader(progress=ProgressPrinter(os.path.basename(self._tarFile),
+                                                         stream=out))
+        self.bytesDownloaded += downloader.download(url, path, sha256=self._sha256)
+
+    def __str__(self):
+        return "Download '%s -> %s'" % (self._url, self._tarFile)
+
+
+class DownloadExtract(Download):
+    """ Callable command that extracts a tar file while it is downloaded.
+    With a download cache, the file is taken from it if it is there, or
+    written into it at the same time. """
+    def __init__(self, env, url, tarFile, extractDir, sha256=None):
+        Download.__init__(self, env, url, tarFile, sha256)
+        self._extractDir = extractDir
+
+    def __call__(self):
+        # Imported here for the same reason as in Download._download
+        from .download import Downloader, ProgressPrinter
+        cache = self._env.getDownloadCache()
+        out = self._env.getOutput()
+        downloader = Downloader(progress=ProgressPrinter(os.path.basename(self._tarFile),
+                                                         stream=out))
+        mkdir(self._extractDir)
+        try:
+            cached = cache.lookup(self._url, self._sha256, self._tarFile) if cache else None
+            if cached:
+                print("Taken from the download cache (%s)" % cache.getPath(),
+                      file=out)
+                try:
+                    downloader.extractFile(cached, self._extractDir, sha256=self._sha256)
+                finally:
+                    os.remove(cached)
+            elif cache is not None:
+                with cache.writer(self._url, self._sha256) as tee:
+                    downloader.extract(self._url, self._extractDir,
+                                       sha256=self._sha256, tee=tee)
+            else:
+                downloader.extract(self._url, self._extractDir, sha256=self._sha256)
+        except Exception as e:
+            print(red("Downloading and extracting %s failed: %s\n"
+                      "INSTALLATION FAILED!!!" % (self._url, e)), file=out)
+            sys.exit(1)
+        self.bytesDownloaded += downloader.bytesDownloaded
+
+    def __str__(self):
+        return "Download and extract '%s -> %s'" % (self._url, self._extractDir)
 
 
 class CommandDef:
@@ -959,8 +1669,14 @@ class CondaCommandDef(CommandDef):
         :return: CondaCommandDef (self)
 
         """
+        # Taken from the conda environment cache if possible. Imported here so
+        # "python -m scipion.install.conda_cache" does not find it already imported
+        from .conda_cache import getCacheCommand
+        restoreCmd = getCacheCommand('restore', self._envName, conda=extraCmds)
+        saveCmd = getCacheCommand('save', self._envName, conda=extraCmds)
         self.append(self._condaActivationCmd)
-        self.append("conda create -y -n %s %s" % (self._envName, extraCmds))
+        self.append("(%s || (conda create -y -n %s %s && %s))"
+                    % (restoreCmd, self._envName, extraCmds, saveCmd))
         return self.touch("env_created.txt")
 
     def pipInstall(self, packages):
@@ -1024,6 +1740,7 @@ class InstallHelper():
         self.__genericCommands = 0
         self.__condaCommands = 0
         self.__extraFiles = 0
+        self.__downloads = []  # (url, fileName) of getExtraFile
 
         # Private list of tuples containing commands with targets
         self.__commandList = []
@@ -1267,12 +1984,24 @@ class InstallHelper():
         # Defining target name
         targetName = targetName if targetName else '{}_CONDA_ENV_CREATED'.format(binaryName.upper())
         
+        # The env is taken from the conda environment cache if possible (see conda_cache).
+        # Otherwise it is created in a subshell, so the cache records it from the same folder.
+        from .conda_cache import getCacheCommand
+        envName = self.__getBinaryEnvName(binaryName, binaryVersion=binaryVersion)
+        envSpec = {'python': pythonVersion, 'pip': requirementList,
+                   'requirements': requirementFileName if requirementsFile else None}
+        createCmd = createEnvCmd + ' && ' + self.__getEnvActivationCommand(binaryName, binaryVersion=binaryVersion)
+        if binaryPath:
+            createCmd += ' && cd {}'.format(binaryPath)
+        createCmd += pythonCommands
+
         # Crafting final command string
-        command = pwem.Plugin.getCondaActivationCmd() + ' ' + createEnvCmd                          # Basic commands: hook and env creation
+        command = pwem.Plugin.getCondaActivationCmd() + ' '                                         # Conda hook
+        command += '({} || (({}) && {}))'.format(getCacheCommand('restore', envName, **envSpec),     # Env creation
+                                                 createCmd, getCacheCommand('save', envName, **envSpec))
         command += ' && ' + self.__getEnvActivationCommand(binaryName, binaryVersion=binaryVersion) # Env activation
         if binaryPath:
             command += ' && cd {}'.format(binaryPath)                                               # cd to binary path if proceeds
-        command += pythonCommands                                                                   # Python related commands
         if extraCommands:
             command += " && " + " && ".join(extraCommands)                                          # Extra conda commands
         if binaryPath:
@@ -1320,10 +2049,13 @@ class InstallHelper():
     
     def getExtraFile(self, url: str, targetName: str='', location: str=".", workDir: str='', fileName: str=None):
         """
-        ### This function creates the command to download with wget the file in the given link into the given path.
+        ### This function creates the command to download the file in the given link into the given path.
         ### The downloaded file will overwrite a local one if they have the same name.
         ### This is done to overwrite potential corrupt files whose download was not fully completed.
 
+        ### The download is retried on errors and resumed if it was interrupted (see scipion.install.download).
+        ### With SCIPION_MIRROR the file is copied from the mirror instead.
+
         #### Parameters:
         url (str): URL of the resource to download.
         targetName (str): Optional. Name of the target file for this command.
@@ -1336,9 +2068,9 @@ class InstallHelper():
 
         #### This function call will generate the following command:
         cd /home/user && mkdir -p /home/user/scipion/software/em/test-package-1.0/subdirectory &&
-        wget -O /home/user/scipion/software/em/test-package-1.0/subdirectory/test.tar https://site.com/myfile.tar && touch /home/user/scipion/software/em/test-package-1.0/FILE_DOWNLOADED
+        python -m scipion.install.download https://site.com/myfile.tar /home/user/scipion/software/em/test-package-1.0/subdirectory/test.tar && touch /home/user/scipion/software/em/test-package-1.0/FILE_DOWNLOADED
         """
-        # Getting filename for wget
+        # Getting filename for the download
         fileName = fileName if fileName else os.path.basename(url)
         mkdirCmd = "mkdir -p {} && ".format(location) if location else ''
 
@@ -1347,14 +2079,20 @@ class InstallHelper():
             targetName = 'EXTRA_FILE_{}'.format(self.__extraFiles)
             self.__extraFiles += 1
 
-        downloadCmd = "{}wget -O {} {}".format(mkdirCmd, os.path.join(location, fileName), url)
+        self.__downloads.append((url, fileName))
+        mirror = getMirror()
+        if mirror is not None:
+            # Offline, only from the mirror
+            downloadCmd = "{}cp {} {}".format(mkdirCmd, getBinaryFile(mirror, url, fileName), os.path.join(location, fileName))
+        else:
+            downloadCmd = "{}{} -m scipion.install.download {} {}".format(mkdirCmd, Environment.getPython(), url, os.path.join(location, fileName))
         self.addCommand(downloadCmd, targetName=targetName, workDir=workDir)
 
         return self
 
     def getExtraFiles(self, fileList: List[Dict[str, str]], binaryName: str=None, workDir: str='', targetNames: List[str]=None):
         """
-        ### This function creates the command to download with wget the file in the given link into the given path.
+        ### This function creates the command to download the file in the given link into the given path.
         ### The downloaded file will overwrite a local one if they have the same name.
         ### This is done to overwrite potential corrupt files whose download was not fully completed.
 
@@ -1375,10 +2113,10 @@ class InstallHelper():
 
         #### This function call will generate the following commands:
         cd /home/user && mkdir -p /home/user/scipion/software/em/test-package-1.0/subdirectory1 &&
-        wget -O /home/user/scipion/software/em/test-package-1.0/subdirectory1/test.tar https://site.com/myfile.tar && touch /home/user/scipion/software/em/test-package-1.0/DOWNLOADED_FILE_1
+        python -m scipion.install.download https://site.com/myfile.tar /home/user/scipion/software/em/test-package-1.0/subdirectory1/test.tar && touch /home/user/scipion/software/em/test-package-1.0/DOWNLOADED_FILE_1
         
         cd /home/user && mkdir -p /home/user/scipion/software/em/test-package-1.0/subdirectory2 &&
-        wget -O /home/user/scipion/software/em/test-package-1.0/subdirectory2/test2.tar2 https://site.com/myfile.tar2 && touch /home/user/scipion/software/em/test-package-1.0/DOWNLOADED_FILE_2
+        python -m scipion.install.download https://site.com/myfile.tar2 /home/user/scipion/software/em/test-package-1.0/subdirectory2/test2.tar2 && touch /home/user/scipion/software/em/test-package-1.0/DOWNLOADED_FILE_2
         """
         # Checking if introduced target name list and file list have same size
         if targetNames and len(fileList) != len(targetNames):
@@ -1420,6 +2158,8 @@ class InstallHelper():
         #### Usage:
         installer.addPackage(env, dependencies=['wget', 'conda'], default=True)
         """
+        for url, fileName in self.__downloads:
+            env.addDownload(url, fileName)
         env.addPackage(self.__packageName, version=self.__packageVersion, tar='void.tgz', commands=self.__commandList, neededProgs=dependencies, default=default, **kwargs)
     
     #--------------------------------------- PUBLIC UTILS FUNCTIONS ---------------------------------------#
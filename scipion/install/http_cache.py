@@ -0,0 +1,167 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+On disk cache of the plugin list and the PyPI data of the plugins, shared
+by the command line and the plugin manager.
+
+Responses younger than SCIPION_METADATA_TTL seconds are used without going
+to the server. Older ones are revalidated with their ETag and Last-Modified
+headers, and used anyway, with a warning, when the server can not be reached.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import requests
+
+from scipion.utils import getCacheFolder
+
+# Seconds the metadata is used without revalidating it
+SCIPION_METADATA_TTL = 'SCIPION_METADATA_TTL'
+DEFAULT_TTL = 3600
+
+
+class HttpCache:
+    """ Keeps the content of http GET responses in a folder """
+
+    def __init__(self, folder, session=None, ttl=None, refresh=False):
+        """
+        :param folder: where the responses are stored
+        :param session: requests session to use, a new one by default
+        :param ttl: seconds a response is used without revalidating it,
+            SCIPION_METADATA_TTL by default
+        :param refresh: revalidate all the responses, whatever their age
+        """
+        self._folder = folder
+        self._session = session or requests.Session()
+        if ttl is None:
+            ttl = float(os.environ.get(SCIPION_METADATA_TTL, DEFAULT_TTL))
+        self._ttl = ttl
+        self._refresh = refresh
+
+    def setRefresh(self, refresh=True):
+        self._refresh = refresh
+
+    def _getFiles(self, url):
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return (os.path.join(self._folder, name + '.json'),
+                os.path.join(self._folder, name + '.body'))
+
+    def _load(self, url):
+        """ Returns the headers and the content cached for url, or None """
+        metaFile, bodyFile = self._getFiles(url)
+        try:
+            with open(metaFile) as f:
+                meta = json.load(f)
+            with open(bodyFile, 'rb') as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, content):
+        # Other processes may be reading it, so replace it at once
+        os.makedirs(self._folder, exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=self._folder, delete=False) as f:
+            f.write(content)
+        os.replace(f.name, path)
+
+    def _save(self, url, meta, content=None):
+        metaFile, bodyFile = self._getFiles(url)
+        try:
+            if content is not None:
+                self._write(bodyFile, content)
+            self._write(metaFile, json.dumps(meta).encode())
+        except OSError as e:
+            print("WARNING: could not cache %s: %s" % (url, e))
+
+    def get(self, url, timeout=None, derive=None):
+        """ Returns the content of url, from the cache if possible, or None
+        if the server does not have it. Raises requests.RequestException
+        when the server can not be reached and url is not cached.
+
+        :param derive: Optional, function of the content to return instead
+            of it. Its result, which has to be json serializable, is cached
+            until the content changes.
+        """
+        content = self._get(url, timeout)
+        if derive is None or content is None:
+            return content
+
+        contentHash = hashlib.sha256(content).hexdigest()
+        derivedFile = self._getFiles(url)[0][:-len('.json')] + '.%s.json' % derive.__name__
+        try:
+            with open(derivedFile) as f:
+                derived = json.load(f)
+            if derived['hash'] == contentHash:
+                return derived['value']
+        except (OSError, ValueError, KeyError):
+            pass
+        value = derive(content)
+        try:
+            self._write(derivedFile, json.dumps({'hash': contentHash,
+                                                 'value': value}).encode())
+        except OSError as e:
+            print("WARNING: could not cache %s: %s" % (url, e))
+        return value
+
+    def _get(self, url, timeout):
+        cached = self._load(url)
+        if cached is not None:
+            meta, content = cached
+            if not self._refresh and time.time() - meta['time'] < self._ttl:
+                return content
+
+        headers = {}
+        if cached is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('lastModified'):
+                headers['If-Modified-Since'] = meta['lastModified']
+        try:
+            response = self._session.get(url, headers=headers, timeout=timeout)
+        except requests.RequestException as e:
+            if cached is None:
+                raise
+            print("WARNING: using cached data of %s: %s" % (url, e))
+            return content
+
+        if response.status_code == 304 and cached is not None:
+            meta['time'] = time.time()
+            self._save(url, meta)
+            return content
+        if response.ok:
+            self._save(url, {'url': url, 'time': time.time(),
+                             'etag': response.headers.get('ETag'),
+                             'lastModified': response.headers.get('Last-Modified')},
+                       response.content)
+            return response.content
+        if cached is not None and response.status_code >= 500:
+            print("WARNING: using cached data of %s: error %d"
+                  % (url, response.status_code))
+            return content
+        return None
@@ -26,12 +26,18 @@
 
 import sys
 import argparse
+import json
 import os
 import re
 
 from scipion.constants import MODE_INSTALL_PLUGIN, MODE_UNINSTALL_PLUGIN
 from scipion.install import Environment
-from scipion.install.plugin_funcs import PluginRepository, PluginInfo, installBinsDefault
+from scipion.install.plugin_funcs import (PluginRepository, PluginInfo, installBinsDefault,
+                                          installPipModules, getMetadataCache, getPipJsonUrl)
+from scipion.install import mirror
+from scipion.install.binary_index import BinaryIndex
+from scipion.install.discovery import getPluginModule
+from scipion.install.wheelhouse import buildWheelhouse
 from pyworkflow.utils import redStr
 
 #  ************************************************************************
@@ -39,7 +45,6 @@ from pyworkflow.utils import redStr
 #  *                       External (EM) Plugins                          *
 #  *                                                                      *
 #  ************************************************************************
-from pyworkflow import Config
 
 MODE_LIST_BINS = 'listb'
 MODE_INSTALL_BINS = 'installb'
@@ -50,10 +55,8 @@ SCIPION_CMD = "scipion"
 
 
 def installPluginMethods():
-    """ Deals with plugin installation methods"""
-
-    # Trigger plugin's variable definition
-    Config.getDomain().getPlugins()
+    """ Deals with plugin installation methods. Plugins are not imported,
+    only the ones whose binaries are installed or uninstalled are. """
 
     invokeCmd = SCIPION_CMD + " " + sys.argv[1]
     pluginRepo = PluginRepository()
@@ -83,6 +86,10 @@ def installPluginMethods():
                                     'all plugins specified in the command.')
     installParser.add_argument('--checkUpdates', action='store_true',
                                help='Optional flag to check which plugins have new releases.\n')
+    installParser.add_argument('--refresh', action='store_true',
+                               help='Optional flag to revalidate the cached plugin list and plugin\n'
+                                    'data from PyPI, even if they are younger than\n'
+                                    '$SCIPION_METADATA_TTL seconds.\n')
     installParser.add_argument('-p', '--plugin', action='append', nargs='+',
                                metavar=('pluginName', 'pluginVersion'),
                                help='- pluginName:     the name of the plugin to install from the list\n'
@@ -99,9 +106,30 @@ def installPluginMethods():
                                     'scipion install -p path/to/pluginName --devel \n'
                                     'scipion install -p https://github.com/someOrg/pluginName.git --devel')
     installParser.add_argument('-j',
-                               default='1',
                                metavar='j',
-                               help='Number of CPUs to use for compilation \n')
+                               help='Number of CPUs to use for compilation, shared by all the binaries\n'
+                                    'installed at the same time. Defaults to the cores and available\n'
+                                    'memory (see SCIPION_INSTALL_JOB_MEMORY).\n')
+    installParser.add_argument('--parallel',
+                               metavar='n',
+                               help='Number of independent binaries to install at the same time.\n'
+                                    'Defaults to $SCIPION_INSTALL_PARALLEL or 1.\n')
+    installParser.add_argument('--build-report',
+                               metavar='path',
+                               help='Append the time and resources used by each install command,\n'
+                                    'and the dependencies between binaries, to this JSON lines file.\n')
+    installParser.add_argument('--wheelhouse',
+                               metavar='dir',
+                               help='Instead of installing, download or build into dir the wheels of the\n'
+                                    'plugins, of the pip modules of their binaries (for plugins already\n'
+                                    'installed) and of all their dependencies. Other installations can\n'
+                                    'then install them without PyPI with SCIPION_WHEELHOUSE=dir.\n')
+    installParser.add_argument('--build-mirror',
+                               metavar='dir',
+                               help='Instead of installing, copy into dir the plugin list, the PyPI data,\n'
+                                    'the wheels and the binary tar files of the plugins (all of them if\n'
+                                    'no -p is given; binaries only for plugins already installed).\n'
+                                    'Installations with SCIPION_MIRROR=dir use only the mirror.\n')
 
     ############################################################################
     #                             Uninstall parser                             #
@@ -139,9 +167,26 @@ def installPluginMethods():
                                        'version in the form name-version. If no version is specified,\n'
                                        'will install the last one.')
     installBinParser.add_argument('-j',
-                                  default='1',
                                   metavar='j',
-                                  help='Number of CPUs to use for compilation \n')
+                                  help='Number of CPUs to use for compilation, shared by all the binaries\n'
+                                       'installed at the same time. Defaults to the cores and available\n'
+                                       'memory (see SCIPION_INSTALL_JOB_MEMORY).\n')
+    installBinParser.add_argument('--parallel',
+                                  metavar='n',
+                                  help='Number of independent binaries to install at the same time.\n'
+                                       'Defaults to $SCIPION_INSTALL_PARALLEL or 1.\n')
+    installBinParser.add_argument('--build-report',
+                                  metavar='path',
+                                  help='Append the time and resources used by each install command,\n'
+                                       'and the dependencies between binaries, to this JSON lines file.\n')
+    installBinParser.add_argument('--force', action='store_true',
+                                  help='Run again the install commands that finished successfully\n'
+                                       'in previous runs.\n')
+    installBinParser.add_argument('--times', action='store_true',
+                                  help='Instead of installing, show the dependencies of the binaries with\n'
+                                       'the time they took to install, the critical path, the estimated\n'
+                                       'time with several --parallel workers and the binaries that block\n'
+                                       'most of the installation.\n')
 
     ############################################################################
     #                          Uninstall Bins parser                           #
@@ -172,6 +217,9 @@ def installPluginMethods():
     parserUsed = modeToParser[mode]
     exitWithErrors = False
 
+    if getattr(parsedArgs, 'refresh', False):
+        getMetadataCache().setRefresh()
+
 
     if parsedArgs.help or (mode in [MODE_INSTALL_BINS, MODE_UNINSTALL_BINS]
                            and len(parsedArgs.binName) == 0):
@@ -179,16 +227,8 @@ def installPluginMethods():
         if mode not in [MODE_INSTALL_BINS, MODE_UNINSTALL_BINS]:
             parserUsed.epilog += pluginRepo.printPluginInfoStr()
         else:
-            env = Environment()
-            env.setDefault(False)
-            installedPlugins = Config.getDomain().getPlugins()
-            for p, pobj in installedPlugins.items():
-                try:
-                    pobj._pluginInstance.defineBinaries(env)
-                except Exception as e:
-                    print(
-                        redStr("Error retrieving plugin %s binaries: " % str(p)), e)
-            parserUsed.epilog += env.printHelp()
+            binaryIndex = BinaryIndex().update()
+            parserUsed.epilog += Environment().printHelp(binaryIndex.getPackages())
         parserUsed.print_help()
         parserUsed.exit(0)
 
@@ -197,7 +237,14 @@ def installPluginMethods():
             print(pluginRepo.printPluginInfoStr(withUpdates=True))
             installParser.exit(0)
 
-        if parsedArgs.devel:
+        if parsedArgs.wheelhouse:
+            exitWithErrors = not buildPluginWheelhouse(pluginRepo, parsedArgs)
+
+        elif parsedArgs.build_mirror:
+            exitWithErrors = not buildPluginMirror(pluginRepo, parsedArgs)
+
+        elif parsedArgs.devel:
+            pluginsToInstall = []
             for p in parsedArgs.plugin:
                 pluginSrc = p[0]
                 pluginName = ""
@@ -212,11 +259,9 @@ def installPluginMethods():
                     exitWithErrors = True
                 else:
                     plugin = PluginInfo(pipName=pluginName, pluginSourceUrl=pluginSrc, remote=False)
-                    numberProcessor = parsedArgs.j
-                    installed = plugin.installPipModule()
-                    if installed and installBinsDefault() and not parsedArgs.noBin:
-                        plugin.getPluginClass()._defineVariables()
-                        plugin.installBin({'args': ['-j', numberProcessor]})
+                    pluginsToInstall.append((plugin, ""))
+            if not installPlugins(pluginsToInstall, parsedArgs):
+                exitWithErrors = True
         else:
             pluginsToInstall = list(zip(*parsedArgs.plugin))[0]
             pluginDict = pluginRepo.getPlugins(pluginList=pluginsToInstall,
@@ -224,19 +269,18 @@ def installPluginMethods():
             if not pluginDict:
                 exitWithErrors = True
             else:
+                pluginsToInstall = []
                 for cmdTarget in parsedArgs.plugin:
                     pluginName = cmdTarget[0]
                     pluginVersion = "" if len(cmdTarget) == 1 else cmdTarget[1]
-                    numberProcessor = parsedArgs.j
                     plugin = pluginDict.get(pluginName, None)
                     if plugin:
-                        installed = plugin.installPipModule(version=pluginVersion)
-                        if installed and installBinsDefault() and not parsedArgs.noBin:
-                            plugin.getPluginClass()._defineVariables()
-                            plugin.installBin({'args': ['-j', numberProcessor]})
+                        pluginsToInstall.append((plugin, pluginVersion))
                     else:
                         print("WARNING: Plugin %s does not exist." % pluginName)
                         exitWithErrors = True
+                if not installPlugins(pluginsToInstall, parsedArgs):
+                    exitWithErrors = True
 
     elif parsedArgs.mode in MODE_UNINSTALL_PLUGIN:
 
@@ -256,15 +300,20 @@ def installPluginMethods():
     elif parsedArgs.mode == MODE_INSTALL_BINS:
         binToInstallList = parsedArgs.binName
         binToPlugin = pluginRepo.getBinToPluginDict()
+        # Group the binaries by plugin, so independent binaries of the same
+        # plugin can be installed in parallel
+        pluginBins = {}
         for binTarget in binToInstallList:
             pluginTargetName = binToPlugin.get(binTarget, None)
             if pluginTargetName is None:
                 print('ERROR: Could not find target %s' % binTarget)
                 continue
-            pmodule = Config.getDomain().getPlugin(pluginTargetName)
-            numberProcessor = parsedArgs.j
+            pluginBins.setdefault(pluginTargetName, []).append(binTarget)
+
+        for pluginTargetName, binTargets in pluginBins.items():
+            pmodule = getPluginModule(pluginTargetName)
             pinfo = PluginInfo(name=pluginTargetName, plugin=pmodule, remote=False)
-            pinfo.installBin({'args': [binTarget, '-j', numberProcessor]})
+            pinfo.installBin({'args': binTargets + getEnvArgs(parsedArgs)})
 
     elif parsedArgs.mode == MODE_UNINSTALL_BINS:
 
@@ -275,7 +324,7 @@ def installPluginMethods():
             if pluginTargetName is None:
                 print('ERROR: Could not find target %s' % binTarget)
                 continue
-            pmodule = Config.getDomain().getPlugin(pluginTargetName)
+            pmodule = getPluginModule(pluginTargetName)
             pinfo = PluginInfo(name=pluginTargetName, plugin=pmodule, remote=False)
             pinfo.uninstallBins([binTarget])
 
@@ -283,3 +332,107 @@ def installPluginMethods():
         parserUsed.exit(1)
     else:
         parserUsed.exit(0)
+
+
+def installPlugins(plugins, parsedArgs):
+    """ Installs the pip packages of the plugins, all at once, and then their
+    binaries. Returns False if any of them could not be installed.
+
+    :param plugins: list of (PluginInfo, version) tuples
+    """
+    installed = installPipModules(plugins)
+    if installBinsDefault() and not parsedArgs.noBin:
+        for plugin in installed:
+            plugin.getPluginClass()._defineVariables()
+            plugin.installBin({'args': getEnvArgs(parsedArgs)})
+    return len(installed) == len(plugins)
+
+
+def getEnvArgs(parsedArgs):
+    """ Returns the list of arguments for the install Environment out of
+    the parsed command line arguments. """
+    args = ['-j', parsedArgs.j] if parsedArgs.j else []
+    if parsedArgs.parallel:
+        args += ['--parallel', parsedArgs.parallel]
+    if parsedArgs.build_report:
+        args += ['--build-report', os.path.abspath(parsedArgs.build_report)]
+    if getattr(parsedArgs, 'force', False):
+        args.append('--force')
+    if getattr(parsedArgs, 'times', False):
+        args += ['--show-tree', '--times']
+    return args
+
+
+def getRequestedPlugins(pluginRepo, parsedArgs):
+    """ Returns a list with the PluginInfo, the version and the install
+    Environment (None if the plugin is not installed) of the plugins given
+    with -p, or of all the plugins of the repository. Returns None on errors. """
+    pluginList = [p[0] for p in parsedArgs.plugin] if parsedArgs.plugin else None
+    pluginDict = pluginRepo.getPlugins(pluginList=pluginList, getPipData=True)
+    cmdTargets = parsedArgs.plugin or [[name] for name in sorted(pluginDict)]
+
+    plugins = []
+    for cmdTarget in cmdTargets:
+        pluginName = cmdTarget[0]
+        plugin = pluginDict.get(pluginName, None)
+        if plugin is None:
+            print(redStr("ERROR: Plugin %s does not exist." % pluginName))
+            return None
+        version = cmdTarget[1] if len(cmdTarget) > 1 else plugin.latestRelease
+        # Binaries are only known once the plugin is installed
+        env = None
+        if plugin.isInstalled() and not parsedArgs.noBin:
+            env = plugin.getInstallenv()
+        plugins.append((plugin, version, env))
+    return plugins
+
+
+def getWheelSpecs(plugins):
+    """ Returns the pip requirements of the plugins (see getRequestedPlugins)
+    and of the pip modules of their binaries """
+    specs = []
+    for plugin, version, env in plugins:
+        specs.append('%s==%s' % (plugin.pipName, version))
+        if env is not None:
+            specs += env.getPipModules()
+    return specs
+
+
+def buildPluginWheelhouse(pluginRepo, parsedArgs):
+    """ Builds the wheelhouse with the plugins requested, the pip modules
+    of their binaries and their dependencies. Returns False on errors. """
+    plugins = getRequestedPlugins(pluginRepo, parsedArgs)
+    if plugins is None:
+        return False
+    return buildWheelhouse(parsedArgs.wheelhouse, getWheelSpecs(plugins)) == 0
+
+
+def buildPluginMirror(pluginRepo, parsedArgs):
+    """ Builds a mirror (see scipion.install.mirror) with the plugins
+    requested. Returns False on errors. """
+    mirrorDir = os.path.abspath(parsedArgs.build_mirror)
+    plugins = getRequestedPlugins(pluginRepo, parsedArgs)
+    if plugins is None:
+        return False
+
+    pluginsJson = pluginRepo.getPluginsJson()
+    names = [plugin.pipName for plugin, _, _ in plugins]
+    mirror.writeFile(mirror.getPluginsFile(mirrorDir),
+                     json.dumps({k: v for k, v in pluginsJson.items() if k in names},
+                                indent=2).encode())
+
+    for name in names:
+        content = getMetadataCache().get(getPipJsonUrl(name))
+        if content is None:
+            print(redStr("ERROR: Couldn't get the PyPI data of %s" % name))
+            return False
+        mirror.writeFile(mirror.getPypiFile(mirrorDir, name), content)
+
+    if buildWheelhouse(mirror.getWheelsFolder(mirrorDir), getWheelSpecs(plugins)) != 0:
+        return False
+
+    downloads = [d for _, _, env in plugins if env is not None for d in env.getDownloads()]
+    failed = mirror.addBinaries(mirrorDir, downloads)
+    print("Mirror %s ready. Install from it with %s=%s"
+          % (mirrorDir, mirror.SCIPION_MIRROR, mirrorDir))
+    return not failed
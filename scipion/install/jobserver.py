@@ -0,0 +1,198 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+GNU make jobserver shared by all the commands of an installation.
+
+The jobserver is a pipe with one byte (token) per job allowed besides the
+one every client has for free. Each install command takes a token while it
+runs, and make (or cmake generated makefiles) started by it take more
+tokens for their parallel jobs, so the total number of jobs never goes
+over the budget, whatever the number of targets installed at once.
+
+All the installations of a process share one jobserver (see
+sharedJobServer), and installations started from a command of another one
+join its jobserver.
+"""
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+# Memory needed by each compilation job, in GB, to compute the default budget
+SCIPION_INSTALL_JOB_MEMORY = 'SCIPION_INSTALL_JOB_MEMORY'
+DEFAULT_JOB_MEMORY = 2
+
+TOKEN = b'+'
+
+# Jobserver shared by the installations of this process, and how many of
+# them are using it
+_shared = None
+_sharedUsers = 0
+_sharedLock = threading.Lock()
+
+
+def getCores():
+    """ Returns the number of cores this process may run on """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def getAvailableMemory():
+    """ Returns the memory available in bytes, or None if unknown """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def getDefaultJobs():
+    """ Returns the number of jobs that fit in the cores and the available
+    memory of this machine. """
+    jobs = getCores()
+    memory = getAvailableMemory()
+    if memory is not None:
+        jobMemory = float(os.environ.get(SCIPION_INSTALL_JOB_MEMORY,
+                                         DEFAULT_JOB_MEMORY)) * 1024 ** 3
+        jobs = min(jobs, int(memory // jobMemory))
+    return max(1, jobs)
+
+
+class JobServer:
+    """ Pool of job tokens, compatible with the GNU make jobserver """
+
+    def __init__(self, jobs, fds=None):
+        """
+        :param jobs: maximum number of jobs running at the same time
+        :param fds: Optional, (read, write) descriptors of the pipe of an
+            existing jobserver to join. A new one is created otherwise.
+        """
+        self._jobs = jobs
+        # Only the pipes we create are closed by us
+        self._owned = fds is None
+        if fds is None:
+            self._fds = os.pipe()
+            os.write(self._fds[1], TOKEN * (jobs - 1))
+        else:
+            self._fds = fds
+        for fd in self._fds:
+            os.set_inheritable(fd, True)
+        # The token we have without reading it from the pipe
+        self._implicitFree = True
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fromEnviron(cls):
+        """ Returns the jobserver given to this process in MAKEFLAGS, if any """
+        flags = os.environ.get('MAKEFLAGS', '')
+        match = re.search(r'--jobserver-(?:auth|fds)=(\d+),(\d+)', flags)
+        if match is None:
+            return None
+        fds = (int(match.group(1)), int(match.group(2)))
+        try:
+            for fd in fds:
+                os.fstat(fd)
+        except OSError:
+            return None  # Not passed to us, e.g. not a child of make
+        jobs = re.search(r'(?:^|\s)-j(\d+)', flags)
+        return cls(int(jobs.group(1)) if jobs else 1, fds)
+
+    def getJobs(self):
+        return self._jobs
+
+    def getFds(self):
+        """ Returns the descriptors of the pipe, that have to be passed to
+        the child processes (see pass_fds in subprocess.Popen) """
+        return self._fds
+
+    def getMakeflags(self):
+        return '-j%d --jobserver-fds=%d,%d --jobserver-auth=%d,%d' % (
+            (self._jobs,) + self._fds * 2)
+
+    def getEnviron(self, environ=None):
+        """ Returns a copy of environ (os.environ by default) telling make
+        to use this jobserver. """
+        environ = dict(os.environ if environ is None else environ)
+        environ['MAKEFLAGS'] = self.getMakeflags()
+        return environ
+
+    def acquire(self):
+        """ Wait for a free job. Returns the token to release. """
+        with self._lock:
+            if self._implicitFree:
+                self._implicitFree = False
+                return None
+        return os.read(self._fds[0], 1)
+
+    def release(self, token):
+        if token is None:
+            with self._lock:
+                self._implicitFree = True
+        else:
+            os.write(self._fds[1], token)
+
+    @contextmanager
+    def job(self):
+        """ Hold a job while running the block """
+        token = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def close(self):
+        """ Close the pipe, if it was created by us """
+        if self._owned:
+            for fd in self._fds:
+                os.close(fd)
+            self._owned = False
+
+
+@contextmanager
+def sharedJobServer(jobs):
+    """ Use the jobserver of this process while running the block. It is
+    the one given by the parent process, if any, or a new one of jobs jobs,
+    shared by all the blocks running at the same time and closed when the
+    last of them ends.
+    """
+    global _shared, _sharedUsers
+    with _sharedLock:
+        if _shared is None:
+            _shared = JobServer.fromEnviron() or JobServer(jobs)
+        _sharedUsers += 1
+        jobServer = _shared
+    try:
+        yield jobServer
+    finally:
+        with _sharedLock:
+            _sharedUsers -= 1
+            if not _sharedUsers:
+                _shared = None
+                jobServer.close()
@@ -0,0 +1,304 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Install manifest: the plugins, and their binaries, an installation has to
+have. "scipion apply manifest.yml" compares it with what is installed and
+only runs the installs, upgrades and uninstalls needed. E.g.:
+
+    noBin: false                    # default for all the plugins
+    plugins:
+      scipion-em-relion: 4.0.1      # a version
+      scipion-em-ctffind4:          # the latest compatible version
+      scipion-em-motioncorr:
+        version: '3.10'             # quoted, yaml would read 3.1
+        binaries: [motioncor2-1.6.4]  # instead of the default ones
+      scipion-em-gctf:
+        noBin: true
+      scipion-em-eman2: absent      # uninstalled
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from pkg_resources import parse_version
+
+from pyworkflow.utils import redStr, yellowStr, greenStr
+
+from .binary_index import BinaryIndex
+from .funcs import Environment
+from .jobserver import getDefaultJobs, sharedJobServer
+from .plugin_funcs import (PluginRepository, PluginInfo, distributionIndex,
+                           installPipModules, installBinsDefault)
+
+ABSENT = 'absent'
+
+
+def loadManifest(path):
+    """ Reads a manifest (yaml or json) and returns a dict with the version
+    ('' for the latest compatible), noBin, binaries (None for the default
+    ones) and absent flags of each plugin. Raises ValueError if it is wrong. """
+    with open(path) as f:
+        content = f.read()
+    try:
+        import yaml
+        data = yaml.safe_load(content)
+    except ImportError:
+        if path.endswith(('.yml', '.yaml')):
+            raise ValueError("%s: reading yaml manifests needs PyYAML (pip install pyyaml), "
+                             "or write it in json" % path)
+        data = json.loads(content)
+
+    if not isinstance(data, dict) or not isinstance(data.get('plugins') or {}, dict):
+        raise ValueError("%s: expected a 'plugins' mapping" % path)
+    noBin = bool(data.get('noBin', False))
+
+    manifest = {}
+    for pipName, spec in (data.get('plugins') or {}).items():
+        if spec is None:
+            spec = {}
+        elif spec is False or spec == ABSENT:
+            spec = {ABSENT: True}
+        elif not isinstance(spec, dict):
+            spec = {'version': spec}
+        binaries = spec.get('binaries')
+        if binaries is not None and not isinstance(binaries, list):
+            raise ValueError("%s: binaries of %s must be a list" % (path, pipName))
+        version = spec.get('version')
+        if version is not None and not isinstance(version, str):
+            # yaml reads 3.10 as the number 3.1
+            raise ValueError("%s: version %s of %s has to be quoted, e.g. '%s'"
+                             % (path, version, pipName, version))
+        manifest[pipName] = {'version': version or '',
+                             'noBin': bool(spec.get('noBin', noBin)),
+                             'binaries': binaries,
+                             ABSENT: bool(spec.get(ABSENT, False))}
+    return manifest
+
+
+class Plan:
+    """ Operations needed to get the state of a manifest """
+
+    def __init__(self):
+        self.uninstall = []  # (pipName, installed version)
+        self.pip = []  # (pipName, version, installed version or None)
+        self.binaries = []  # (pipName, binaries or None for the default ones)
+
+    def isEmpty(self):
+        return not (self.uninstall or self.pip or self.binaries)
+
+    def __str__(self):
+        if self.isEmpty():
+            return "Nothing to do, the installation matches the manifest."
+        lines = []
+        for pipName, installed in self.uninstall:
+            lines.append(redStr("  uninstall  %s %s" % (pipName, installed)))
+        for pipName, version, installed in self.pip:
+            if installed is None:
+                lines.append(greenStr("  install    %s %s" % (pipName, version)))
+            else:
+                action = 'upgrade' if parse_version(version) > parse_version(installed) else 'downgrade'
+                lines.append(yellowStr("  %-10s %s %s -> %s" % (action, pipName, installed, version)))
+        for pipName, binaries in self.binaries:
+            lines.append(greenStr("  installb   %s: %s" % (
+                pipName, ' '.join(binaries) if binaries is not None else 'default binaries')))
+        return '\n'.join(lines)
+
+
+def _getModuleName(dist, binaryIndex):
+    """ Returns the name of the plugin module of an installed distribution """
+    topLevel = (dist['top_level'] or '').split()
+    for name in topLevel:
+        if name in binaryIndex.getPlugins():
+            return name
+    return topLevel[0] if topLevel else None
+
+
+def getMissingBinaries(binaryIndex, moduleName, binaries=None):
+    """ Returns the binaries (name-version) of a plugin that are not installed.
+
+    :param binaries: names of the binaries wanted, with or without version.
+        The default binaries of the plugin if None.
+    """
+    packages = binaryIndex.getPackages(moduleName)
+    defaults = set(t['name'] for t in binaryIndex.getTargets(moduleName) if t['default'])
+
+    if binaries is None:
+        wanted = [(n, v) for n, v in packages if Environment._getExtName(n, v) in defaults]
+    else:
+        wanted = []
+        for binary in binaries:
+            matches = [(n, v) for n, v in packages
+                       if binary in (n, Environment._getExtName(n, v))]
+            if not matches:
+                print(yellowStr("WARNING: binary %s not found in plugin %s" % (binary, moduleName)))
+                continue
+            # Without version, the default one
+            default = [p for p in matches if Environment._getExtName(*p) in defaults]
+            wanted.append((default or matches)[-1])
+
+    env = Environment()
+    return [Environment._getExtName(n, v) for n, v in wanted if not env._isInstalled(n, v)]
+
+
+def getPlan(manifest, pluginRepo=None, binaryIndex=None):
+    """ Compares the manifest with the installation and returns the Plan.
+    PyPI is only asked for the latest version of plugins without version. """
+    plan = Plan()
+    latest = [pipName for pipName, spec in manifest.items()
+              if not spec[ABSENT] and not spec['version']]
+    pluginDict = {}
+    if latest:
+        pluginRepo = pluginRepo or PluginRepository()
+        pluginDict = pluginRepo.getPlugins(pluginList=latest, getPipData=True)
+
+    binaryIndex = binaryIndex or BinaryIndex().update()
+    for pipName, spec in manifest.items():
+        dist = distributionIndex.get(pipName)
+        installed = dist['Version'] if dist is not None else None
+        if spec[ABSENT]:
+            if installed is not None:
+                plan.uninstall.append((pipName, installed))
+            continue
+
+        version = spec['version']
+        if not version:
+            plugin = pluginDict.get(pipName)
+            if plugin is None:
+                raise ValueError("Plugin %s does not exist" % pipName)
+            version = plugin.latestRelease
+        # 4.0 and 4.0.0 are the same version
+        change = installed is None or parse_version(version) != parse_version(installed)
+        if change:
+            plan.pip.append((pipName, version, installed))
+
+        if spec['noBin'] or not installBinsDefault():
+            continue
+        if change:
+            # Binaries of the version to install are not known yet
+            plan.binaries.append((pipName, spec['binaries']))
+        else:
+            missing = getMissingBinaries(binaryIndex, _getModuleName(dist, binaryIndex),
+                                         spec['binaries'])
+            if missing:
+                plan.binaries.append((pipName, missing))
+    return plan
+
+
+def applyPlan(plan, envArgs=(), parallel=1, pluginRepo=None):
+    """ Runs the operations of the plan: uninstalls, a single pip install
+    for all the plugins and then the binaries, of up to parallel plugins at
+    the same time. Returns False if any of them failed. """
+    ok = True
+    for pipName, _ in plan.uninstall:
+        plugin = PluginInfo(pipName, pipName, remote=False)
+        plugin.uninstallBins()
+        plugin.uninstallPip()
+
+    failedPip = set()
+    pluginInfos = {}
+    if plan.pip:
+        pluginRepo = pluginRepo or PluginRepository()
+        pluginDict = pluginRepo.getPlugins(pluginList=[p[0] for p in plan.pip],
+                                           getPipData=True)
+        toInstall = []
+        for pipName, version, _ in plan.pip:
+            if pipName in pluginDict:
+                toInstall.append((pluginDict[pipName], version))
+            else:
+                print(redStr("ERROR: Plugin %s does not exist." % pipName))
+        installed = installPipModules(toInstall)
+        pluginInfos = {plugin.pipName: plugin for plugin in installed}
+        failedPip = set(p[0] for p in plan.pip) - set(pluginInfos)
+        ok = not failedPip
+
+    jobs = []
+    for pipName, binaries in plan.binaries:
+        if pipName in failedPip:
+            continue
+        plugin = pluginInfos.get(pipName) or PluginInfo(pipName, pipName, remote=False)
+        jobs.append((plugin, list(binaries or [])))
+
+    # The environments of all the plugins use the jobserver of this
+    # process, so the -j budget (and its free job) is shared by all of them
+    args = list(envArgs)
+    processors = int(args[args.index('-j') + 1]) if '-j' in args else getDefaultJobs()
+    jobServer = nullcontext() if os.name == 'nt' else sharedJobServer(processors)
+
+    def installBin(job):
+        plugin, binaries = job
+        try:
+            plugin.getPluginClass()._defineVariables()
+            plugin.installBin({'args': binaries + list(envArgs)})
+            return True
+        except BaseException as e:  # sys.exit when a command fails
+            print(redStr("ERROR installing binaries of %s: %s" % (plugin.pipName, e)))
+            return False
+
+    # Targets shared by several plugins are built by one of them at a time
+    # (see Target.execute)
+    with jobServer, ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        ok = all(list(executor.map(installBin, jobs))) and ok
+    return ok
+
+
+def main(args=None):
+    from .install_plugin import getEnvArgs
+
+    parser = argparse.ArgumentParser(prog='scipion apply',
+                                     description="Install, upgrade and uninstall plugins and "
+                                                 "binaries to match a manifest.")
+    parser.add_argument('manifest', help="yaml (or json) file with the plugins")
+    parser.add_argument('--plan', action='store_true',
+                        help="Only show the operations needed")
+    parser.add_argument('-j', metavar='j',
+                        help="Number of CPUs to use for compilation, shared by all the binaries")
+    parser.add_argument('--parallel', metavar='n',
+                        help="Number of plugins, and binaries of each plugin, to install at "
+                             "the same time")
+    parser.add_argument('--build-report', metavar='path',
+                        help="Append the time and resources used by each install command "
+                             "to this JSON lines file")
+    parsedArgs = parser.parse_args(args)
+
+    try:
+        manifest = loadManifest(parsedArgs.manifest)
+        plan = getPlan(manifest)
+    except (OSError, ValueError) as e:
+        print(redStr("ERROR: %s" % e))
+        sys.exit(1)
+
+    print(plan)
+    if parsedArgs.plan or plan.isEmpty():
+        sys.exit(0)
+    parallel = max(1, int(parsedArgs.parallel or 1))
+    sys.exit(0 if applyPlan(plan, getEnvArgs(parsedArgs), parallel) else 1)
+
+
+if __name__ == '__main__':
+    main()
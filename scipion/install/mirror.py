@@ -0,0 +1,99 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Local mirror of everything needed to install plugins without internet,
+built with "scipion installp -p ... --build-mirror DIR". It contains:
+
+ - plugins.json: the plugin list
+ - pypi/NAME.json: the PyPI data of each plugin
+ - wheels/: the wheels of the plugins, of the pip modules of their
+   binaries and of their dependencies
+ - binaries/: the tar files downloaded by the binaries of the plugins
+
+With SCIPION_MIRROR=DIR installp, installb and the plugin manager take
+everything from it and never use the network.
+"""
+import hashlib
+import os
+
+# Folder of the mirror to install from
+SCIPION_MIRROR = 'SCIPION_MIRROR'
+
+
+def getMirror():
+    """ Returns the mirror folder configured, or None """
+    folder = os.environ.get(SCIPION_MIRROR, '')
+    return os.path.abspath(os.path.expanduser(folder)) if folder else None
+
+
+def getPluginsFile(mirror):
+    return os.path.join(mirror, 'plugins.json')
+
+
+def getPypiFile(mirror, pipName):
+    return os.path.join(mirror, 'pypi', '%s.json' % pipName)
+
+
+def getWheelsFolder(mirror):
+    return os.path.join(mirror, 'wheels')
+
+
+def getBinaryFile(mirror, url, tar):
+    """ Returns the path of the tar file downloaded from url in the mirror """
+    urlHash = hashlib.sha256(url.encode()).hexdigest()[:16]
+    return os.path.join(mirror, 'binaries', urlHash, tar)
+
+
+def writeFile(path, content):
+    """ Write content (bytes) into path, creating its folder """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def addBinaries(mirror, downloads):
+    """ Download the tar files of the binaries into the mirror.
+
+    :param downloads: list of (url, tar, sha256) as Environment.getDownloads
+    :returns the list of urls that could not be downloaded
+    """
+    from .download import Downloader
+
+    failed = []
+    for url, tar, sha256 in downloads:
+        path = getBinaryFile(mirror, url, tar)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print("Downloading %s" % url)
+        try:
+            Downloader().download(url, path, sha256=sha256)
+        except Exception as e:
+            print("ERROR: could not download %s: %s" % (url, e))
+            failed.append(url)
+    return failed
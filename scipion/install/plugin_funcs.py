@@ -1,17 +1,24 @@
 import requests
 import os
+import subprocess
 import re
 import sys
 import json
-import pkg_resources
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pkg_resources import parse_version
 
+from .binary_index import BinaryIndex
+from .discovery import getPluginModule, forgetPluginModule
 from .funcs import Environment
+from .http_cache import HttpCache
+from .mirror import getMirror, getPluginsFile, getPypiFile
+from .wheelhouse import getPipInstallOptions
 from pwem import Domain
-from pyworkflow.utils import redStr, yellowStr
+from pyworkflow.utils import redStr, yellowStr, cyanStr
 from pyworkflow.utils.path import cleanPath
 from pyworkflow import LAST_VERSION, CORE_VERSION, OLD_VERSIONS, Config
-from importlib import reload
+from scipion.utils import getCacheFolder
 
 NULL_VERSION = "0.0.0"
 # This constant is used in order to install all plugins taking into account a
@@ -24,47 +31,224 @@ if REPOSITORY_URL is None:
     REPOSITORY_URL = Config.SCIPION_PLUGIN_REPO_URL
 
 PIP_BASE_URL = 'https://pypi.python.org/pypi'
-PIP_CMD = '{0} -m pip install %(installSrc)s'.format(
-    Environment.getPython())
+# Seconds to wait for PyPI, and number of plugins requested at the same time
+PIP_TIMEOUT = 15
+PIP_WORKERS = int(os.environ.get('SCIPION_PYPI_WORKERS', 16))
+PIP_CMD = '{0} -m pip install {1}%(installSrc)s'.format(
+    Environment.getPython(), getPipInstallOptions())
 
 PIP_UNINSTALL_CMD = '{0} -m pip uninstall -y %s'.format(
     Environment.getPython())
 
 versions = list(OLD_VERSIONS) + [LAST_VERSION]
 
+# Scipion versions a release is compatible with, in its pypi comment text
+_SCIPION_VERSION_REGEX = re.compile(r'scipion-([\d.]*\d)')
+_CORE_VERSION = str(parse_version(CORE_VERSION))
+
+_session = None
+_sessionLock = threading.Lock()
+_metadataCache = None
+
+
+class DistributionIndex:
+    """ Metadata of the installed python distributions, read once for all
+    the plugins. It has to be invalidated after installing or uninstalling. """
+
+    KEYS = ['Name', 'Version', 'Summary', 'Home-page', 'Author', 'Author-email']
+
+    def __init__(self):
+        self._dists = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(name):
+        """ Returns the name pip uses to compare distribution names """
+        return re.sub(r'[-_.]+', '-', name).lower()
+
+    def _load(self):
+        from importlib import metadata
+        dists = {}
+        # As in sys.path, the first distribution found with a name is used
+        for dist in metadata.distributions():
+            name = dist.metadata['Name']
+            if not name or self.normalize(name) in dists:
+                continue
+            info = {key: dist.metadata.get(key) or "" for key in self.KEYS}
+            topLevel = dist.read_text('top_level.txt')
+            info['top_level'] = topLevel.strip() if topLevel is not None else None
+            dists[self.normalize(name)] = info
+        return dists
+
+    def get(self, name):
+        """ Returns a dict with the metadata fields (KEYS) and the top level
+        packages (top_level) of the distribution name, or None if it is not
+        installed. """
+        with self._lock:
+            if self._dists is None:
+                self._dists = self._load()
+            return self._dists.get(self.normalize(name))
+
+    def invalidate(self):
+        with self._lock:
+            self._dists = None
+
+
+distributionIndex = DistributionIndex()
+
+
+def getSession():
+    """ Returns the http session shared by all the requests, which keeps
+    the connections open and retries failed requests. """
+    global _session
+    with _sessionLock:
+        if _session is None:
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            retry = Retry(total=3, backoff_factor=0.5,
+                          status_forcelist=(429, 500, 502, 503, 504))
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=PIP_WORKERS,
+                                  max_retries=retry)
+            _session = requests.Session()
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def getMetadataCache():
+    """ Returns the on disk cache of the plugin list and the pypi data """
+    global _metadataCache
+    session = getSession()
+    with _sessionLock:
+        if _metadataCache is None:
+            _metadataCache = HttpCache(os.path.join(getCacheFolder(), 'metadata'),
+                                       session=session)
+        return _metadataCache
+
+
+def getCompatibilityMatrix(pipJsonData):
+    """ Returns the data of a plugin needed out of its json data from pypi:
+    the info fields and the matrix with the upload time and the compatible
+    Scipion versions of each release. """
+    matrix = {}
+    for release, files in pipJsonData.get('releases', {}).items():
+        if files:
+            comment = files[0].get('comment_text') or ''
+            scipionVersions = [str(parse_version(v))
+                               for v in _SCIPION_VERSION_REGEX.findall(comment)]
+            matrix[release] = [files[0].get('upload_time'), scipionVersions]
+    info = pipJsonData.get('info') or {}
+    return {'info': {key: info.get(key) for key in
+                     ['home_page', 'summary', 'author', 'author_email']},
+            'matrix': matrix}
+
+
+def compatibilityMatrix(content):
+    """ getCompatibilityMatrix of the content of a pypi json response """
+    return getCompatibilityMatrix(json.loads(content))
+
+
+def getPipJsonUrl(pipName):
+    return "%s/%s/json" % (PIP_BASE_URL, pipName)
+
+
+def _getPipData(pipName, derive=None):
+    """ Returns the pypi json content of pipName, or the result of derive
+    of it, from the mirror or the metadata cache. None if not available. """
+    mirror = getMirror()
+    if mirror is not None:
+        pypiFile = getPypiFile(mirror, pipName)
+        if os.path.exists(pypiFile):
+            with open(pypiFile, 'rb') as f:
+                content = f.read()
+            return content if derive is None else derive(content)
+        print("Warning: %s is not in the mirror %s" % (pipName, mirror))
+        return None
+    try:
+        data = getMetadataCache().get(getPipJsonUrl(pipName), timeout=PIP_TIMEOUT,
+                                      derive=derive)
+        if data is not None:
+            return data
+    except (requests.RequestException, ValueError) as e:
+        print(e)
+    print("Warning: Couldn't get remote plugin data for %s" % pipName)
+    return None
+
+
+def getPipJsonData(pipName):
+    """ Requests the json data of pipName from pypi. Returns it, or an empty
+    dict if it is not available. """
+    content = _getPipData(pipName)
+    return json.loads(content) if content is not None else {}
+
+
+def getPipMatrix(pipName):
+    """ Returns the part of the pypi json data of pipName used by the plugin
+    manager (see getCompatibilityMatrix), or an empty dict if it is not
+    available. It is computed again only when the data in pypi changes. """
+    return _getPipData(pipName, compatibilityMatrix) or {}
+
+
+def fetchPipMatrices(pipNames):
+    """ Requests the json data of several packages from pypi at the same
+    time. Returns a dict with the matrix of each one (see getPipMatrix). """
+    pipNames = list(pipNames)
+    if not pipNames:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(PIP_WORKERS, len(pipNames))) as executor:
+        return dict(zip(pipNames, executor.map(getPipMatrix, pipNames)))
+
+
+class _LazyField:
+    """ Attribute of PluginInfo set, with others, by the loader method the
+    first time it is read. Once set, the value in the instance is used. """
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __set_name__(self, owner, name):
+        self._name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        getattr(instance, self._loader)(self._name)
+        return instance.__dict__[self._name]
+
+
+REMOTE_FIELDS = ['homePage', 'summary', 'author', 'email',
+                 'compatibleReleases', 'latestRelease']
+LOCAL_FIELDS = ['dirName', 'pipVersion', 'binVersions']
+
 
 class PluginInfo(object):
 
+    # things from pypi
+    homePage = _LazyField('_loadRemotePluginInfo')
+    summary = _LazyField('_loadRemotePluginInfo')
+    author = _LazyField('_loadRemotePluginInfo')
+    email = _LazyField('_loadRemotePluginInfo')
+    compatibleReleases = _LazyField('_loadRemotePluginInfo')
+    latestRelease = _LazyField('_loadRemotePluginInfo')
+
+    # things we have when installed
+    dirName = _LazyField('_loadLocalPluginInfo')
+    pipVersion = _LazyField('_loadLocalPluginInfo')
+    binVersions = _LazyField('_loadLocalPluginInfo')
+
     def __init__(self, pipName="", name="", pluginSourceUrl="", remote=True,
-                 plugin=None, **kwargs):
+                 plugin=None, pipJsonData=None, **kwargs):
         self.pipName = pipName
         self.name = name
         self.pluginSourceUrl = pluginSourceUrl
         self.remote = remote
-
-        # things from pypi
-        self.homePage = ""
-        self.summary = ""
-        self.author = ""
-        self.email = ""
-        self.compatibleReleases = {}
-        self.latestRelease = ""
-
-        # things we have when installed
-        self.dirName = ""
-        self.pipVersion = ""
-        self.binVersions = []
         self.pluginEnv = None
 
-        # Distribution
-        self._dist = None
-        self._plugin = plugin
-        if self.remote:
-            self.setRemotePluginInfo()
-        else:
-            self.setFakedRemotePluginInfo()
+        # Data from pypi and from the installed package are only read when
+        # one of their fields is used
+        self._pipJsonData = pipJsonData
+        self._localMetadata = None
 
-        self.setLocalPluginInfo()  # get local info if installed
+        self._plugin = plugin
 
     # ###################### Install funcs ############################
 
@@ -76,19 +260,14 @@ class PluginInfo(object):
         self.setLocalPluginInfo()
 
     def _getDistribution(self):
-        if self._dist is None:
-            try:
-                self._dist = pkg_resources.get_distribution(self.pipName)
-            except:
-                pass
-        return self._dist
+        return distributionIndex.get(self.pipName) if self.pipName else None
 
     def _getPlugin(self):
         if self._plugin is None:
 
             try:
                 dirname = self.getDirName()
-                self._plugin = Config.getDomain().getPluginModule(dirname)
+                self._plugin = getPluginModule(dirname)
             except:
                 pass
         return self._plugin
@@ -100,7 +279,6 @@ class PluginInfo(object):
     def isInstalled(self):
         """Checks if the current plugin is installed (i.e. has pip package).
         NOTE: we might want to change definition of isInstalled, hence the extra function."""
-        reload(pkg_resources)
         return self.hasPipPackage()
 
     def installPipModule(self, version=""):
@@ -109,6 +287,33 @@ class PluginInfo(object):
         compatible one."""
         environment = Environment()
 
+        pipArgs = self.getPipInstallArgs(version)
+        if pipArgs is None:
+            return False
+        installSrc, target = pipArgs
+
+        cmd = PIP_CMD % {'installSrc': installSrc}
+
+        pipModule = environment.addPipModule(self.pipName,
+                                             target=target,
+                                             pipCmd=cmd)
+
+        # check if we're doing a version change of an already installed plugin
+        reloadPkgRes = self.isInstalled()
+
+        environment.execute()
+        distributionIndex.invalidate()
+        # we already have a dir for the plugin:
+        if reloadPkgRes:
+            # if plugin was already installed, its module is the old one
+            # so it needs a reload
+            self.refreshPlugin()
+        return True
+
+    def getPipInstallArgs(self, version=""):
+        """Returns the pip install arguments for the version specified (latest
+        compatible one if not specified) and the pattern of the folder it creates
+        in site-packages, or None if that version can not be installed."""
         if not version:
             version = self.latestRelease
         elif version not in self.compatibleReleases:
@@ -120,11 +325,11 @@ class PluginInfo(object):
             else:
                 print("%s has no compatible versions with current Scipion "
                       "version %s." % (self.pipName, LAST_VERSION))
-            return False
+            return None
 
         if version == NULL_VERSION:
             print("Plugin %s is not available for this Scipion %s yet" % (self.pipName, LAST_VERSION))
-            return False
+            return None
 
         if self.pluginSourceUrl:
             if os.path.exists(self.pluginSourceUrl):
@@ -139,25 +344,14 @@ class PluginInfo(object):
             # install from pypi
             installSrc = "%s==%s" % (self.pipName, version)
             target = "%s*" % self.pipName.replace('-', '_')
+        return installSrc, target
 
-        cmd = PIP_CMD % {'installSrc': installSrc}
-
-        pipModule = environment.addPipModule(self.pipName,
-                                             target=target,
-                                             pipCmd=cmd)
-
-        # check if we're doing a version change of an already installed plugin
-        reloadPkgRes = self.isInstalled()
-
-        environment.execute()
-        # we already have a dir for the plugin:
-        if reloadPkgRes:
-            # if plugin was already installed, pkg_resources has the old one
-            # so it needs a reload
-            reload(pkg_resources)
-            self.dirName = self.getDirName()
-            Domain.refreshPlugin(self.dirName)
-        return True
+    def refreshPlugin(self):
+        """Reloads the plugin module after a version change"""
+        self.dirName = self.getDirName()
+        Domain.refreshPlugin(self.dirName)
+        forgetPluginModule(self.dirName)
+        self._plugin = None
 
     def installBin(self, args=None):
         """Install binaries of the plugin. Args is the list of args to be
@@ -198,18 +392,19 @@ class PluginInfo(object):
         subprocess.call(PIP_UNINSTALL_CMD % self.pipName, shell=True,
                         stdout=sys.stdout,
                         stderr=sys.stderr)
+        distributionIndex.invalidate()
+        self.setLocalPluginInfo()
 
     # ###################### Remote data funcs ############################
 
     def getPipJsonData(self):
         """"Request json data from pypi, return json content"""
-        pipData = requests.get("%s/%s/json" % (PIP_BASE_URL, self.pipName))
-        if pipData.ok:
-            pipData = pipData.json()
-            return pipData
-        else:
-            print("Warning: Couldn't get remote plugin data for %s" % self.pipName)
-            return {}
+        return getPipJsonData(self.pipName)
+
+    def getPipMatrix(self):
+        """ Returns the info and the compatibility matrix of the releases
+        from the pypi json data (see getCompatibilityMatrix) """
+        return getPipMatrix(self.pipName)
 
     def getCompatiblePipReleases(self, pipJsonData=None):
         """Get pip releases of this plugin that are compatible with
@@ -217,35 +412,53 @@ class PluginInfo(object):
          a special key "latest" with the most recent one."""
 
         if pipJsonData is None:
-            pipJsonData = self.getPipJsonData()
+            pipJsonData = self.getPipMatrix()
+        if 'matrix' not in pipJsonData:
+            pipJsonData = getCompatibilityMatrix(pipJsonData)
 
-        reg = r'scipion-([\d.]*\d)'
         releases = {}
-        latestCompRelease = NULL_VERSION
-
-        for release, releaseData in pipJsonData['releases'].items():
-            releaseData = releaseData[0]
-            scipionVersions = [parse_version(v)
-                               for v in re.findall(reg,
-                                                   releaseData['comment_text'])]
-            if len(scipionVersions) != 0:
-                releases[release] = releaseData
-                if any([v == parse_version(CORE_VERSION)
-                        for v in scipionVersions]):
-                    if parse_version(latestCompRelease) < parse_version(release):
-                        latestCompRelease = release
+        compatible = []
+        for release, (uploadTime, scipionVersions) in pipJsonData['matrix'].items():
+            if scipionVersions:
+                releases[release] = {'upload_time': uploadTime}
+                if _CORE_VERSION in scipionVersions:
+                    compatible.append(release)
             else:
                 print(yellowStr("WARNING: %s's release %s did not specify a "
                                 "compatible Scipion version. Please, remove this "
                                 "release from pypi") % (self.pipName, release))
 
-        releases['latest'] = latestCompRelease
+        releases['latest'] = max(compatible, key=parse_version) if compatible else NULL_VERSION
         return releases
 
-    def setRemotePluginInfo(self):
-        """Sets value for the attributes that need to be obtained from pypi"""
-        reg = r'scipion-([\d.]*\d)'
-        pipData = self.getPipJsonData()
+    def _loadRemotePluginInfo(self, field=None):
+        """Sets all the fields from pypi, or from the installed package for
+        plugins that are not remote."""
+        self.homePage = ""
+        self.summary = ""
+        self.author = ""
+        self.email = ""
+        self.compatibleReleases = {}
+        self.latestRelease = ""
+        if self.remote:
+            self.setRemotePluginInfo(self._pipJsonData)
+        else:
+            self.setFakedRemotePluginInfo()
+            metadata = self._getLocalMetadata()
+            if metadata is not None:
+                # only do this if we don't already have it from remote
+                self.homePage = metadata.get('Home-page', "")
+                self.summary = metadata.get('Summary', "")
+                self.author = metadata.get('Author', "")
+                self.email = metadata.get('Author-email', "")
+
+    def setRemotePluginInfo(self, pipData=None):
+        """Sets value for the attributes that need to be obtained from pypi.
+
+        :param pipData: Optional, json data from pypi already requested, or
+            its compatibility matrix"""
+        if pipData is None:
+            pipData = self.getPipMatrix()
         if not pipData:
             return
         info = pipData['info']
@@ -267,45 +480,30 @@ class PluginInfo(object):
 
     # ###################### Local data funcs ############################
 
-    def setLocalPluginInfo(self):
-        """Sets value for the attributes that can be obtained locally if the
-        plugin is installed."""
-        if self.isInstalled():
-
-            metadata = {}
-            # Take into account 2 cases here:
-            # A.: plugin is a proper pipmodule and is installed as such
-            # B.: Plugin is not yet a pipmodule but a local folder.
-            try:
-                package = pkg_resources.get_distribution(self.pipName)
-                keys = ['Name', 'Version', 'Summary', 'Home-page', 'Author',
-                        'Author-email']
-                pattern = r'(.*): (.*)'
-
-                for line in package._get_metadata(package.PKG_INFO):
-                    match = re.match(pattern, line)
-                    if match:
-                        key = match.group(1)
-                        if key in keys:
-                            metadata[key] = match.group(2)
-                            keys.remove(key)
-                            if not len(keys):
-                                break
-
-                self.pipVersion = metadata.get('Version', "")
-                self.dirName = self.getDirName()
-                self.binVersions = self.getBinVersions()
-
-            except:
-                # Case B: code local but not yet a pipmodule.
-                pass
+    def _getLocalMetadata(self):
+        """Returns a dict with the PKG-INFO fields of the installed plugin,
+        or None if it is not installed."""
+        if self._localMetadata is None:
+            self._localMetadata = self._getDistribution()
+        return self._localMetadata
+
+    def _loadLocalPluginInfo(self, field):
+        """Sets the field asked of the installed plugin. The binaries are
+        only read if asked, since it imports the plugin."""
+        metadata = self._getLocalMetadata()
+        if field == 'binVersions':
+            self.binVersions = self.getBinVersions() if metadata else []
+        else:
+            self.pipVersion = metadata.get('Version', "") if metadata else ""
+            self.dirName = self.getDirName() if metadata else ""
 
-            if not self.remote:
-                # only do this if we don't already have it from remote
-                self.homePage = metadata.get('Home-page', "")
-                self.summary = metadata.get('Summary', "")
-                self.author = metadata.get('Author', "")
-                self.email = metadata.get('Author-email', "")
+    def setLocalPluginInfo(self):
+        """Forgets the attributes obtained locally, so they are read again
+        from the plugin installed when used."""
+        self._localMetadata = None
+        fields = LOCAL_FIELDS if self.remote else LOCAL_FIELDS + REMOTE_FIELDS
+        for field in fields:
+            self.__dict__.pop(field, None)
 
     def getPluginClass(self):
         """ Tries to find the Plugin object."""
@@ -360,10 +558,8 @@ class PluginInfo(object):
            itself (e.g. to import the _plugin object.)"""
         # top level file is a file included in all pip packages that contains
         # the name of the package's top level directory
-        try:
-            return pkg_resources.get_distribution(self.pipName).get_metadata('top_level.txt').strip()
-        except Exception as e:
-            return None
+        dist = self._getDistribution()
+        return dist['top_level'] if dist is not None else None
 
     def printBinInfoStr(self):
         """Returns string with info of binaries installed to print in console
@@ -423,15 +619,37 @@ class PluginRepository(object):
 
     @staticmethod
     def getBinToPluginDict():
-        localPlugins = Domain.getPlugins()
-        binToPluginDict = {}
-        for p, pobj in localPlugins.items():
-            pinfo = PluginInfo(name=p, plugin=pobj, remote=False)
-            pbins = pinfo.getBinVersions()
-            binToPluginDict.update({k: p for k in pbins})
-            pbinsNoVersion = set([b.split('-', 1)[0] for b in pbins])
-            binToPluginDict.update({k: p for k in pbinsNoVersion})
-        return binToPluginDict
+        return BinaryIndex().update().getBinToPluginDict()
+
+    def getPluginsJson(self):
+        """Reads the plugins from the mirror, if any, or from self.repoUrl.
+        Returns a dict with the data of each plugin, or None if it is not
+        available."""
+        mirror = getMirror()
+        if mirror is not None:
+            pluginsFile = getPluginsFile(mirror)
+            if not os.path.exists(pluginsFile):
+                print(redStr("ERROR: The mirror %s has no plugin list %s. Build it with "
+                             "'scipion installp -p ... --build-mirror %s'."
+                             % (mirror, pluginsFile, mirror)))
+                return None
+            with open(pluginsFile) as f:
+                return json.load(f)
+        if os.path.isfile(self.repoUrl):
+            with open(self.repoUrl) as f:
+                return json.load(f)
+        try:
+            content = getMetadataCache().get(self.repoUrl, timeout=PIP_TIMEOUT)
+        except requests.RequestException as e:
+            print("\nWARNING: Error while trying to connect with a server:\n"
+                  "  > Please, check your internet connection!\n")
+            print(e)
+            return None
+        if content is None:
+            print("WARNING: Can't get Scipion's plugin list, the plugin "
+                  "repository is not available")
+            return None
+        return json.loads(content)
 
     def getPlugins(self, pluginList=None, getPipData=False):
         """Reads available plugins from self.repoUrl and returns a dict with
@@ -440,29 +658,14 @@ class PluginRepository(object):
         - getPipData: If true, each PluginInfo object will try to get the data
         of the plugin from pypi."""
 
-        pluginsJson = {}
         if self.plugins is None:
             self.plugins = {}
 
-        if os.path.isfile(self.repoUrl):
-            with open(self.repoUrl) as f:
-                pluginsJson = json.load(f)
-            getPipData = False
-        else:
-            try:
-                r = requests.get(self.repoUrl)
-                getPipData = True
-            except requests.ConnectionError as e:
-                print("\nWARNING: Error while trying to connect with a server:\n"
-                      "  > Please, check your internet connection!\n")
-                print(e)
-                return self.plugins
-            if r.ok:
-                pluginsJson = r.json()
-            else:
-                print("WARNING: Can't get Scipion's plugin list, the plugin "
-                      "repository is not available")
-                return self.plugins
+        pluginsJson = self.getPluginsJson()
+        if pluginsJson is None:
+            return self.plugins
+        # Plugins in a local file have no data in pypi
+        getPipData = getMirror() is not None or not os.path.isfile(self.repoUrl)
 
         availablePlugins = pluginsJson.keys()
 
@@ -478,8 +681,13 @@ class PluginRepository(object):
                 print("You can see the list of available plugins with the following command:\n"
                       "scipion installp --help")
 
-        for pluginName in targetPlugins:
-            pluginsJson[pluginName].update(remote=getPipData)
+        # Plugins data is requested to pypi at once, not one after the other
+        pipNames = [pluginsJson[p].get('pipName', p) for p in targetPlugins]
+        pipJsonData = fetchPipMatrices(pipNames) if getPipData else {}
+
+        for pluginName, pipName in zip(targetPlugins, pipNames):
+            pluginsJson[pluginName].update(remote=getPipData,
+                                           pipJsonData=pipJsonData.get(pipName))
             pluginInfo = PluginInfo(**pluginsJson[pluginName])
             if pluginInfo.getLatestRelease() != NULL_VERSION:
                 self.plugins[pluginName] = pluginInfo
@@ -531,4 +739,51 @@ def installBinsDefault():
     """ Returns the default behaviour for installing binaries
     By default it is TRUE, define "SCIPION_DONT_INSTALL_BINARIES" to anything to deactivate binaries installation"""
 
-    return os.environ.get("SCIPION_DONT_INSTALL_BINARIES", True) == True
\ No newline at end of file
+    return os.environ.get("SCIPION_DONT_INSTALL_BINARIES", True) == True
+
+def installPipModules(plugins):
+    """ Installs the pip packages of several plugins with a single pip install,
+    so their dependencies are resolved and downloaded only once. If it fails,
+    the plugins are installed one by one to tell which ones fail.
+
+    :param plugins: list of (PluginInfo, version) tuples. An empty version
+        means the latest compatible one.
+    :returns the list of plugins installed
+    """
+    sources = []
+    for plugin, version in plugins:
+        pipArgs = plugin.getPipInstallArgs(version)
+        if pipArgs is not None:
+            sources.append((plugin, pipArgs[0]))
+    if not sources:
+        return []
+
+    # Already installed plugins have to be reloaded after a version change
+    updated = [plugin for plugin, _ in sources if plugin.isInstalled()]
+
+    if _runPip(' '.join(src for _, src in sources)) == 0:
+        installed = [plugin for plugin, _ in sources]
+    elif len(sources) == 1:
+        installed = []
+    else:
+        print(yellowStr("Installing the plugins one by one to find the failing ones"))
+        installed = [plugin for plugin, src in sources if _runPip(src) == 0]
+
+    for plugin, _ in sources:
+        if plugin not in installed:
+            print(redStr("Error installing plugin %s" % plugin.pipName))
+
+    distributionIndex.invalidate()
+    if any(plugin in installed for plugin in updated):
+        for plugin in updated:
+            if plugin in installed:
+                plugin.refreshPlugin()
+    return installed
+
+
+def _runPip(installSrc):
+    """ Runs pip install with installSrc and returns its exit code """
+    cmd = PIP_CMD % {'installSrc': installSrc}
+    print(cyanStr(cmd))
+    sys.stdout.flush()
+    return subprocess.call(cmd, shell=True, stdout=sys.stdout, stderr=sys.stderr)
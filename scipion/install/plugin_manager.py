@@ -31,7 +31,8 @@ from pyworkflow.gui.project import ProjectManagerWindow
 from pyworkflow.project import MenuConfig
 from pyworkflow.gui import *
 import pyworkflow.gui.dialog as pwgui
-from scipion.install.plugin_funcs import PluginRepository, PluginInfo, NULL_VERSION, installBinsDefault
+from scipion.install.plugin_funcs import (PluginRepository, PluginInfo, NULL_VERSION,
+                                          installBinsDefault, installPipModules)
 
 from pyworkflow.utils.properties import *
 from pyworkflow.utils import redStr, makeFilePath
@@ -224,19 +225,34 @@ class Operation:
         """
         return self.objParent
 
-    def runOperation(self, processors, handleBins=True):
+    def isPluginInstall(self):
+        """
+        Returns True if the operation installs or updates a plugin
+        """
+        return (self.objType == PluginStates.PLUGIN and
+                self.objStatus in (PluginStates.INSTALL, PluginStates.TO_UPDATE))
+
+    def runOperation(self, processors, handleBins=True, pipInstalled=None):
         """
         This method install or uninstall a plugin/binary operation
 
         :param processors: number of processors to compilation
         :param handleBins: deal with binaries installation/uninstallation if true (default)
+        :param pipInstalled: Optional, names of the plugins whose pip package
+            is already installed (see OperationList.installPipModules). If given,
+            plugin installs only install the binaries, and raise RuntimeError if
+            the plugin is not among them.
         """
         if self.objType == PluginStates.PLUGIN:
-            if (self.objStatus == PluginStates.INSTALL or
-                    self.objStatus == PluginStates.TO_UPDATE):
+            if self.isPluginInstall():
                 plugin = pluginDict.get(self.objName, None)
                 if plugin is not None:
-                    installed = plugin.installPipModule()
+                    if pipInstalled is None:
+                        installed = plugin.installPipModule()
+                    else:
+                        installed = self.objName in pipInstalled
+                        if not installed:
+                            raise RuntimeError("pip install of %s failed" % self.objName)
                     if installed and handleBins:
                         plugin.installBin({'args': ['-j', processors]})
             elif self.objStatus == PluginStates.UNINSTALL:
@@ -313,6 +329,19 @@ class OperationList:
             return operation[0]
         return None
 
+    def installPipModules(self, operations):
+        """
+        Install at once the pip packages of the plugins installed or updated
+        by the operations. Returns the names of the operations (see
+        getObjName) whose plugin was installed.
+        """
+        operations = [op for op in operations
+                      if op.isPluginInstall() and op.getObjName() in pluginDict]
+        installed = installPipModules([(pluginDict[op.getObjName()], "")
+                                       for op in operations])
+        return {op.getObjName() for op in operations
+                if pluginDict[op.getObjName()] in installed}
+
     def applyOperations(self):
         """
         Execute a operation list
@@ -764,11 +793,19 @@ class PluginBrowser(tk.Frame):
         message = pwgui.FloatingMessage(self.operationTree, defaultModeMessage,
                                         xPos=300, yPos=20)
         message.show()
-        for op in self.operationList.getOperations(operation):
+        operations = self.operationList.getOperations(operation)
+        # Plugins are installed with a single pip install, when the first of
+        # them is reached: after the operations queued before it, and before
+        # the ones queued after it
+        pipInstalled = None
+        for op in operations:
             item = op.getObjName()
             try:
                 self.operationTree.processing_item(item)
-                op.runOperation(self.numberProcessors.get(), not self.skipBinaries.get())
+                if pipInstalled is None and op.isPluginInstall():
+                    pipInstalled = self.operationList.installPipModules(operations)
+                op.runOperation(self.numberProcessors.get(), not self.skipBinaries.get(),
+                                pipInstalled=pipInstalled)
                 self.operationTree.installed_item(item)
                 if (op.getObjStatus() == PluginStates.INSTALL or
                         op.getObjStatus() == PluginStates.TO_UPDATE):
@@ -778,7 +815,7 @@ class PluginBrowser(tk.Frame):
                         self.tree.check_item(item)
                 else:
                     self.tree.uncheck_item(item)
-            except AssertionError as err:
+            except (AssertionError, RuntimeError) as err:
                 self.operationTree.failure_item(item)
                 if op.getObjType() == PluginStates.BINARY:
                     self.reloadInstalledPlugin(op.getObjParent())
@@ -1135,10 +1172,8 @@ class PluginManager(PluginManagerWindow):
     Windows to hold a frame inside.
     """
     def __init__(self, title, master=None, **kwargs):
-
-        # Trigger plugin's variable definition
-        Config.getDomain().getPlugins()
-
+        # Plugins are imported, and their variables defined, when their
+        # binaries are shown or installed
         PluginManagerWindow.__init__(self, title, master, **kwargs)
         PluginBrowser(self.root, **kwargs)
 
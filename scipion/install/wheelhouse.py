@@ -0,0 +1,74 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Folder with the wheels of the plugins and the pip modules of their
+binaries, built once (scipion installp -p ... --wheelhouse DIR) and used
+by the installations of all the nodes without going to PyPI.
+"""
+import os
+import shlex
+import subprocess
+import sys
+
+from .mirror import getMirror, getWheelsFolder
+
+# Folder with the wheels. When defined, pip installs only from it.
+SCIPION_WHEELHOUSE = 'SCIPION_WHEELHOUSE'
+
+
+def getWheelhouse():
+    """ Returns the wheelhouse folder configured, the one of the mirror
+    (see SCIPION_MIRROR) or None """
+    folder = os.environ.get(SCIPION_WHEELHOUSE, '')
+    if folder:
+        return os.path.abspath(os.path.expanduser(folder))
+    mirror = getMirror()
+    return getWheelsFolder(mirror) if mirror else None
+
+
+def getPipInstallOptions():
+    """ Returns the options for pip install to use the wheelhouse, if any,
+    followed by a space. """
+    folder = getWheelhouse()
+    if folder is None:
+        return ''
+    return '--no-index --find-links %s ' % shlex.quote(folder)
+
+
+def buildWheelhouse(folder, specs, python=None):
+    """ Download, or build from the sources, the wheels of specs and all
+    their dependencies into folder. Wheels already there are reused.
+
+    :param folder: the wheelhouse
+    :param specs: list of pip requirements, e.g. scipion-em-relion==3.1
+    :param python: python whose pip is used, the current one by default
+    :returns the exit code of pip
+    """
+    os.makedirs(folder, exist_ok=True)
+    cmd = [python or sys.executable, '-m', 'pip', 'wheel',
+           '--wheel-dir', folder, '--find-links', folder] + list(specs)
+    print(' '.join(cmd))
+    return subprocess.call(cmd)
@@ -0,0 +1,319 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Profiling of scipion commands, enabled with SCIPION_PROFILE:
+
+ - 1 (or on, true, yes, cprofile): every function call is measured with cProfile
+ - sample: the stacks of all the threads are sampled every
+   SCIPION_PROFILE_INTERVAL seconds (0.005 by default), with a low overhead
+
+Each process writes its own file, MODE-HOST-PID-TIME.prof (pstats) or
+.folded (collapsed stacks, as used by flame graph tools), into
+SCIPION_PROFILE_DIR (the profiles folder of the scipion cache by default).
+
+    python -m scipion.profiling run [--mode MODE] script.py|-c CODE|-m MODULE [ARGS]
+    python -m scipion.profiling report [--mode MODE] [--top N] [FOLDER or FILES]
+
+"scipion profile ..." is the same as "python -m scipion.profiling ...".
+"""
+import argparse
+import atexit
+import glob
+import os
+import socket
+import sys
+import threading
+import time
+
+from scipion.utils import getCacheFolder
+
+SCIPION_PROFILE = 'SCIPION_PROFILE'
+SCIPION_PROFILE_DIR = 'SCIPION_PROFILE_DIR'
+SCIPION_PROFILE_INTERVAL = 'SCIPION_PROFILE_INTERVAL'
+
+PROFILE_CPROFILE = 'cprofile'
+PROFILE_SAMPLE = 'sample'
+DEFAULT_INTERVAL = 0.005
+
+_EXTENSIONS = {PROFILE_CPROFILE: '.prof', PROFILE_SAMPLE: '.folded'}
+
+# Profiler of this process, if any
+_profiler = None
+
+
+def getProfileKind():
+    """ Returns PROFILE_CPROFILE, PROFILE_SAMPLE or None, from SCIPION_PROFILE """
+    value = os.environ.get(SCIPION_PROFILE, '').lower()
+    if value in ['1', 'true', 'on', 'yes', PROFILE_CPROFILE]:
+        return PROFILE_CPROFILE
+    if value in [PROFILE_SAMPLE, 'sampling']:
+        return PROFILE_SAMPLE
+    return None
+
+
+def getProfileDir():
+    return os.path.expanduser(os.environ.get(SCIPION_PROFILE_DIR) or
+                              os.path.join(getCacheFolder(), 'profiles'))
+
+
+def getProfileFile(mode, kind):
+    """ Returns a new file for the profile of this process """
+    name = '%s-%s-%d-%s%s' % (mode, socket.gethostname(), os.getpid(),
+                              time.strftime('%Y%m%d-%H%M%S'), _EXTENSIONS[kind])
+    return os.path.join(getProfileDir(), name.replace(os.sep, '_'))
+
+
+class SamplingProfiler:
+    """ Counts the stacks of the threads of this process, sampled from a
+    background thread """
+
+    def __init__(self, interval=None):
+        if interval is None:
+            interval = float(os.environ.get(SCIPION_PROFILE_INTERVAL, DEFAULT_INTERVAL))
+        self._interval = interval
+        self._counts = {}
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        ownId = threading.get_ident()
+        while self._running:
+            time.sleep(self._interval)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for threadId, frame in sys._current_frames().items():
+                if threadId != ownId:
+                    stack = self._getStack(frame, names.get(threadId, str(threadId)))
+                    self._counts[stack] = self._counts.get(stack, 0) + 1
+
+    @staticmethod
+    def _getStack(frame, threadName):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append('%s (%s:%d)' % (code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        frames.append(threadName)
+        return ';'.join(reversed(frames))
+
+    def getCounts(self):
+        return dict(self._counts)
+
+    def dump(self, path):
+        """ Writes the stacks in the collapsed format: frames separated by
+        semicolons, then the number of samples """
+        with open(path, 'w') as f:
+            for stack, count in sorted(self._counts.items()):
+                f.write('%s %d\n' % (stack, count))
+
+
+class _CProfiler:
+    def __init__(self):
+        import cProfile
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def dump(self, path):
+        self._profile.dump_stats(path)
+
+
+def start(mode):
+    """ Starts profiling this process, if SCIPION_PROFILE is set, until it
+    exits or stop is called. Returns whether it was started. """
+    global _profiler
+    kind = getProfileKind()
+    if kind is None or _profiler is not None:
+        return False
+    profiler = _CProfiler() if kind == PROFILE_CPROFILE else SamplingProfiler()
+    _profiler = (profiler, getProfileFile(mode, kind))
+    profiler.start()
+    atexit.register(stop)
+    return True
+
+
+def stop():
+    """ Stops profiling and writes the profile. Returns its file, or None """
+    global _profiler
+    if _profiler is None:
+        return None
+    profiler, path = _profiler
+    _profiler = None
+    profiler.stop()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump(path)
+    except OSError as e:
+        print("Could not write the profile %s: %s" % (path, e), file=sys.stderr)
+        return None
+    return path
+
+
+def reset():
+    """ Discards the profiler of this process, e.g. inherited with fork """
+    global _profiler
+    if _profiler is not None:
+        _profiler[0].stop()
+        _profiler = None
+
+
+def getProfileFiles(paths, mode=None):
+    """ Returns the profile files in paths (files or folders), of mode only
+    if given """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.prof')) +
+                                glob.glob(os.path.join(path, '*.folded'))))
+        else:
+            files.append(path)
+    if mode is not None:
+        files = [f for f in files if os.path.basename(f).startswith(mode + '-')]
+    return files
+
+
+def mergeSamples(files):
+    """ Returns a dict with the number of samples of each stack in the
+    collapsed stack files """
+    counts = {}
+    for path in files:
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    counts[stack] = counts.get(stack, 0) + int(count)
+    return counts
+
+
+def getSampleReport(counts, top=30):
+    """ Returns a table with the functions taking most samples, in the
+    function itself (self) or in the functions it calls (total) """
+    selfCounts = {}
+    totalCounts = {}
+    for stack, count in counts.items():
+        frames = stack.split(';')[1:]  # Without the thread
+        if not frames:
+            continue
+        selfCounts[frames[-1]] = selfCounts.get(frames[-1], 0) + count
+        for frame in set(frames):
+            totalCounts[frame] = totalCounts.get(frame, 0) + count
+
+    samples = sum(counts.values()) or 1
+    lines = ['%d samples' % sum(counts.values()),
+             '%8s %8s  %s' % ('total%', 'self%', 'function')]
+    for frame in sorted(totalCounts, key=lambda f: (-totalCounts[f], f))[:top]:
+        lines.append('%8.1f %8.1f  %s' % (100. * totalCounts[frame] / samples,
+                                         100. * selfCounts.get(frame, 0) / samples, frame))
+    return '\n'.join(lines)
+
+
+def report(paths, mode=None, top=30, output=None):
+    """ Prints the merge of the profiles in paths. Returns False if there
+    are none.
+
+    :param output: Optional, file to write the merged profile into: pstats
+        for cProfile profiles, collapsed stacks for the sampled ones
+    """
+    files = getProfileFiles(paths, mode)
+    profFiles = [f for f in files if f.endswith('.prof')]
+    sampleFiles = [f for f in files if f.endswith('.folded')]
+    if not files:
+        print("No profiles found in %s" % ' '.join(paths))
+        return False
+
+    if profFiles:
+        import pstats
+        print("cProfile: %d profiles" % len(profFiles))
+        stats = pstats.Stats(*profFiles)
+        stats.sort_stats('cumulative').print_stats(top)
+        if output:
+            stats.dump_stats(output)
+    if sampleFiles:
+        counts = mergeSamples(sampleFiles)
+        print("Sampling: %d profiles, %s" % (len(sampleFiles), getSampleReport(counts, top)))
+        if output and not profFiles:
+            with open(output, 'w') as f:
+                for stack, count in sorted(counts.items()):
+                    f.write('%s %d\n' % (stack, count))
+    return True
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='scipion profile',
+                                     description="Profile python commands and merge the profiles "
+                                                 "written with SCIPION_PROFILE.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    runParser = subparsers.add_parser('run', help="Run python with a profile of it")
+    runParser.add_argument('--mode', default='python', help="Name of the profile files")
+    runParser.add_argument('args', nargs=argparse.REMAINDER,
+                           help="script.py, -c CODE or -m MODULE, and their arguments")
+    reportParser = subparsers.add_parser('report', help="Merge the profiles into a report")
+    reportParser.add_argument('paths', nargs='*', help="Profile files or folders, "
+                                                       "SCIPION_PROFILE_DIR by default")
+    reportParser.add_argument('--mode', help="Only the profiles of this mode")
+    reportParser.add_argument('--top', type=int, default=30, help="Number of functions shown")
+    reportParser.add_argument('-o', '--output', help="Write the merged profile into this file")
+
+    args = sys.argv[1:] if args is None else list(args)
+    if args[:1] == ['run'] and not set(args[1:2]) & {'-h', '--help'}:
+        # The arguments of python are given as they are, not parsed
+        mode, pythonArgs = 'python', args[1:]
+        if pythonArgs[:1] == ['--mode'] and len(pythonArgs) > 1:
+            mode, pythonArgs = pythonArgs[1], pythonArgs[2:]
+        if pythonArgs[:1] == ['--']:
+            pythonArgs = pythonArgs[1:]
+
+        from scipion.utils import runPythonInProcess
+        if os.environ.get(SCIPION_PROFILE) is None:
+            os.environ[SCIPION_PROFILE] = PROFILE_CPROFILE
+        start(mode)
+        if not runPythonInProcess(pythonArgs):
+            # An interactive session or python options: not profiled
+            reset()
+            os.execv(sys.executable, [sys.executable] + pythonArgs)
+        return
+
+    parsedArgs = parser.parse_args(args)
+    if parsedArgs.command == 'report':
+        sys.exit(0 if report(parsedArgs.paths or [getProfileDir()], parsedArgs.mode,
+                             parsedArgs.top, parsedArgs.output) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+# **************************************************************************
+# *
+# * Authors:     Scipion team (scipion@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Warm server for repeated scipion invocations. "scipion server" imports
+pyworkflow and the plugins once and listens on a UNIX socket. With
+SCIPION_SERVER=1, "scipion runprotocol", "python", "run" and "protocols"
+send their arguments, working folder, environment and stdin/stdout/stderr
+to it. The server forks a child that receives and runs them, with python
+scripts run in the child itself, and the exit code is sent back.
+
+Requests from an environment whose scipion variables, python path or
+interpreter differ from the ones of the server are refused, and run as
+usual. When the installed distributions or plugins change (installp,
+uninstallp, an upgrade...), the server refuses the request and stops, since
+the code it loaded is no longer the installed one. They are only read again
+when the folders of sys.path or the __init__ files of the plugins change.
+"""
+import hashlib
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import traceback
+from importlib import metadata, util
+
+from scipion.utils import getCacheFolder
+
+# Set it to 1 to run the scipion commands in the server, if it is running
+SCIPION_SERVER = 'SCIPION_SERVER'
+# Socket of the server, server-HASH.sock of the cache folder by default
+SCIPION_SERVER_SOCKET = 'SCIPION_SERVER_SOCKET'
+SERVER_VARS = [SCIPION_SERVER, SCIPION_SERVER_SOCKET]
+# Variables changing the code python imports, compared as the scipion ones
+PYTHON_VARS = ['PYTHONPATH', 'PYTHONHOME', 'VIRTUAL_ENV']
+
+# Seconds to wait for the request of a client
+REQUEST_TIMEOUT = 10
+
+_HEADER = struct.Struct('!I')
+_STDIO = [0, 1, 2]
+
+
+def getServerSocket(configFiles):
+    """ Returns the socket of the server of the given config files """
+    path = os.environ.get(SCIPION_SERVER_SOCKET)
+    if path:
+        return path
+    name = hashlib.sha256('\n'.join(configFiles).encode()).hexdigest()[:16]
+    return os.path.join(getCacheFolder(), 'server-%s.sock' % name)
+
+
+def getCodeFiles():
+    """ Returns the folders of sys.path and the __init__ files of the
+    plugins, which change when the code installed does """
+    from scipion.install.discovery import getPluginEntryPoints
+    files = [path for path in sys.path if os.path.isdir(path)]
+    for name in getPluginEntryPoints():
+        try:
+            spec = util.find_spec(name)
+            if spec is not None and spec.origin and os.path.exists(spec.origin):
+                files.append(spec.origin)
+        except (ImportError, ValueError):
+            pass
+    return files
+
+
+def _getModificationTimes(files):
+    times = []
+    for path in files:
+        try:
+            times.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            times.append(None)
+    return times
+
+
+def getCodeKey():
+    """ Returns the version of each installed distribution and the version
+    and __init__ modification time of each plugin, as the binary index """
+    from scipion.install.binary_index import getPluginVersions
+    key = {}
+    for dist in metadata.distributions():
+        name = dist.metadata['Name']
+        if name:
+            key[name] = dist.version
+    key.update(('plugin:%s' % name, version) for name, version in getPluginVersions().items())
+    return key
+
+
+def _sendMessage(conn, message, fds=None):
+    data = json.dumps(message).encode()
+    header = _HEADER.pack(len(data))
+    if fds:
+        socket.send_fds(conn, [header], fds)
+    else:
+        conn.sendall(header)
+    conn.sendall(data)
+
+
+def _recvExactly(conn, size, data=b''):
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError('connection closed')
+        data += chunk
+    return data
+
+
+def _recvMessage(conn, maxFds=0):
+    """ Returns the message received and the file descriptors sent with it """
+    fds = []
+    header = b''
+    if maxFds:
+        header, fds, _, _ = socket.recv_fds(conn, _HEADER.size, maxFds)
+    header = _recvExactly(conn, _HEADER.size, header)
+    size, = _HEADER.unpack(header)
+    return json.loads(_recvExactly(conn, size)), fds
+
+
+def runInServer(socketPath, argv):
+    """ Runs scipion with argv in the server listening at socketPath and
+    exits with its exit code. Returns if there is no server or it refuses
+    the request. """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socketPath)
+        _sendMessage(conn, {'argv': argv, 'cwd': os.getcwd(), 'environ': dict(os.environ),
+                            'executable': sys.executable}, _STDIO)
+        reply, _ = _recvMessage(conn)
+    except (OSError, EOFError, ValueError):
+        conn.close()
+        return
+    if 'pid' not in reply:
+        if reply.get('error') == 'code':
+            print("The scipion server was stopped: the installed plugins changed "
+                  "since it started. Start it again to use them.", file=sys.stderr)
+        conn.close()
+        return
+
+    pid = reply['pid']
+
+    def forward(signum, frame):
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+
+    for signum in [signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT]:
+        signal.signal(signum, forward)
+    try:
+        reply, _ = _recvMessage(conn)
+    except (OSError, EOFError, ValueError):
+        sys.exit('Lost connection with the scipion server')
+    exitCode = reply['exitCode']
+    if exitCode < 0:  # Killed by a signal, die the same way
+        signal.signal(-exitCode, signal.SIG_DFL)
+        os.kill(os.getpid(), -exitCode)
+    sys.exit(exitCode)
+
+
+class ZygoteServer:
+    """ Forks a child running the scipion arguments of each client """
+
+    def __init__(self, socketPath, runChild, environKey, environ=None, codeKey=None,
+                 codeFiles=()):
+        """
+        :param socketPath: UNIX socket to listen to
+        :param runChild: function running scipion with a list of arguments,
+            called in the child
+        :param environKey: function returning the values of the variables
+            of an environment that have to be the same as in the server
+        :param environ: environment the server was launched with,
+            os.environ by default
+        :param codeKey: optional function returning the versions of the code
+            installed, e.g. getCodeKey. The server stops when they change.
+        :param codeFiles: files and folders that are modified when the code
+            installed changes, e.g. getCodeFiles. codeKey is only called
+            when one of them was modified.
+        """
+        self._socketPath = socketPath
+        self._runChild = runChild
+        self._environKey = environKey
+        self._serverKey = self._getKey(os.environ if environ is None else environ,
+                                       sys.executable)
+        self._codeKey = codeKey
+        self._serverCode = codeKey() if codeKey is not None else None
+        self._codeFiles = list(codeFiles)
+        self._codeTimes = _getModificationTimes(self._codeFiles)
+        self._socket = None
+        self._wakeupFds = None
+        self._children = {}  # pid: connection with its client
+        self._running = False
+
+    def _getKey(self, environ, executable):
+        """ Returns what has to be the same in a client and in the server """
+        environ = {k: v for k, v in environ.items() if k not in SERVER_VARS}
+        return (self._environKey(environ), {name: environ.get(name) for name in PYTHON_VARS},
+                executable)
+
+    def _listen(self):
+        if os.path.exists(self._socketPath):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self._socketPath)
+                probe.close()
+                sys.exit('A scipion server is already listening at %s' % self._socketPath)
+            except OSError:
+                os.remove(self._socketPath)  # Left by a dead server
+        os.makedirs(os.path.dirname(self._socketPath) or '.', exist_ok=True)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)  # Only the user can connect
+        try:
+            self._socket.bind(self._socketPath)
+        finally:
+            os.umask(umask)
+        self._socket.listen(64)
+
+    def stop(self, *args):
+        self._running = False
+
+    def serve(self):
+        """ Serves the clients until SIGTERM or Ctrl-C """
+        self._listen()
+        self._wakeupFds = os.pipe()
+        for fd in self._wakeupFds:
+            os.set_blocking(fd, False)
+        signal.set_wakeup_fd(self._wakeupFds[1])
+        signal.signal(signal.SIGCHLD, lambda *args: None)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGUSR1, self.stop)  # From a child, the code changed
+        print("Scipion server listening at %s" % self._socketPath)
+        sys.stdout.flush()
+
+        self._running = True
+        try:
+            while self._running:
+                readable, _, _ = select.select([self._socket, self._wakeupFds[0]], [], [])
+                if self._wakeupFds[0] in readable:
+                    try:
+                        os.read(self._wakeupFds[0], 4096)
+                    except BlockingIOError:
+                        pass
+                self._reap()
+                if self._socket in readable and self._running:
+                    self._accept()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._socket.close()
+            if os.path.exists(self._socketPath):
+                os.remove(self._socketPath)
+            try:
+                self._reap(wait=True)  # The requests being run are finished
+            except KeyboardInterrupt:
+                pass
+            signal.set_wakeup_fd(-1)
+            for fd in self._wakeupFds:
+                os.close(fd)
+
+    def _reap(self, wait=False):
+        """ Sends the exit code of the children finished to their clients.
+
+        :param wait: True to wait until all of them finish
+        """
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, 0 if wait else os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            conn = self._children.pop(pid, None)
+            if conn is not None:
+                try:
+                    _sendMessage(conn, {'exitCode': os.waitstatus_to_exitcode(status)})
+                except OSError:
+                    pass
+                conn.close()
+
+    def _accept(self):
+        """ Forks a child for the next client. Its request is received and
+        checked in the child, so a slow client does not stop the others. """
+        conn, _ = self._socket.accept()
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+        except OSError as e:
+            print("Error serving a request: %s" % e)
+            conn.close()
+            return
+        if pid == 0:
+            self._child(conn)
+        self._children[pid] = conn
+
+    def _checkRequest(self, request, fds):
+        """ Returns why the request is refused, or None """
+        key = self._getKey(request['environ'], request.get('executable'))
+        if len(fds) != len(_STDIO) or key != self._serverKey:
+            return 'environment'
+        if (self._codeKey is not None
+                and _getModificationTimes(self._codeFiles) != self._codeTimes
+                and self._codeKey() != self._serverCode):
+            return 'code'
+        return None
+
+    def _child(self, conn):
+        """ Receives the request of the client of conn, and runs it in this
+        child with the stdio of the client. Exits with its exit code. """
+        signal.set_wakeup_fd(-1)
+        for signum in [signal.SIGCHLD, signal.SIGTERM, signal.SIGUSR1]:
+            signal.signal(signum, signal.SIG_DFL)
+        self._socket.close()
+        for other in self._children.values():
+            other.close()
+        for fd in self._wakeupFds:
+            os.close(fd)
+
+        fds = []
+        try:
+            conn.settimeout(REQUEST_TIMEOUT)
+            request, fds = _recvMessage(conn, maxFds=len(_STDIO))
+            error = self._checkRequest(request, fds)
+            if error is not None:
+                _sendMessage(conn, {'error': error})
+                if error == 'code':
+                    print("The installed plugins changed since the server started, stopping it")
+                    os.kill(os.getppid(), signal.SIGUSR1)
+                sys.stdout.flush()
+                os._exit(1)
+            _sendMessage(conn, {'pid': os.getpid()})
+        except (OSError, EOFError, ValueError, KeyError) as e:
+            print("Error serving a request: %s" % e)
+            sys.stdout.flush()
+            os._exit(1)
+        except BaseException:  # e.g. Ctrl-C, never back to the loop of the server
+            os._exit(1)
+        finally:
+            conn.close()
+
+        exitCode = 1
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            for target, fd in zip(_STDIO, fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            fds[:] = []
+            sys.stdin = sys.__stdin__ = os.fdopen(0, 'r', closefd=False)
+            sys.stdout = sys.__stdout__ = os.fdopen(1, 'w', buffering=1 if os.isatty(1) else -1,
+                                                    closefd=False)
+            sys.stderr = sys.__stderr__ = os.fdopen(2, 'w', buffering=1, closefd=False)
+
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['environ'])
+            self._runChild(request['argv'])
+            exitCode = 0
+        except SystemExit as e:
+            if e.code is None:
+                exitCode = 0
+            elif isinstance(e.code, int):
+                exitCode = e.code
+            else:
+                print(e.code, file=sys.stderr)
+        except KeyboardInterrupt:
+            exitCode = 128 + signal.SIGINT
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                import atexit
+                atexit._run_exitfuncs()
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(exitCode)
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# Folder with the scipion package, for the python subprocesses of the tests
+SOURCE_FOLDER = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestCase(unittest.TestCase):
+    """ Base of the scipion tests, with temporary folders removed after
+    each test """
+
+    def getTmpFolder(self):
+        """ Returns a new empty folder, removed when the test finishes """
+        folder = tempfile.mkdtemp(prefix='scipion-test-')
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        return folder
+
+    @staticmethod
+    def getSubprocessEnviron(**variables):
+        """ Returns the environment for python subprocesses importing scipion """
+        pythonPath = os.pathsep.join(filter(None, [SOURCE_FOLDER, os.environ.get('PYTHONPATH')]))
+        return dict(os.environ, PYTHONPATH=pythonPath, **variables)
+
+
+class FakeSession:
+    """ requests session answering with the content of a dict of urls.
+    Urls are revalidated with their ETag and the requests are recorded. """
+
+    def __init__(self, contents=None):
+        self.contents = contents or {}
+        self.requests = []
+        self.online = True
+
+    def getETag(self, url):
+        return '"%s"' % hashlib.md5(self.contents[url]).hexdigest()
+
+    def get(self, url, headers=None, timeout=None, **kwargs):
+        headers = headers or {}
+        self.requests.append((url, headers))
+        if not self.online:
+            raise requests.ConnectionError('offline')
+        response = requests.Response()
+        response.url = url
+        content = self.contents.get(url)
+        if content is None:
+            response.status_code = 404
+        elif headers.get('If-None-Match') == self.getETag(url):
+            response.status_code = 304
+        else:
+            response.status_code = 200
+            response.headers['ETag'] = self.getETag(url)
+            response._content = content
+        return response
+
+
+class HttpServer:
+    """ Local http server of the files in a dict {path: bytes}, accepting
+    range requests. It records the requests, and can be made to fail the
+    next GET requests (errors), to close their connection after sending a
+    part of the file (drops) or to go down after sending some bytes (limit).
+    Used as a context manager. """
+
+    def __init__(self, files, ranges=True, encoded=()):
+        """
+        :param ranges: False for a server without range requests
+        :param encoded: paths sent with Content-Encoding: gzip, as some
+            servers do for compressed files
+        """
+        self.files = files
+        self.ranges = ranges
+        self.encoded = set(encoded)
+        self.requests = []  # (method, path, Range header)
+        self.errors = []  # status codes of the next GET requests
+        self.drops = []  # bytes sent by the next GET requests
+        self.limit = None  # bytes of the files that can be sent, None for all
+        self.ignoreRanges = False  # GET requests get the whole file, as if HEAD lied
+        self.url = None
+        self._lock = threading.Lock()
+        self._httpd = None
+
+    def __enter__(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self):
+                server._handle(self, head=True)
+
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, args=(0.05,), daemon=True).start()
+        self.url = 'http://127.0.0.1:%d' % self._httpd.server_address[1]
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def getSent(self, path):
+        """ Returns the bytes of path sent in GET requests, according to their ranges """
+        sent = 0
+        for method, requestPath, rangeHeader in self.requests:
+            if method == 'GET' and requestPath == path:
+                start, end = self._getRange(rangeHeader, len(self.files[path]), self.ranges)
+                sent += end - start + 1
+        return sent
+
+    @staticmethod
+    def _getRange(rangeHeader, size, ranges):
+        if not (ranges and rangeHeader):
+            return 0, size - 1
+        start, _, end = rangeHeader[len('bytes='):].partition('-')
+        return int(start), min(int(end), size - 1) if end else size - 1
+
+    def _handle(self, handler, head=False):
+        rangeHeader = handler.headers.get('Range')
+        with self._lock:
+            self.requests.append((handler.command, handler.path, rangeHeader))
+            error = self.errors.pop(0) if self.errors and not head else None
+            if error is None and not head and self.limit is not None and self.limit <= 0:
+                error = 503
+            drop = self.drops.pop(0) if self.drops and not error and not head else None
+        content = self.files.get(handler.path)
+        if error or content is None:
+            handler.send_response(error or 404)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+
+        ranges = self.ranges and (head or not self.ignoreRanges)
+        start, end = self._getRange(rangeHeader, len(content), ranges)
+        partial = ranges and rangeHeader is not None
+        handler.send_response(206 if partial else 200)
+        handler.send_header('Content-Length', str(end - start + 1))
+        if self.ranges:
+            handler.send_header('Accept-Ranges', 'bytes')
+        if partial:
+            handler.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(content)))
+        if handler.path in self.encoded:
+            handler.send_header('Content-Encoding', 'gzip')
+        handler.end_headers()
+        if head:
+            return
+
+        body = content[start:end + 1][:drop]
+        with self._lock:
+            if self.limit is not None:
+                body = body[:self.limit]
+                self.limit -= len(body)
+        handler.wfile.write(body)
+        if len(body) < end - start + 1:
+            handler.close_connection = True  # The client gets less than expected
@@ -0,0 +1,61 @@
+import os
+import unittest
+
+from scipion.install.artifact_cache import ArtifactCache, DirectoryStore
+from scipion.install.funcs import Environment
+from scipion.tests.base import TestCase
+
+
+class TestArtifactCache(TestCase):
+    def test_artifact_cache(self):
+
+        tmp = self.getTmpFolder()
+        cache = ArtifactCache(DirectoryStore(os.path.join(tmp, 'cache')))
+        node1 = os.path.join(tmp, 'node1')
+        node2 = os.path.join(tmp, 'node2')
+        os.makedirs(os.path.join(node1, 'pkg-1.0', 'bin'))
+        os.makedirs(node2)
+        with open(os.path.join(node1, 'pkg-1.0', 'bin', 'prog'), 'w') as f:
+            f.write('binary')
+        os.symlink('bin/prog', os.path.join(node1, 'pkg-1.0', 'prog'))
+
+        key = cache.getKey('recipe')
+        self.assertNotEqual(key, cache.getKey('other recipe'))
+        self.assertFalse(cache.restore(key, node2))
+        cache.save(key, node1, ['pkg-1.0'])
+        self.assertTrue(cache.restore(key, node2))
+
+        self.assertEqual(os.listdir(node2), ['pkg-1.0'])
+        self.assertEqual(os.readlink(os.path.join(node2, 'pkg-1.0', 'prog')), 'bin/prog')
+        with open(os.path.join(node2, 'pkg-1.0', 'prog')) as f:
+            self.assertEqual(f.read(), 'binary')
+
+    def test_target_artifact(self):
+
+        tmp = self.getTmpFolder()
+        store = os.path.join(tmp, 'cache')
+
+        def install(cmd, relocatable=False):
+            env = Environment()
+            env._artifactCache = ArtifactCache(DirectoryStore(store))
+            t = env.addTarget('pkg', always=True)
+            t.addCommand(cmd, cwd=tmp)
+            t.setArtifact(tmp, ['pkg'], relocatable=relocatable)
+            env._executeTargets([t])
+            return t._getArtifactKey(env.getArtifactCache())
+
+        # A failing command does not leave a broken package in the cache
+        install('mkdir -p pkg && exit 3')
+        self.assertEqual(os.listdir(store), [])
+        key = install('mkdir -p pkg')
+        self.assertEqual(os.listdir(store), [key + '.tgz'])
+
+        # Only relocatable artifacts are shared with other software folders
+        cache = ArtifactCache(DirectoryStore(store))
+        self.assertNotEqual(cache.getKey('recipe', '/home/a/software'),
+                            cache.getKey('recipe', '/home/b/software'))
+        self.assertNotEqual(key, install('mkdir -p pkg', relocatable=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
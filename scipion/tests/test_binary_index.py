@@ -0,0 +1,32 @@
+import os
+import unittest
+from unittest import mock
+
+from scipion.install.binary_index import BinaryIndex
+from scipion.tests.base import TestCase
+
+
+class TestBinaryIndex(TestCase):
+    def test_binary_index(self):
+
+        entries = {'plugin1': {'version': '1.0', 'targets': [{'name': 'ctffind4-4.1.14', 'default': True}],
+                               'packages': [['ctffind4', '4.1.14']]},
+                   'plugin2': {'version': '2.0', 'targets': [], 'packages': []}}
+        tmp = self.getTmpFolder()
+        path = os.path.join(tmp, 'index.json')
+        with mock.patch.object(BinaryIndex, '_readPlugin',
+                               side_effect=lambda name, version: entries[name]) as readPlugin:
+            BinaryIndex(path).update({'plugin1': '1.0', 'plugin2': '2.0'})
+            self.assertEqual(readPlugin.call_count, 2)
+            # Only the plugins updated are read again
+            entries['plugin2']['version'] = '2.1'
+            index = BinaryIndex(path).update({'plugin1': '1.0', 'plugin2': '2.1'})
+            self.assertEqual(readPlugin.call_count, 3)
+        self.assertEqual(index.getBinToPluginDict(), {'ctffind4-4.1.14': 'plugin1',
+                                                      'ctffind4': 'plugin1'})
+        self.assertEqual(index.getPackages(), {'ctffind4': [('ctffind4', '4.1.14')]})
+        self.assertEqual(BinaryIndex(path).update({'plugin1': '1.0'}).getPlugins(), ['plugin1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
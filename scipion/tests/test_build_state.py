@@ -0,0 +1,76 @@
+import os
+import unittest
+from unittest import mock
+
+from scipion.install.build_state import BuildState, hashCommand
+from scipion.install.mirror import SCIPION_MIRROR
+from scipion.install.funcs import Environment
+from scipion.tests.base import TestCase
+
+
+class TestBuildState(TestCase):
+    def test_build_state(self):
+
+        tmp = self.getTmpFolder()
+        log = os.path.join(tmp, 'log.txt')
+
+        def install(*steps, fail=None, args=()):
+            env = Environment(args=list(args))
+            env._buildState = BuildState(os.path.join(tmp, 'state.sqlite'))
+            t = env.addTarget('pkg')
+            for step in steps:
+                if step == fail:  # does not produce its target
+                    t.addCommand('echo %s >> %s' % (step, log),
+                                 targets=os.path.join(tmp, 'missing'))
+                else:
+                    t.addCommand('echo %s >> %s' % (step, log))
+            t.addCommand('touch done', targets=os.path.join(tmp, 'done'),
+                         cwd=tmp, final=True)
+            try:
+                env._executeTargets([t])
+            finally:
+                env.getBuildState().close()
+            if not os.path.exists(log):
+                return []
+            with open(log) as f:
+                lines = f.read().split()
+            os.remove(log)
+            return lines
+
+        self.assertEqual(install('a', 'b', 'c'), ['a', 'b', 'c'])
+        # Nothing to do the second time
+        self.assertEqual(install('a', 'b', 'c'), [])
+        # Only the changed step and the following ones run again
+        self.assertEqual(install('a', 'B', 'c'), ['B', 'c'])
+        self.assertEqual(install('a', 'B', 'c', args=['--force']),
+                         ['a', 'B', 'c'])
+
+        # An interrupted build goes on from the failing command
+        os.remove(os.path.join(tmp, 'done'))
+        self.assertRaises(SystemExit, install, 'a', 'B', 'c', 'd', fail='c')
+        self.assertEqual(install('a', 'B', 'c', 'd'), ['c', 'd'])
+
+    def test_recipe_key(self):
+
+        def getKey(stream=False, cflags='-O3', **variables):
+            with mock.patch.dict(os.environ, variables):
+                env = Environment()
+                t = env._addDownloadUntar('pkg', url='https://host/pkg.tgz', sha256='0' * 64,
+                                          stream=stream)
+                t.addCommand('make', cwd=t.buildPath, environ={'CFLAGS': cflags})
+                return t.getRecipeKey()
+
+        # How the file is taken does not change what is built
+        key = getKey()
+        self.assertEqual(getKey(stream=True), key)
+        self.assertEqual(getKey(**{SCIPION_MIRROR: self.getTmpFolder()}), key)
+        # Neither the variables of the user that the command does not set
+        self.assertEqual(getKey(DISPLAY=':1', SSH_AUTH_SOCK='/tmp/agent'), key)
+        self.assertNotEqual(getKey(cflags='-O2'), key)
+
+        self.assertEqual(hashCommand('pkg', 'make', environ={}),
+                         hashCommand('pkg', 'make'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import shlex
+import sys
+import unittest
+from unittest import mock
+
+from scipion.install.conda_cache import (getEnvKey, getCacheCommand, getParser, main,
+                                         CondaEnvCache)
+from scipion.tests.base import TestCase
+
+# conda with the commands used by the cache, for environments that are folders of ENVS
+FAKE_CONDA = """#!%s
+import json, os, shutil, sys
+envs = os.environ['ENVS']
+args = [a for a in sys.argv[1:] if a not in ['-y', '--json', '--offline']]
+if args == ['env', 'list']:
+    print(json.dumps({'envs': [os.path.join(envs, e) for e in sorted(os.listdir(envs))]}))
+elif args == ['info']:
+    print(json.dumps({'envs_dirs': [envs]}))
+elif args[:2] == ['env', 'remove']:
+    shutil.rmtree(os.path.join(envs, args[3]))
+elif args[0] == 'create' and args[3] == '--clone':
+    shutil.copytree(args[4], os.path.join(envs, args[2]))
+else:
+    sys.exit('unexpected conda %%s' %% args)
+""" % sys.executable
+
+
+class TestCondaCache(TestCase):
+    def test_conda_env_key(self):
+
+        tmp = self.getTmpFolder()
+        requirements = os.path.join(tmp, 'requirements.txt')
+        with open(requirements, 'w') as f:
+            f.write('numpy\n')
+        key = getEnvKey('3.8', requirements, ['torch', 'scipy'])
+        self.assertEqual(key, getEnvKey('3.8', requirements, ['scipy', 'torch']))
+        self.assertNotEqual(key, getEnvKey('3.9', requirements, ['scipy', 'torch']))
+        with open(requirements, 'a') as f:
+            f.write('pandas\n')
+        self.assertNotEqual(key, getEnvKey('3.8', requirements, ['torch', 'scipy']))
+
+    def test_cache_command(self):
+
+        spec = {'python': '3.8', 'requirements': "/my data/it's requirements.txt",
+                'pip': ['numpy<2', 'torch==2.0 ; python_version>"3"'],
+                'conda': 'cudatoolkit=11.3 -c pytorch', 'channels': ['conda-forge']}
+        cmd = shlex.split(getCacheCommand('restore', 'my-env', **spec))
+        # The shell gives the values back unchanged, whatever they contain
+        self.assertEqual(cmd[:5], [sys.executable, '-m', 'scipion.install.conda_cache',
+                                   'restore', 'my-env'])
+        args = getParser().parse_args(cmd[3:])
+        self.assertEqual((args.python, args.requirements, args.pip, args.conda, args.channel),
+                         (spec['python'], spec['requirements'], spec['pip'], spec['conda'],
+                          spec['channels']))
+
+        # Values that look like options are still values
+        cmd = shlex.split(getCacheCommand('save', 'my-env', pip=['-e .', '--pre']))
+        self.assertEqual(getParser().parse_args(cmd[3:]).pip, ['-e .', '--pre'])
+
+    def test_cache_errors(self):
+
+        # Saving never breaks the install commands, restoring just fails
+        for mode, code in [('save', 0), ('restore', 1)]:
+            with self.assertRaises(SystemExit) as cm:
+                main([mode, 'my-env', '--pip', '-e'])
+            self.assertEqual(cm.exception.code, code)
+
+    def test_clean_clone(self):
+
+        tmp = self.getTmpFolder()
+        envs = os.path.join(tmp, 'envs')
+        os.makedirs(os.path.join(envs, 'a', 'conda-meta'))
+        conda = os.path.join(tmp, 'conda')
+        with open(conda, 'w') as f:
+            f.write(FAKE_CONDA)
+        os.chmod(conda, 0o755)
+        patcher = mock.patch.dict(os.environ, {'ENVS': envs})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        cache = CondaEnvCache(conda=conda)
+        key = getEnvKey('3.9', conda='numpy')
+        self.assertIsNone(cache.restore('a', key))
+        with open(os.path.join(envs, 'a', 'created'), 'w'):
+            pass
+        cache.save('a', key)
+        # Then the install commands go on with the environment
+        with open(os.path.join(envs, 'a', 'editable.pth'), 'w'):
+            pass
+
+        self.assertEqual(cache.restore('a', key), 'already there')
+        self.assertEqual(cache.restore('b', key), 'cloned from %s'
+                         % os.path.join(envs, cache.getCacheEnvName(key)))
+        self.assertEqual(sorted(os.listdir(os.path.join(envs, 'b'))), ['conda-meta', 'created'])
+        self.assertEqual(cache.getKey(os.path.join(envs, 'b')), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
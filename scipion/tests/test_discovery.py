@@ -0,0 +1,24 @@
+import unittest
+from unittest import mock
+
+from scipion.install import discovery
+from scipion.tests.base import TestCase
+
+
+class TestDiscovery(TestCase):
+    def test_plugin_discovery(self):
+
+        self.assertIn('pyworkflowtests', discovery.getPluginNames())
+        self.assertEqual(discovery.getPluginDistribution('pwem'), 'scipion-em')
+        from pwem import Domain
+        with mock.patch.object(Domain, 'getPluginModule', side_effect=lambda name: name) as getModule:
+            discovery.forgetPluginModule('pyworkflowtests')
+            self.assertEqual(discovery.getPluginModule('pyworkflowtests'), 'pyworkflowtests')
+            discovery.getPluginModule('pyworkflowtests')
+            # Only the plugin asked for is imported, once
+            self.assertEqual([c.args[0] for c in getModule.call_args_list], ['pyworkflowtests'])
+            discovery.forgetPluginModule('pyworkflowtests')
+
+
+if __name__ == '__main__':
+    unittest.main()
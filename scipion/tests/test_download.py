@@ -0,0 +1,209 @@
+import hashlib
+import io
+import os
+import tarfile
+import unittest
+from unittest import mock
+
+from scipion.install import download
+from scipion.install.download import Downloader, DownloadError
+from scipion.install.download_cache import DownloadCache
+from scipion.install.funcs import DownloadExtract, Environment, SCIPION_STREAM_DOWNLOADS
+from scipion.tests.base import TestCase, HttpServer
+
+# Big enough to be downloaded in several segments of several chunks
+CONTENT = os.urandom(64 * 1024)
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+class TestDownload(TestCase):
+    def setUp(self):
+        for name, value in [('MIN_SEGMENT_SIZE', 1024), ('CHUNK_SIZE', 1024)]:
+            patcher = mock.patch.object(download, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # No waiting between attempts, but they are recorded
+        patcher = mock.patch.object(download.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = os.path.join(self.getTmpFolder(), 'file.tgz')
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_segments(self):
+
+        with HttpServer({'/file.tgz': CONTENT}) as server:
+            sent = Downloader(segments=4).download(server.url + '/file.tgz', self.path, SHA256)
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertEqual(sent, len(CONTENT))
+        ranges = sorted(r[2] for r in server.requests if r[0] == 'GET')
+        self.assertEqual(ranges, ['bytes=0-16383', 'bytes=16384-32767',
+                                  'bytes=32768-49151', 'bytes=49152-65535'])
+        self.assertFalse(os.path.exists(self.path + '.part.json'))
+
+        # Without range requests, a single connection
+        with HttpServer({'/file.tgz': CONTENT}, ranges=False) as server:
+            Downloader(segments=4).download(server.url + '/file.tgz', self.path, SHA256)
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertEqual(len([r for r in server.requests if r[0] == 'GET']), 1)
+
+    def test_resume(self):
+
+        with HttpServer({'/file.tgz': CONTENT}) as server:
+            url = server.url + '/file.tgz'
+            # The connection is lost after 20 KB and the server goes down
+            server.limit = 20 * 1024
+            self.assertRaises(DownloadError, Downloader(segments=4, retries=0).download,
+                              url, self.path, SHA256)
+            self.assertFalse(os.path.exists(self.path))
+            self.assertTrue(os.path.exists(self.path + '.part.json'))
+
+            server.limit = None
+            del server.requests[:]
+            sent = Downloader(segments=4).download(url, self.path, SHA256)
+        # Only what was missing is asked for again
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertEqual(sent, len(CONTENT) - 20 * 1024)
+        self.assertEqual(server.getSent('/file.tgz'), len(CONTENT) - 20 * 1024)
+        self.assertFalse(os.path.exists(self.path + '.part.json'))
+
+    def test_resume_single(self):
+
+        with HttpServer({'/file.tgz': CONTENT}) as server:
+            url = server.url + '/file.tgz'
+            server.limit = 20 * 1024
+            self.assertRaises(DownloadError, Downloader(segments=1, retries=0).download, url,
+                              self.path)
+            self.assertEqual(os.path.getsize(self.path + '.part'), 20 * 1024)
+
+            # Without a sha256 to check it: only the size tells it is complete
+            server.limit = None
+            sent = Downloader(segments=1).download(url, self.path)
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertEqual(sent, len(CONTENT) - 20 * 1024)
+
+    def test_resume_ignored(self):
+
+        with HttpServer({'/file.tgz': CONTENT}) as server:
+            url = server.url + '/file.tgz'
+            server.limit = 20 * 1024
+            self.assertRaises(DownloadError, Downloader(segments=4, retries=0).download, url,
+                              self.path)
+            # Ranges announced but not honoured: the segments are not continued
+            server.limit = None
+            server.ignoreRanges = True
+            Downloader(segments=4).download(url, self.path, SHA256)
+        self.assertEqual(self._read(self.path), CONTENT)
+        self.assertFalse(os.path.exists(self.path + '.part.json'))
+
+    def test_retries(self):
+
+        with HttpServer({'/file.tgz': CONTENT}) as server:
+            url = server.url + '/file.tgz'
+            server.errors = [503, 500]
+            Downloader(segments=1).download(url, self.path, SHA256)
+            self.assertEqual(self._read(self.path), CONTENT)
+            # Exponential backoff between attempts
+            self.assertEqual([c.args[0] for c in self.sleep.call_args_list], [2, 4])
+
+            # Not found is not tried again
+            self.sleep.reset_mock()
+            self.assertRaises(download.requests.HTTPError, Downloader().download,
+                              server.url + '/missing.tgz', self.path)
+            self.sleep.assert_not_called()
+
+            server.errors = [503] * 3
+            self.assertRaises(DownloadError, Downloader(segments=1, retries=2).download,
+                              url, self.path + '.2')
+
+    def test_checksum(self):
+
+        with HttpServer({'/file.tgz': CONTENT}) as server:
+            self.assertRaises(DownloadError, Downloader(segments=4).download,
+                              server.url + '/file.tgz', self.path, '0' * 64)
+        # Nothing is left to be resumed
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), [])
+
+
+class TestExtract(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(download.time, 'sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tgz = io.BytesIO()
+        with tarfile.open(fileobj=tgz, mode='w:gz') as tar:
+            info = tarfile.TarInfo('pkg-1.0/data')
+            info.size = len(CONTENT)
+            tar.addfile(info, io.BytesIO(CONTENT))
+        self.tgz = tgz.getvalue()
+        self.sha256 = hashlib.sha256(self.tgz).hexdigest()
+        self.tmp = self.getTmpFolder()
+
+    def _checkExtracted(self, folder):
+        self.assertEqual(os.listdir(folder), ['pkg-1.0'])
+        with open(os.path.join(folder, 'pkg-1.0', 'data'), 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_extract(self):
+
+        dest = os.path.join(self.tmp, 'em')
+        os.mkdir(dest)
+        tee = io.BytesIO()
+        # The tgz is hashed and written as sent, even declared as gzip encoded
+        with HttpServer({'/pkg.tgz': self.tgz}, encoded=['/pkg.tgz']) as server:
+            server.drops = [len(self.tgz) // 2]
+            Downloader().extract(server.url + '/pkg.tgz', dest, self.sha256, tee)
+        self._checkExtracted(dest)
+        self.assertEqual(tee.getvalue(), self.tgz)
+        # The connection lost is continued where it was
+        self.assertEqual([r[2] for r in server.requests if r[0] == 'GET'],
+                         [None, 'bytes=%d-' % (len(self.tgz) // 2)])
+
+        # Extracted into the folders already there, as tar does
+        with open(os.path.join(dest, 'pkg-1.0', 'data'), 'wb') as f:
+            f.write(b'old')
+        with open(os.path.join(dest, 'pkg-1.0', 'kept'), 'w'):
+            pass
+        with HttpServer({'/pkg.tgz': self.tgz}) as server:
+            Downloader().extract(server.url + '/pkg.tgz', dest, self.sha256)
+        self.assertEqual(sorted(os.listdir(os.path.join(dest, 'pkg-1.0'))), ['data', 'kept'])
+        self._checkExtracted(dest)
+
+        path = os.path.join(self.tmp, 'pkg.tgz')
+        with open(path, 'wb') as f:
+            f.write(self.tgz)
+        other = os.path.join(self.tmp, 'other')
+        os.mkdir(other)
+        self.assertRaises(DownloadError, Downloader().extractFile, path, other, '0' * 64)
+        self.assertEqual(os.listdir(other), [])
+        Downloader().extractFile(path, other, self.sha256)
+        self._checkExtracted(other)
+
+    def test_download_extract(self):
+
+        for value, stream in [('0', False), ('false', False), ('', False), ('1', True),
+                              ('Yes', True)]:
+            with mock.patch.dict(os.environ, {SCIPION_STREAM_DOWNLOADS: value}):
+                self.assertEqual(Environment()._streamDownloads, stream)
+
+        env = Environment()
+        env._downloadCache = DownloadCache(os.path.join(self.tmp, 'cache'))
+        with HttpServer({'/pkg.tgz': self.tgz}) as server:
+            for name in ['home1', 'home2']:
+                dest = os.path.join(self.tmp, name)
+                DownloadExtract(env, server.url + '/pkg.tgz', os.path.join(dest, 'pkg.tgz'),
+                                dest, self.sha256)()
+                self._checkExtracted(dest)
+        # The second one is taken from the cache the first one wrote
+        self.assertEqual(len([r for r in server.requests if r[0] == 'GET']), 1)
+        self.assertEqual(env.getDownloadCache().lookup(server.url + '/pkg.tgz', self.sha256,
+                                                       os.path.join(self.tmp, 'cached.tgz')),
+                         os.path.join(self.tmp, 'cached.tgz'))
+        with open(os.path.join(self.tmp, 'cached.tgz'), 'rb') as f:
+            self.assertEqual(f.read(), self.tgz)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import unittest
+
+from scipion.install.download_cache import DownloadCache
+from scipion.tests.base import TestCase
+
+
+class TestDownloadCache(TestCase):
+    def test_download_cache(self):
+
+        downloads = []
+
+        def download(url, path):
+            downloads.append(url)
+            with open(path, 'w') as f:
+                f.write(url * 100)
+
+        tmp = self.getTmpFolder()
+        cache = DownloadCache(os.path.join(tmp, 'cache'), maxSize=2000)
+        home1 = os.path.join(tmp, 'a.tgz')
+        home2 = os.path.join(tmp, 'b.tgz')
+
+        self.assertFalse(cache.fetch('http://x/a.tgz', home1, download))
+        self.assertTrue(cache.fetch('http://x/a.tgz', home2, download))
+        self.assertEqual(downloads, ['http://x/a.tgz'])
+        with open(home2) as f:
+            self.assertEqual(f.read(), 'http://x/a.tgz' * 100)
+
+        # Least recently used entries go away when the cache is full
+        cache.fetch('http://x/b.tgz', home2, download)
+        self.assertIsNone(cache.lookup('http://x/a.tgz'))
+        self.assertIsNotNone(cache.lookup('http://x/b.tgz'))
+
+        # A file looked up into a path of its own outlives its eviction
+        home3 = os.path.join(tmp, 'c.tgz')
+        self.assertEqual(cache.lookup('http://x/b.tgz', dest=home3), home3)
+        cache.fetch('http://x/c.tgz', home2, download)
+        self.assertIsNone(cache.lookup('http://x/b.tgz'))
+        with open(home3) as f:
+            self.assertEqual(f.read(), 'http://x/b.tgz' * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
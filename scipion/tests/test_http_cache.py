@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from scipion.install.http_cache import HttpCache
+from scipion.tests.base import TestCase, FakeSession
+
+
+class TestHttpCache(TestCase):
+    def test_http_cache(self):
+
+        tmp = self.getTmpFolder()
+        url = 'https://example.org/plugins.json'
+        session = FakeSession({url: b'{"plugins": 1}'})
+        self.assertEqual(HttpCache(tmp, session, ttl=60).get(url), b'{"plugins": 1}')
+        # Fresh: no request. Refresh: revalidated with the ETag
+        self.assertEqual(HttpCache(tmp, session, ttl=60).get(url), b'{"plugins": 1}')
+        self.assertEqual(len(session.requests), 1)
+        self.assertEqual(HttpCache(tmp, session, refresh=True).get(url), b'{"plugins": 1}')
+        self.assertEqual(session.requests[-1], (url, {'If-None-Match': session.getETag(url)}))
+        # Stale data is better than nothing without connection
+        session.online = False
+        self.assertEqual(HttpCache(tmp, session, ttl=0).get(url), b'{"plugins": 1}')
+        self.assertRaises(requests.ConnectionError, HttpCache(tmp, session).get,
+                          'https://example.org/other.json')
+        # Values derived from the content are computed once
+        derive = mock.Mock(return_value={'n': 1}, __name__='count')
+        for _ in range(2):
+            self.assertEqual(HttpCache(tmp, session).get(url, derive=derive), {'n': 1})
+        self.assertEqual(derive.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
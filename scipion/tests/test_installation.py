@@ -0,0 +1,138 @@
+import contextlib
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+from scipion.install.build_state import BuildState
+from scipion.install.funcs import CommandDef, CondaCommandDef, Environment, Link
+from scipion.install.wheelhouse import SCIPION_WHEELHOUSE
+from scipion.tests.base import TestCase
+
+
+class TestCommands(TestCase):
+    def test_command_class(self):
+
+        myCmd = CommandDef("ls -l", "lolo")\
+            .append("cd ..", ["one", "two"])\
+            .append("cd .", sep="?")
+
+        self.assertEqual(myCmd.getCommands()[0][0], "ls -l && cd .. ? cd .")
+        self.assertEqual(myCmd.getCommands()[0][1], ["lolo", "one", "two"])
+
+        cmds = CondaCommandDef("modelangelo-3.0")
+        cmds.create('python=3.9').activate().cd('model-angelo')\
+            .pipInstall('-r requirements.txt')\
+            .condaInstall('-y torchvision torchaudio cudatoolkit=11.3 -c pytorch')\
+            .pipInstall('-e .').touch('../env-installed.txt')
+
+        print(cmds.getCommands())
+
+    def test_parallel_targets(self):
+
+        env = Environment(args=['--parallel', '3'])
+        executed = []
+
+        def addTarget(name, *deps):
+            t = env.addTarget(name, always=True)
+            t.addCommand(lambda: executed.append(name))
+            env._addTargetDeps(t, deps)
+            return t
+
+        addTarget('a')
+        addTarget('b', 'a')
+        addTarget('c', 'a')
+        d = addTarget('d', 'b', 'c')
+
+        env._executeTargets([d])
+        self.assertEqual(sorted(executed), ['a', 'b', 'c', 'd'])
+        self.assertEqual(executed[0], 'a')
+        self.assertEqual(executed[-1], 'd')
+
+        # Cycles are detected before executing anything
+        env.getTarget('a').addDep('d')
+        del executed[:]
+        self.assertRaises(RuntimeError, env._executeTargets, [d])
+        self.assertEqual(executed, [])
+
+    def test_build_report(self):
+
+        tmp = self.getTmpFolder()
+        reportFile = os.path.join(tmp, 'report.jsonl')
+        env = Environment(args=['--build-report', reportFile])
+        a = env.addTarget('a', always=True)
+        a.addCommand('python -c "bytearray(50 * 1024 * 1024)"')
+        b = env.addTarget('b', always=True)
+        b.addCommand('exit 3')
+        env._addTargetDeps(b, ['a'])
+        env._executeTargets([b])
+
+        with open(reportFile) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r['type'] for r in records],
+                         ['graph', 'command', 'target', 'command', 'target'])
+        self.assertEqual(records[0]['targets'], {'a': [], 'b': ['a']})
+        self.assertEqual(records[1]['status'], 0)
+        self.assertGreater(records[1]['maxRssKb'], 50 * 1024)
+        self.assertEqual(records[3]['status'], 3)
+        self.assertEqual(records[4]['deps'], ['a'])
+
+    def test_target_times(self):
+
+        env = Environment()
+        durations = {'a': 10, 'b': 30, 'c': 5, 'd': 1, 'e': 20}
+        for name, deps in [('a', []), ('b', ['a']), ('c', ['a']),
+                           ('d', ['b', 'c']), ('e', [])]:
+            env._addTargetDeps(env.addTarget(name), deps)
+        targets = env._sortTargets([env.getTarget('d'), env.getTarget('e')])
+
+        self.assertEqual(env._getCriticalPath(targets, durations), ['a', 'b', 'd'])
+        self.assertEqual(env._getMakespan(targets, durations, 1), 66)
+        self.assertEqual(env._getMakespan(targets, durations, 2), 41)
+        self.assertEqual(env._getBlockedTimes(targets, durations)['a'], 36)
+
+        # At least one worker, whatever is asked
+        self.assertEqual(Environment(args=['--parallel', '0']).getParallel(), 1)
+        with mock.patch.dict(os.environ, {'SCIPION_INSTALL_PARALLEL': '0'}):
+            env = Environment()
+        self.assertEqual(env.getParallel(), 1)
+        env._buildState = BuildState(os.path.join(self.getTmpFolder(), 'state.sqlite'))
+        env._addTargetDeps(env.addTarget('a'), [])
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            env._showTargetTimes([env.getTarget('a')])
+        env.getBuildState().close()
+        self.assertIn('Speedup', output.getvalue())
+
+    def test_link_output(self):
+
+        tmp = self.getTmpFolder()
+        os.mkdir(os.path.join(tmp, 'pkg-1.0'))
+        env = Environment()
+        # As when the target is executed with --parallel
+        env._threadData.output = io.StringIO()
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            Link(os.path.join(tmp, 'pkg'), os.path.join(tmp, 'pkg-1.0'), env)()
+        self.assertTrue(os.path.islink(os.path.join(tmp, 'pkg')))
+        self.assertIn('Created link', env.getOutput().getvalue())
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_wheelhouse(self):
+
+        env = Environment()
+        t = env.addPipModule('numpy', '1.24.1', default=False)
+        env.addPipModule('tifffile', default=False)
+        self.assertEqual(env.getPipModules(), ['numpy==1.24.1', 'tifffile'])
+        self.assertNotIn('--no-index', t.getCommands()[0]._cmd)
+
+        # The folder is quoted for the shell
+        with mock.patch.dict(os.environ, {SCIPION_WHEELHOUSE: "/shared/Bob's wheels"}):
+            t = Environment().addPipModule('numpy', '1.24.1', default=False)
+        self.assertEqual(t.getCommands()[0]._cmd,
+                         "pip install --no-index --find-links '/shared/Bob'\"'\"'s wheels' "
+                         "numpy==1.24.1")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import shutil
+import subprocess
+import unittest
+from unittest import mock
+
+from scipion.install.jobserver import JobServer, sharedJobServer
+from scipion.tests.base import TestCase
+
+
+class TestJobServer(TestCase):
+    def test_jobserver(self):
+
+        jobServer = JobServer(3)
+        tokens = [jobServer.acquire() for _ in range(3)]
+        self.assertEqual(tokens, [None, b'+', b'+'])
+        for token in tokens:
+            jobServer.release(token)
+
+        if shutil.which('make') is None:
+            return
+        # make runs its jobs with the tokens of the jobserver
+        tmp = self.getTmpFolder()
+        with open(os.path.join(tmp, 'Makefile'), 'w') as f:
+            f.write('all:\n\t@echo "$(MAKEFLAGS)"\n')
+        with jobServer.job():
+            output = subprocess.check_output(['make', '-s', '-C', tmp],
+                                             env=jobServer.getEnviron(),
+                                             pass_fds=jobServer.getFds(),
+                                             stderr=subprocess.STDOUT)
+        self.assertIn(b'jobserver', output)
+        self.assertNotIn(b'warning', output)
+
+    def test_shared(self):
+
+        with mock.patch.dict(os.environ, {'MAKEFLAGS': ''}):
+            with sharedJobServer(2) as jobServer:
+                # The installations running at the same time share one
+                with sharedJobServer(4) as other:
+                    self.assertIs(other, jobServer)
+                self.assertEqual(jobServer.getJobs(), 2)
+                os.fstat(jobServer.getFds()[0])
+            # and its pipe is closed when the last one ends
+            for fd in jobServer.getFds():
+                self.assertRaises(OSError, os.fstat, fd)
+
+            # The one of the parent process is joined, and not closed
+            parent = JobServer(3)
+            os.environ['MAKEFLAGS'] = parent.getMakeflags()
+            with sharedJobServer(2) as jobServer:
+                self.assertEqual(jobServer.getFds(), parent.getFds())
+                self.assertEqual(jobServer.getJobs(), 3)
+            os.fstat(parent.getFds()[0])
+            parent.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
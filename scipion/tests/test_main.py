@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from scipion.tests.base import TestCase
+
+
+class TestMain(TestCase):
+    def test_python_mode(self):
+
+        home = self.getTmpFolder()
+        os.mkdir(os.path.join(home, 'config'))
+        env = self.getSubprocessEnviron(SCIPION_HOME=home, HOME=home,
+                                        SCIPION_CACHE=os.path.join(home, 'cache'),
+                                        SCIPION_LOCAL_CONFIG=os.path.join(home, 'scipion.conf'))
+        env.pop('SCIPION_SERVER', None)
+        args = ['a b', "it's", '"quoted"', '$HOME', '*', '']
+        code = 'import sys; print(repr(sys.argv[1:])); sys.exit(3)'
+        # Once reading the config and once with the variables cached
+        for _ in range(2):
+            result = subprocess.run([sys.executable, '-m', 'scipion', 'python', '-c', code] + args,
+                                    env=env, cwd=home, capture_output=True, text=True)
+            # The arguments get to python as they are, without a shell in between
+            self.assertEqual(result.returncode, 3, result.stderr)
+            self.assertEqual(result.stdout.splitlines()[-1], repr(args))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+from scipion.install.binary_index import BinaryIndex
+from scipion.install.build_state import BuildState
+from scipion.install.funcs import Environment
+from scipion.install import manifest
+from scipion.tests.base import TestCase
+
+
+class TestManifest(TestCase):
+    def test_manifest_plan(self):
+
+        from importlib import metadata
+        pwVersion = metadata.version('scipion-pyworkflow')
+        entries = {'pyworkflow': {'version': '1.0', 'targets': [{'name': 'fakebin-1.0', 'default': True}],
+                                  'packages': [['fakebin', '1.0'], ['fakebin', '2.0']]}}
+        tmp = self.getTmpFolder()
+        path = os.path.join(tmp, 'manifest.json')
+        with open(path, 'w') as f:
+            json.dump({'noBin': True,
+                       'plugins': {'scipion-pyworkflow': {'version': pwVersion + '.0',
+                                                          'noBin': False},
+                                   'scipion-em-new': '1.0',
+                                   'scipion-em-notinstalled': 'absent',
+                                   'requests': 'absent'}}, f)
+        spec = manifest.loadManifest(path)
+        self.assertEqual(spec['scipion-em-new'], {'version': '1.0', 'noBin': True,
+                                                  'binaries': None, 'absent': False})
+        with mock.patch.object(BinaryIndex, '_readPlugin',
+                               side_effect=lambda name, version: entries[name]):
+            index = BinaryIndex(os.path.join(tmp, 'index.json')).update({'pyworkflow': '1.0'})
+        # Nothing is asked to PyPI when all the versions are given
+        plan = manifest.getPlan(spec, pluginRepo=mock.Mock(side_effect=AssertionError),
+                                binaryIndex=index)
+        # The installed version is the same, only written differently
+        self.assertEqual(plan.pip, [('scipion-em-new', '1.0', None)])
+        self.assertEqual(plan.uninstall, [('requests', metadata.version('requests'))])
+        self.assertEqual(plan.binaries, [('scipion-pyworkflow', ['fakebin-1.0'])])
+        self.assertEqual(manifest.getMissingBinaries(index, 'pyworkflow', ['fakebin-2.0']),
+                         ['fakebin-2.0'])
+
+    def test_manifest_versions(self):
+
+        tmp = self.getTmpFolder()
+        path = os.path.join(tmp, 'manifest.yml')
+        with open(path, 'w') as f:
+            f.write("plugins:\n  scipion-em-a:\n    version: 3.10\n")
+        with self.assertRaisesRegex(ValueError, "quoted"):
+            manifest.loadManifest(path)
+        with open(path, 'w') as f:
+            f.write("plugins:\n  scipion-em-a:\n    version: '3.10'\n  scipion-em-b: 4.0.1\n")
+        spec = manifest.loadManifest(path)
+        self.assertEqual([spec[p]['version'] for p in sorted(spec)], ['3.10', '4.0.1'])
+
+        with mock.patch.dict(sys.modules, {'yaml': None}):
+            with self.assertRaisesRegex(ValueError, "PyYAML"):
+                manifest.loadManifest(path)
+
+    def test_apply_plan(self):
+
+        tmp = self.getTmpFolder()
+        builds = []
+        lock = threading.Lock()
+
+        class FakePlugin:
+            def __init__(self, pipName, *args, **kwargs):
+                self.pipName = pipName
+
+            def getPluginClass(self):
+                return mock.Mock()
+
+            def installBin(self, args):
+                if self.pipName == 'scipion-em-broken':
+                    sys.exit(1)
+                env = Environment(args=args['args'])
+                env._buildState = BuildState(os.path.join(tmp, self.pipName + '.sqlite'))
+                # Both plugins need the same library
+                for name in ['shared', self.pipName]:
+                    t = env.addTarget(name)
+                    t.addCommand(lambda name=name: builds.append(name) or time.sleep(0.2))
+                    t.addCommand(lambda: jobServers.append(env.getJobServer()))
+                    t.addCommand('touch %s' % name, targets=os.path.join(tmp, name),
+                                 cwd=tmp, final=True)
+                env._addTargetDeps(env.getTarget(self.pipName), ['shared'])
+                try:
+                    env._executeTargets([env.getTarget(self.pipName)])
+                finally:
+                    env.getBuildState().close()
+                with lock:
+                    plugins.append(self)
+
+        plugins = []
+        jobServers = []
+        plan = manifest.Plan()
+        plan.binaries = [('scipion-em-a', None), ('scipion-em-b', None)]
+        with mock.patch.object(manifest, 'PluginInfo', FakePlugin), \
+                mock.patch.dict(os.environ, {'MAKEFLAGS': 'k'}):
+            self.assertTrue(manifest.applyPlan(plan, ['-j', '2'], parallel=2))
+            # The -j budget, with its free job, was shared by a single jobserver
+            self.assertEqual(len(set(map(id, jobServers))), 1)
+            self.assertEqual(jobServers[0].getJobs(), 2)
+            self.assertEqual(os.environ['MAKEFLAGS'], 'k')
+
+            plan.binaries.append(('scipion-em-broken', None))
+            self.assertFalse(manifest.applyPlan(plan, ['-j', '2'], parallel=2))
+        # The library of both is built once, and not at the same time
+        self.assertEqual(sorted(builds), ['scipion-em-a', 'scipion-em-b', 'shared'])
+
+
+if __name__ == '__main__':
+    unittest.main()
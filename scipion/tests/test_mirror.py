@@ -0,0 +1,57 @@
+import json
+import os
+import shlex
+import unittest
+from unittest import mock
+
+from scipion.install.funcs import Environment, InstallHelper
+from scipion.install import mirror
+from scipion.install import plugin_funcs
+from scipion.tests.base import TestCase
+
+
+class TestMirror(TestCase):
+    def test_mirror(self):
+
+        core = plugin_funcs.CORE_VERSION
+        pipData = {'info': {'summary': 'A plugin'},
+                   'releases': {'1.0': [{'comment_text': 'scipion-%s' % core, 'upload_time': 't1'}]}}
+        tmp = self.getTmpFolder()
+        mirror.writeFile(mirror.getPluginsFile(tmp), json.dumps(
+            {'scipion-em-mirrored': {'pipName': 'scipion-em-mirrored', 'name': 'mirrored'}}).encode())
+        mirror.writeFile(mirror.getPypiFile(tmp, 'scipion-em-mirrored'),
+                         json.dumps(pipData).encode())
+        with mock.patch.dict(os.environ, {mirror.SCIPION_MIRROR: tmp}), \
+                mock.patch.object(plugin_funcs, 'getSession', side_effect=AssertionError):
+            plugins = plugin_funcs.PluginRepository('https://example.org').getPlugins()
+            self.assertEqual(plugins['scipion-em-mirrored'].latestRelease, '1.0')
+
+            env = Environment()
+            t = env.addPackage('pkg', version='1.0', tar='pkg-1.0.tgz', url='https://example.org/pkg-1.0.tgz')
+            url, tar, sha256 = env.getDownloads()[0]
+            self.assertEqual((url, tar), ('https://example.org/pkg-1.0.tgz', 'pkg-1.0.tgz'))
+            self.assertIn(mirror.getBinaryFile(tmp, url, tar), t.getCommands()[0]._cmd)
+            self.assertIn('--find-links %s' % shlex.quote(mirror.getWheelsFolder(tmp)),
+                          env.addPipModule('numpy', '1.24.1').getCommands()[0]._cmd)
+
+    def test_mirror_extra_files(self):
+
+        tmp = self.getTmpFolder()
+        url = 'https://example.org/model.pt'
+        with mock.patch.dict(os.environ, {mirror.SCIPION_MIRROR: tmp}):
+            env = Environment()
+            installer = InstallHelper('pkg', packageHome=os.path.join(tmp, 'pkg-1.0'),
+                                      packageVersion='1.0')
+            installer.getExtraFile(url, location='models').addPackage(env)
+            self.assertIn((url, 'model.pt', None), env.getDownloads())
+            commands = ' '.join(str(c._cmd) for c in env.getTarget('pkg-1.0').getCommands())
+            self.assertIn('cp %s models/model.pt' % mirror.getBinaryFile(tmp, url, 'model.pt'),
+                          commands)
+            self.assertNotIn('scipion.install.download', commands)
+
+            # Without plugins.json the plugin list is not available
+            self.assertIsNone(plugin_funcs.PluginRepository('https://example.org').getPluginsJson())
+
+
+if __name__ == '__main__':
+    unittest.main()
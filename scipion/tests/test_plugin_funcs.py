@@ -0,0 +1,121 @@
+import json
+import os
+import time
+import unittest
+from unittest import mock
+
+from scipion.install import plugin_funcs
+from scipion.install.http_cache import HttpCache
+from scipion.install.mirror import SCIPION_MIRROR
+from scipion.tests.base import TestCase, FakeSession
+
+
+class TestPluginFuncs(TestCase):
+    def test_batch_pip_install(self):
+
+        class FakePlugin:
+            def __init__(self, pipName):
+                self.pipName = pipName
+
+            def getPipInstallArgs(self, version):
+                return '%s==%s' % (self.pipName, version or '1.0'), self.pipName
+
+            def isInstalled(self):
+                return False
+
+        a, b, c = FakePlugin('a'), FakePlugin('b'), FakePlugin('c')
+        calls = []
+
+        def runPip(installSrc):
+            calls.append(installSrc)
+            return 1 if 'b==' in installSrc else 0
+
+        with mock.patch.object(plugin_funcs, '_runPip', runPip):
+            installed = plugin_funcs.installPipModules([(a, ''), (b, ''), (c, '2.0')])
+        # One pip install for all, then one per plugin to find the failing one
+        self.assertEqual(calls, ['a==1.0 b==1.0 c==2.0', 'a==1.0', 'b==1.0', 'c==2.0'])
+        self.assertEqual(installed, [a, c])
+
+    def test_lazy_plugin_info(self):
+
+        pipData = {'info': {'home_page': 'https://example.org', 'summary': 'A plugin',
+                            'author': 'me', 'author_email': 'me@example.org'},
+                   'releases': {'1.0': [{'comment_text': 'scipion-%s' % plugin_funcs.CORE_VERSION}]}}
+        with mock.patch.object(plugin_funcs.PluginInfo, 'getPipMatrix',
+                               return_value=plugin_funcs.getCompatibilityMatrix(pipData)) \
+                as getPipMatrix, \
+                mock.patch.object(plugin_funcs.PluginInfo, 'getBinVersions') as getBinVersions:
+            plugin = plugin_funcs.PluginInfo('scipion-em-notinstalled')
+            self.assertEqual(getPipMatrix.call_count, 0)
+            self.assertEqual(plugin.latestRelease, '1.0')
+            self.assertEqual(plugin.summary, 'A plugin')
+            self.assertEqual(getPipMatrix.call_count, 1)
+            self.assertEqual(plugin.pipVersion, '')
+            self.assertEqual(plugin.binVersions, [])
+            getBinVersions.assert_not_called()
+
+    def test_distribution_index(self):
+
+        from importlib import metadata
+        index = plugin_funcs.DistributionIndex()
+        dist = index.get('Scipion_PyWorkflow')
+        self.assertEqual(dist['Version'], metadata.version('scipion-pyworkflow'))
+        self.assertIn('pyworkflow', dist['top_level'].split())
+        self.assertIsNone(index.get('scipion-em-notinstalled'))
+        index.invalidate()
+        self.assertIsNotNone(index.get('requests'))
+
+    def test_compatibility_matrix(self):
+
+        core = plugin_funcs.CORE_VERSION
+        pipData = {'info': {'summary': 'A plugin'},
+                   'releases': {'1.0': [{'comment_text': 'scipion-%s' % core, 'upload_time': 't1'}],
+                                '1.10': [{'comment_text': 'scipion-2.0, scipion-%s' % core,
+                                          'upload_time': 't2'}],
+                                '2.0': [{'comment_text': 'scipion-1.0', 'upload_time': 't3'}],
+                                '0.1': [{'comment_text': '', 'upload_time': 't0'}],
+                                '0.0': []}}
+        matrix = plugin_funcs.getCompatibilityMatrix(pipData)
+        self.assertEqual(matrix['info']['summary'], 'A plugin')
+        self.assertEqual(sorted(matrix['matrix']), ['0.1', '1.0', '1.10', '2.0'])
+        self.assertEqual(matrix['matrix']['2.0'], ['t3', ['1.0']])
+
+        plugin = plugin_funcs.PluginInfo('scipion-em-notinstalled', pipJsonData=matrix)
+        self.assertEqual(plugin.latestRelease, '1.10')
+        self.assertEqual(sorted(plugin.compatibleReleases), ['1.0', '1.10', '2.0', 'latest'])
+        self.assertEqual(plugin.getReleaseDate('1.10'), 't2')
+
+    def test_concurrent_pip_data(self):
+
+        pipNames = ['scipion-em-plugin%d' % i for i in range(20)]
+        pipData = {'info': {'summary': 'A plugin'},
+                   'releases': {'1.0': [{'comment_text': '', 'upload_time': 't1'}]}}
+        session = FakeSession({plugin_funcs.getPipJsonUrl(name): json.dumps(pipData).encode()
+                               for name in pipNames})
+        caches = []
+
+        class SlowHttpCache(HttpCache):
+            def __init__(self, *args, **kwargs):
+                time.sleep(0.05)  # All the threads ask for the cache meanwhile
+                caches.append(self)
+                HttpCache.__init__(self, *args, **kwargs)
+
+        environ = {'SCIPION_CACHE': self.getTmpFolder()}
+        with mock.patch.dict(os.environ, environ), \
+                mock.patch.object(plugin_funcs, '_session', session), \
+                mock.patch.object(plugin_funcs, '_metadataCache', None), \
+                mock.patch.object(plugin_funcs, 'HttpCache', SlowHttpCache):
+            os.environ.pop(SCIPION_MIRROR, None)
+            data = plugin_funcs.fetchPipMatrices(pipNames)
+            # The json of pypi as it is, from the cache
+            plugin = plugin_funcs.PluginInfo(pipNames[0])
+            self.assertEqual(plugin.getPipJsonData(), pipData)
+            self.assertEqual(plugin.getPipMatrix(), data[pipNames[0]])
+        self.assertEqual(len(caches), 1)
+        self.assertEqual(sorted(url for url, _ in session.requests),
+                         sorted(plugin_funcs.getPipJsonUrl(name) for name in pipNames))
+        self.assertEqual(data[pipNames[0]]['matrix'], {'1.0': ['t1', []]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+from unittest import mock
+
+from scipion.install import plugin_manager
+from scipion.install.plugin_manager import Operation, OperationList
+from scipion.tests.base import TestCase
+
+
+class TestPluginManager(TestCase):
+    def test_failed_pip_install(self):
+
+        plugin = mock.Mock()
+        with mock.patch.object(plugin_manager, 'pluginDict', {'scipion-em-a': plugin}):
+            # The binaries of a plugin whose pip install failed are not installed
+            self.assertRaises(RuntimeError, Operation('scipion-em-a').runOperation, 2,
+                              pipInstalled=set())
+            plugin.installBin.assert_not_called()
+            Operation('scipion-em-a').runOperation(2, pipInstalled={'scipion-em-a'})
+            plugin.installBin.assert_called_once_with({'args': ['-j', 2]})
+            plugin.installPipModule.assert_not_called()
+
+    def test_batch_pip_names(self):
+
+        plugin, failed = mock.Mock(pipName='scipion-em-a'), mock.Mock()
+        plugins = {'a': plugin, 'b': failed}
+        operations = [Operation('a'), Operation('b'),
+                      Operation('c', objStatus=plugin_manager.PluginStates.UNINSTALL)]
+        with mock.patch.object(plugin_manager, 'pluginDict', plugins), \
+                mock.patch.object(plugin_manager, 'installPipModules',
+                                  return_value=[plugin]) as installPipModules:
+            # The names of the operations are returned, not the pip names
+            pipInstalled = OperationList().installPipModules(operations)
+            self.assertEqual(pipInstalled, {'a'})
+            installPipModules.assert_called_once_with([(plugin, ""), (failed, "")])
+            operations[0].runOperation(2, handleBins=False, pipInstalled=pipInstalled)
+            self.assertRaises(RuntimeError, operations[1].runOperation, 2,
+                              pipInstalled=pipInstalled)
+
+
+if __name__ == '__main__':
+    unittest.main()
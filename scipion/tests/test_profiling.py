@@ -0,0 +1,38 @@
+import os
+import time
+import unittest
+from unittest import mock
+
+from scipion import profiling
+from scipion.tests.base import TestCase
+
+
+class TestProfiling(TestCase):
+    def test_profiling(self):
+
+        tmp = self.getTmpFolder()
+        with mock.patch.dict(os.environ, {profiling.SCIPION_PROFILE: 'sample',
+                                          profiling.SCIPION_PROFILE_DIR: tmp,
+                                          profiling.SCIPION_PROFILE_INTERVAL: '0.001'}):
+            self.assertTrue(profiling.start('test'))
+            self.assertFalse(profiling.start('test'))
+            deadline = time.time() + 0.2
+            while time.time() < deadline:
+                pass
+            path = profiling.stop()
+        self.assertTrue(os.path.basename(path).startswith('test-'))
+        self.assertIn('-%d-' % os.getpid(), os.path.basename(path))
+        self.assertTrue(path.endswith('.folded'))
+        counts = profiling.mergeSamples([path, path])
+        self.assertTrue(any('test_profiling' in stack for stack in counts))
+        self.assertEqual(sum(counts.values()) % 2, 0)
+
+        merged = {'MainThread;main (a.py:1);work (a.py:5)': 3, 'MainThread;main (a.py:1)': 1}
+        report = profiling.getSampleReport(merged).splitlines()
+        self.assertEqual(report[0], '4 samples')
+        self.assertEqual(report[2].split(), ['100.0', '25.0', 'main', '(a.py:1)'])
+        self.assertEqual(report[3].split(), ['75.0', '75.0', 'work', '(a.py:5)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
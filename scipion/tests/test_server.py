@@ -0,0 +1,88 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import unittest
+
+from scipion.tests.base import TestCase
+
+
+class TestServer(TestCase):
+    def test_zygote_server(self):
+
+        tmp = self.getTmpFolder()
+        socketPath = os.path.join(tmp, 'server.sock')
+        codeFile = os.path.join(tmp, 'code')
+        with open(codeFile, 'w') as f:
+            f.write('1')
+        calls = os.path.join(tmp, 'calls')  # A line each time the code key is read
+        env = self.getSubprocessEnviron(SCIPION_TEST_KEY='1')
+        server = subprocess.Popen(
+            [sys.executable, '-c', 'import sys; from scipion.server import ZygoteServer; '
+             'ZygoteServer(%r, lambda argv: print(*argv) or sys.exit(len(argv)), '
+             'lambda env: env.get("SCIPION_TEST_KEY"), '
+             'codeKey=lambda: open(%r, "a").write("\\n") and open(%r).read(), '
+             'codeFiles=[%r]).serve()' % (socketPath, calls, codeFile, codeFile)],
+            env=env, stdout=subprocess.DEVNULL)
+        try:
+            for _ in range(100):
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(socketPath)  # Listening, not only bound
+                    break
+                except OSError:
+                    time.sleep(0.1)
+                finally:
+                    probe.close()
+            client = ('from scipion.server import runInServer; '
+                      'runInServer(%r, ["a", "b"]); print("refused")' % socketPath)
+            # A client that does not send its request does not keep the others waiting
+            slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            slow.connect(socketPath)
+            self.addCleanup(slow.close)
+            start = time.time()
+            result = subprocess.run([sys.executable, '-c', client], env=env,
+                                    capture_output=True, text=True)
+            self.assertLess(time.time() - start, 5)
+            slow.close()
+            # The child of the server writes to the stdout of the client
+            self.assertEqual((result.returncode, result.stdout), (2, 'a b\n'))
+            # Other scipion variables, python path or interpreter are refused
+            otherPath = env['PYTHONPATH'] + os.pathsep + tmp
+            for clientEnv, prefix in [(dict(env, SCIPION_TEST_KEY='2'), ''),
+                                      (dict(env, PYTHONPATH=otherPath), ''),
+                                      (env, 'sys.executable = "/other/python"; ')]:
+                result = subprocess.run([sys.executable, '-c', 'import sys; ' + prefix + client],
+                                        env=clientEnv, capture_output=True, text=True)
+                self.assertEqual((result.returncode, result.stdout), (0, 'refused\n'))
+            self.assertIsNone(server.poll())
+
+            # The code key is only read again when the code files are modified
+            self._countLines(calls, 1)
+            os.utime(codeFile, ns=(1, 1))
+            result = subprocess.run([sys.executable, '-c', client], env=env,
+                                    capture_output=True, text=True)
+            self.assertEqual(result.returncode, 2)
+            self._countLines(calls, 2)
+
+            # The installed code changed: refused, and the server stops
+            with open(codeFile, 'w') as f:
+                f.write('2')
+            result = subprocess.run([sys.executable, '-c', client], env=env,
+                                    capture_output=True, text=True)
+            self.assertEqual((result.returncode, result.stdout), (0, 'refused\n'))
+            self.assertIn('server was stopped', result.stderr)
+            server.wait(10)
+        finally:
+            server.terminate()
+            server.wait()
+        self.assertFalse(os.path.exists(socketPath))
+
+    def _countLines(self, path, lines):
+        with open(path) as f:
+            self.assertEqual(len(f.readlines()), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
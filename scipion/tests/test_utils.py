@@ -0,0 +1,32 @@
+import os
+import unittest
+
+from scipion import utils
+from scipion.tests.base import TestCase
+
+
+class TestUtils(TestCase):
+    def test_vars_cache(self):
+
+        tmp = self.getTmpFolder()
+        config = os.path.join(tmp, 'scipion.conf')
+        with open(config, 'w') as f:
+            f.write('[PYWORKFLOW]\nSCIPION_USER_DATA = $HOME/data\n')
+        cacheFile = os.path.join(tmp, 'vars.json')
+        defaults = {'SCIPION_DOMAIN': 'pwem'}
+        environ = {'HOME': '/home/user', 'SCIPION_HOME': tmp, 'PWD': tmp}
+        varsDict = {'SCIPION_USER_DATA': '/home/user/data'}
+        utils.saveVarsCache(cacheFile, [config], defaults, environ, ['HOME'], varsDict)
+        self.assertEqual(utils.loadVarsCache(cacheFile, [config], defaults, environ), varsDict)
+        # Variables not used do not matter
+        self.assertEqual(utils.loadVarsCache(cacheFile, [config], defaults,
+                                             dict(environ, PWD='/')), varsDict)
+        for changedEnviron in [dict(environ, HOME='/root'), dict(environ, SCIPION_NEW='1')]:
+            self.assertIsNone(utils.loadVarsCache(cacheFile, [config], defaults, changedEnviron))
+        self.assertIsNone(utils.loadVarsCache(cacheFile, [config], {}, environ))
+        os.utime(config, ns=(0, 0))
+        self.assertIsNone(utils.loadVarsCache(cacheFile, [config], defaults, environ))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,10 +26,19 @@
 # *
 # **************************************************************************
 import sys
+import hashlib
+import json
+import os
 from os.path import join, dirname, exists, isdir
 from os import environ
 import importlib
 
+# Folder for the files cached by Scipion
+SCIPION_CACHE = 'SCIPION_CACHE'
+
+# Set it to 0 to read the config files every time scipion is launched
+SCIPION_VARS_CACHE = 'SCIPION_VARS_CACHE'
+
 
 def getScipionHome():
     home = environ.get("SCIPION_HOME", None)
@@ -71,3 +80,93 @@ def getModuleFolder(moduleName):
     """ Returns the path of a module without importing it"""
     spec = importlib.util.find_spec(moduleName)
     return dirname(spec.origin)
+
+
+def getCacheFolder():
+    """ Returns SCIPION_CACHE, or the scipion folder in the user cache """
+    folder = environ.get(SCIPION_CACHE)
+    if not folder:
+        folder = join(environ.get('XDG_CACHE_HOME') or '~/.cache', 'scipion')
+    return os.path.expanduser(folder)
+
+
+def getVarsCacheFile(configFiles):
+    """ Returns the file caching the variables of the launcher for the
+    given config files, or None if the cache is disabled """
+    if environ.get(SCIPION_VARS_CACHE, '1').lower() in ['0', 'false', 'off', 'no']:
+        return None
+    name = hashlib.sha256('\n'.join(configFiles).encode()).hexdigest()[:16]
+    return join(getCacheFolder(), 'vars-%s.json' % name)
+
+
+def _getFilesKey(files):
+    key = {}
+    for path in files:
+        try:
+            key[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            key[path] = None
+    return key
+
+
+def getEnvironKey(names, environ):
+    """ Values of the names given and of all the SCIPION_ variables """
+    names = set(names).union(n for n in environ if n.startswith('SCIPION_'))
+    return {name: environ.get(name) for name in sorted(names)}
+
+
+def loadVarsCache(cacheFile, files, defaults, environ):
+    """ Returns the variables cached in cacheFile, or None if any of the
+    files, the defaults or the environment variables they were computed
+    from changed.
+
+    :param files: paths of the files the variables are read from
+    :param defaults: dict with the initial values of the variables
+    :param environ: the environment scipion was launched with
+    """
+    try:
+        with open(cacheFile) as f:
+            cache = json.load(f)
+        if (cache['files'] == _getFilesKey(files) and cache['defaults'] == defaults
+                and cache['environ'] == getEnvironKey(cache['environ'], environ)):
+            return cache['vars']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def saveVarsCache(cacheFile, files, defaults, environ, names, varsDict):
+    """ Writes the variables computed from files, defaults and the
+    environment variables in names into cacheFile """
+    cache = {'files': _getFilesKey(files), 'defaults': defaults,
+             'environ': getEnvironKey(names, environ), 'vars': varsDict}
+    try:
+        os.makedirs(dirname(cacheFile), exist_ok=True)
+        tmp = '%s.%d.tmp' % (cacheFile, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, separators=(',', ':'))
+        os.replace(tmp, cacheFile)
+    except OSError:
+        pass
+
+
+def runPythonInProcess(args):
+    """ Runs python with args in this process, as the python command would.
+    Only for a script, -c or -m. Returns False for other arguments. """
+    import runpy
+
+    if len(args) > 1 and args[0] == '-c':
+        sys.argv = ['-c'] + args[2:]
+        sys.path.insert(0, '')
+        exec(compile(args[1], '<string>', 'exec'), {'__name__': '__main__'})
+    elif len(args) > 1 and args[0] == '-m':
+        sys.argv = list(args[1:])
+        sys.path.insert(0, os.getcwd())
+        runpy.run_module(args[1], run_name='__main__', alter_sys=True)
+    elif args and not args[0].startswith('-'):
+        sys.argv = list(args)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(args[0])))
+        runpy.run_path(args[0], run_name='__main__')
+    else:
+        return False
+    return True